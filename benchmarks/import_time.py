@@ -0,0 +1,107 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# import_time.py - Guards the cold-start time of the entry points.
+#
+# Usage: python benchmarks/import_time.py [--runs 9] [--update]
+#
+# Every module is imported in fresh interpreters, the median import time is compared with
+# import_time.json and the script exits with 1 if a module got more than TOLERANCE plus SLACK_MS
+# slower or loads a module it must not (Selenium for anything but the Selenium backend, numpy for the
+# one-shot commands). --update writes the measured times as the new baseline, run it on the
+# machine the numbers should hold for.
+
+import os
+import sys
+import json
+import statistics
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "import_time.json")
+TOLERANCE = 0.5  # Allowed slowdown relative to the baseline, a module pulling in a new dependency is well past it
+SLACK_MS = 20.0  # Absolute slack, so the fast imports do not fail on a busy machine
+
+# Module -> modules it must not load
+TARGETS = {
+    "heatautomation.cli": ("selenium", "numpy", "requests"),
+    "heatautomation.tibber": ("selenium", "numpy"),
+    "heatautomation.smhi": ("selenium", "numpy"),
+    "heatautomation.sensibo": ("selenium", "numpy"),
+    "heatautomation.kmp": ("selenium", "numpy"),
+    "heatautomation.main": ("selenium",),
+}
+
+PROBE = """
+import sys, json, time
+started = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - started
+print(json.dumps({{"ms": seconds * 1000, "loaded": [name for name in {forbidden!r} if name in sys.modules]}}))
+"""
+
+
+def measure(module, forbidden, runs):
+    """Returns the median import time in ms over fresh interpreters and the forbidden modules it loaded."""
+    times = []
+    loaded = set()
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE.format(module=module, forbidden=tuple(forbidden))],
+            cwd=ROOT, check=True, capture_output=True, text=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        times.append(result["ms"])
+        loaded.update(result["loaded"])
+    return statistics.median(times), sorted(loaded)  # The median ignores the odd run slowed by other processes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time benchmark for the heatautomation entry points.")
+    parser.add_argument("--runs", type=int, default=9, help="fresh interpreters per module")
+    parser.add_argument("--update", action="store_true", help="write the measured times as the new baseline")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    measured = {}
+    failed = False
+    for module, forbidden in TARGETS.items():
+        ms, loaded = measure(module, forbidden, args.runs)
+        measured[module] = round(ms, 1)
+        limit = baseline.get(module)
+        verdict = "ok"
+        if loaded:
+            verdict, failed = f"FAIL loads {', '.join(loaded)}", True
+        elif limit is not None and not args.update and ms > limit * (1 + TOLERANCE) + SLACK_MS:
+            verdict, failed = f"FAIL baseline {limit:.1f} ms", True
+        print(f"{module:<26} {ms:8.1f} ms  {verdict}")
+
+    if args.update:
+        with open(BASELINE_FILE, "w", encoding="utf-8") as f:
+            json.dump(measured, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline written to {BASELINE_FILE}")
+        return 0
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
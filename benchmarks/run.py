@@ -0,0 +1,330 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# run.py - Offline performance benchmarks for the control cycle and the decision engine.
+#
+# Usage: python benchmarks/run.py [--cycles 20] [--homes 1] [--delay-ms 0] [--selenium] [--update] [--output results.json]
+#
+# The control cycle runs against the local stub servers in stubs.py, no network is needed. The suite
+# measures:
+#   cycle.cold.*        a cycle after a restart, with empty caches and no logged in portal
+#   cycle.warm.*        the cycles after it, a quarter hour apart: only the short-lived Sensibo state
+#                       has expired, the rest is served from the caches like most quarter hours
+#   integration.*       the mean latency of every integration call, over all cycles
+#   memory.*            the peak RSS of this process, and of Chrome with --selenium
+#   throughput.*        the cost model, the planner and the backtest on synthetic data
+#   live.*              CPU per Tibber live sample and the cost of a rolling average, needs websocket-client
+#
+# The results are compared with baseline.json and the script exits with 1 on a regression larger
+# than the threshold of its group. --update writes the results as the new baseline, keeping the
+# thresholds. Run it on the machine the numbers should hold for, the committed baseline is from a
+# shared build machine and only catches gross regressions. The Selenium backend needs Chrome and
+# chromedriver, without --selenium the stove is driven through the HTTP backend.
+
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import logging
+import argparse
+import resource
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+BASELINE_FILE = os.path.join(BENCH_DIR, "baseline.json")
+DEFAULT_THRESHOLDS = {"cycle": 0.5, "integration": 1.0, "memory": 0.2, "throughput": 0.4, "live": 0.5}
+SLACK_MS = 2.0  # Absolute slack for latencies, so sub-millisecond numbers do not fail on noise
+
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+import stubs  # noqa: E402
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def _summary(values):
+    return {"p50_ms": _percentile(values, 0.5), "p90_ms": _percentile(values, 0.9), "max_ms": max(values)}
+
+
+def _configure(cache_dir, selenium):
+    """Points the package at a scratch cache directory. Must run before heatautomation is imported."""
+    os.environ.update({
+        "HEATAUTOMATION_CACHE_DIR": cache_dir,
+        "HEATAUTOMATION_HOMES": os.path.join(cache_dir, "homes.json"),
+        "METRICS_PORT": "0",
+        "KMP_BACKEND": "selenium" if selenium else "http",
+        "TIBBER_API_KEY": "benchmark",
+        "SENSIBO_API_KEY": "benchmark",
+    })
+
+
+def _homes(config, urls, count):
+    # All homes share the price area, every second one the forecast grid point
+    return [
+        config.Home(name=f"home{i}", price_area="SE3", sensibo_pods=[f"pod{i}"],
+                    kmp_username=f"user{i}", kmp_password="benchmark", kmp_url=urls["kmp"] + "/kmp/",
+                    lat=60.1333 + 0.1 * (i // 2), lon=15.2667)
+        for i in range(count)
+    ]
+
+
+def _reset(cache_dir):
+    """Forgets everything a restart forgets: the in-memory state, the cache files and the connections."""
+    from heatautomation import tibber, smhi, sensibo, kmp_http, devicestate, main, httppool, breaker, thermal, shadow
+    tibber._areas.clear()
+    smhi._forecasts.clear()
+    sensibo._pods.clear()
+    kmp_http._portals.clear()
+    devicestate._states.clear()
+    main._plans.clear()
+    main._last_good.clear()
+    main._available.clear()
+    main._setpoints.clear()
+    main._shifted.clear()
+    thermal._models.clear()
+    shadow._totals.clear()
+    breaker._breakers.clear()
+    httppool._sessions.clear()
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+def _quarter_hour_later():
+    """Expires what a quarter hour expires, the Sensibo state. Prices, forecast and portal are cached longer."""
+    from heatautomation import sensibo
+    for pod in sensibo._pods.values():
+        pod.state_time -= 900
+
+
+async def _run_cycles(homes, count, reset=None):
+    from heatautomation import main, metrics
+    times = []
+    for _ in range(count):
+        if reset:
+            reset()
+        deadline = datetime.now() + timedelta(minutes=15)
+        started = time.perf_counter()
+        with metrics.cycle():
+            cycle = await main.run_cycle(deadline, homes)
+        times.append((time.perf_counter() - started) * 1000)
+        failed = [name for name, inputs in cycle.items() if inputs is None]
+        if failed:
+            raise RuntimeError(f"The cycle failed for {', '.join(failed)}, check the stubs.")
+    return times
+
+
+def _integration_latency(before, after, hosts):
+    """Returns the mean latency per integration call between two metrics snapshots."""
+    result = {}
+    for key, values in after.items():
+        count = values["count"] - before.get(key, {}).get("count", 0)
+        if not count:
+            continue
+        seconds = values["seconds"] - before.get(key, {}).get("seconds", 0.0)
+        host, _, operation = key.rpartition(".")
+        name = f"{hosts[host]}.http_{operation}" if host in hosts else key  # The HTTP pool counts per host
+        result[f"integration.{name}.mean_ms"] = seconds / count * 1000
+    return result
+
+
+def bench_cycles(args, cache_dir):
+    from heatautomation import config, tibber, sensibo, smhi, metrics
+    results = {}
+    chrome_rss = []
+    with stubs.StubServers(delay=args.delay_ms / 1000) as servers:
+        tibber.URL = servers.urls["tibber"] + "/v1-beta/gql"
+        sensibo.URL = servers.urls["sensibo"] + "/api/v2/pods/{pod}/acStates"
+        smhi.FORECAST_URL = (servers.urls["smhi"]
+                             + "/api/category/pmp3g/version/2/geotype/point/lon/{lon}/lat/{lat}/data.json")
+        homes = _homes(config, servers.urls, args.homes)
+
+        before = metrics.snapshot()
+        cold = asyncio.run(_run_cycles(homes, max(3, args.cycles // 4), reset=lambda: _reset(cache_dir)))
+        warm = asyncio.run(_run_cycles(homes, args.cycles, reset=_quarter_hour_later))
+        after = metrics.snapshot()
+        requests = servers.requests()
+
+        if args.selenium:
+            from heatautomation import chromepool
+            with chromepool.session("kmp") as driver:
+                chrome_rss.append(chromepool.session_rss_mb(driver))
+            chromepool.shutdown()
+
+    for name, times in (("cold", cold), ("warm", warm)):
+        results.update({f"cycle.{name}.{key}": value for key, value in _summary(times).items()})
+    results.update(_integration_latency(before, after, servers.hosts))
+    if chrome_rss:
+        results["memory.chrome_rss_mb"] = max(chrome_rss)
+    logging.info(f"Requests served by the stubs: {requests}")
+    return results
+
+
+def _rate(func, items, repeat=5):
+    """Returns items per second of the median of repeat runs."""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+    return items / sorted(times)[repeat // 2]
+
+
+def bench_throughput():
+    import numpy as np
+    from heatautomation import costmodel, planner, backtest
+    rng = np.random.default_rng(2025)
+    results = {}
+
+    count = 1_000_000
+    prices = rng.gamma(2.0, 0.5, count)
+    temps = rng.normal(-2.0, 8.0, count)
+    results["throughput.decide_per_s"] = _rate(lambda: costmodel.DEFAULT.decide(prices, temps), count)
+
+    # A two-day horizon of quarter-hour prices with hourly temperatures, like get_plan() sees it
+    start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    slots = [(start + timedelta(minutes=15 * i), float(p)) for i, p in enumerate(prices[:192])]
+    forecast = [(start + timedelta(hours=i), float(t)) for i, t in enumerate(temps[:48])]
+    plans = 20
+    results["throughput.plans_per_s"] = _rate(
+        lambda: [planner.make_plan(slots, forecast) for _ in range(plans)], plans)
+
+    # One year of quarter hours
+    year = 365 * 96
+    times = start.timestamp() + 900.0 * np.arange(year)
+    rows = list(zip(times.tolist(), prices[:year].tolist(), temps[:year].tolist()))
+    results["throughput.backtest_slots_per_s"] = _rate(
+        lambda: backtest.run_backtest(iter(rows), "temperature"), year)
+    return results
+
+
+def bench_live(samples=3000, rate=1000.0):
+    from heatautomation import tibber_live
+    if not tibber_live.available():
+        logging.warning("websocket-client is not installed, skipping the live measurement benchmark.")
+        return {}
+    results = {}
+    with stubs.TibberLiveStub(rate=rate, count=samples) as server:
+        client = tibber_live.LiveClient("benchmark", "benchmark", url=server.url).start()
+        while not client.buffer.appended and server.connections < 2:
+            time.sleep(0.01)
+        # CPU of the client thread only, the stub runs in this process too
+        clock = time.pthread_getcpuclockid(client._thread.ident)
+        cpu, appended = time.clock_gettime(clock), client.buffer.appended
+        while server.sent < samples:
+            time.sleep(0.05)
+        time.sleep(0.1)
+        cpu, appended = time.clock_gettime(clock) - cpu, client.buffer.appended - appended
+        client.stop()
+    results["live.client_cpu_us_per_sample"] = cpu / max(appended, 1) * 1e6
+
+    buffer = client.buffer
+    now = buffer.latest()[0]
+    count = 10_000
+    started = time.perf_counter()
+    for _ in range(count):
+        buffer.mean(60, now)
+    results["live.mean_us"] = (time.perf_counter() - started) / count * 1e6
+    return results
+
+
+def _group(key):
+    return key.split(".", 1)[0]
+
+
+def compare(results, baseline):
+    """Returns the regressions of results against a baseline as a list of messages."""
+    thresholds = dict(DEFAULT_THRESHOLDS, **baseline.get("thresholds", {}))
+    regressions = []
+    for key, expected in sorted(baseline.get("results", {}).items()):
+        value = results.get(key)
+        if value is None or expected is None:
+            continue
+        tolerance = thresholds[_group(key)]
+        if key.endswith("_per_s"):
+            if value < expected * (1 - tolerance):
+                regressions.append(f"{key}: {value:.4g} < {expected:.4g} -{tolerance:.0%}")
+        else:
+            slack = SLACK_MS if key.endswith("_ms") else 0.0
+            if value > expected * (1 + tolerance) + slack:
+                regressions.append(f"{key}: {value:.4g} > {expected:.4g} +{tolerance:.0%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for heatautomation.")
+    parser.add_argument("--cycles", type=int, default=20, help="warm control cycles to run")
+    parser.add_argument("--homes", type=int, default=1, help="homes controlled in every cycle")
+    parser.add_argument("--delay-ms", type=float, default=0.0, help="delay the stubs add to every request")
+    parser.add_argument("--selenium", action="store_true", help="drive the stove portal with Chrome")
+    parser.add_argument("--update", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="show the log of the control cycles")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s - %(levelname)s - %(message)s")
+
+    cache_dir = tempfile.mkdtemp(prefix="heatautomation-bench-")
+    try:
+        _configure(cache_dir, args.selenium)
+        results = bench_cycles(args, cache_dir)
+        results.update(bench_throughput())
+        results.update(bench_live())
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    results["memory.peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    for key, value in sorted(results.items()):
+        expected = baseline.get("results", {}).get(key)
+        reference = f"  (baseline {expected:.4g})" if expected is not None else ""
+        print(f"{key:<48} {value:12.4g}{reference}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.update:
+        baseline = {
+            "thresholds": baseline.get("thresholds", DEFAULT_THRESHOLDS),
+            "options": {"cycles": args.cycles, "homes": args.homes, "delay_ms": args.delay_ms, "selenium": args.selenium},
+            "results": {key: round(value, 4) for key, value in sorted(results.items())},
+        }
+        with open(BASELINE_FILE, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2)
+            f.write("\n")
+        print(f"Baseline written to {BASELINE_FILE}")
+        return 0
+
+    regressions = compare(results, baseline)
+    for message in regressions:
+        print(f"REGRESSION {message}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
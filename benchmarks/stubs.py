@@ -0,0 +1,356 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# stubs.py - Local HTTP servers that stand in for Tibber, Sensibo, SMHI and the KMP portal.
+#
+# Every integration gets its own server on 127.0.0.1, so the per-host latency counters keep them
+# apart. The responses are the files in fixtures/, with their timestamps moved to the current day
+# so the prices and the forecast cover "now". Each server can add a fixed delay per request to
+# imitate the network. TibberLiveStub is a websocket server for the live measurement stream.
+
+import os
+import json
+import time
+import base64
+import socket
+import struct
+import hashlib
+import threading
+import socketserver
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+class Stub:
+    """One stubbed service. route() returns (status, headers, body) for a request."""
+
+    name = None
+
+    def __init__(self, delay=0.0):
+        self.delay = delay  # Seconds added to every request
+        self.requests = 0
+
+    def route(self, method, path, query, headers, body):
+        raise NotImplementedError
+
+
+class TibberStub(Stub):
+    name = "tibber"
+
+    def __init__(self, delay=0.0):
+        super().__init__(delay)
+        data = json.loads(fixture("tibber_prices.json"))
+        price_info = data["data"]["viewer"]["homes"][0]["currentSubscription"]["priceInfo"]
+        # Move the recorded days to today and tomorrow, keeping the recorded time zone
+        recorded = _parse_time(price_info["today"][0]["startsAt"])
+        shift = datetime.now(recorded.tzinfo).date() - recorded.date()
+        for slot in price_info["today"] + price_info["tomorrow"]:
+            slot["startsAt"] = (_parse_time(slot["startsAt"]) + shift).isoformat(timespec="milliseconds")
+        self.home = data["data"]["viewer"]["homes"][0]
+
+    def route(self, method, path, query, headers, body):
+        if method != "POST" or path != "/v1-beta/gql":
+            return 404, {}, b""
+        if not headers.get("Authorization", "").startswith("Bearer "):
+            return 401, {}, b'{"errors": [{"message": "Unauthorized"}]}'
+        request = json.loads(body or b"{}")
+        viewer = {"home": self.home} if request.get("variables", {}).get("id") else {"homes": [self.home]}
+        return 200, {"Content-Type": "application/json"}, json.dumps({"data": {"viewer": viewer}}).encode()
+
+
+class SensiboStub(Stub):
+    name = "sensibo"
+
+    def __init__(self, delay=0.0):
+        super().__init__(delay)
+        self.recorded = json.loads(fixture("sensibo_acstates.json"))
+        self.states = {}  # Pod -> acState
+        self.missing = set()  # Pods that answer 404, like one removed from the account
+        self.lock = threading.Lock()
+
+    def route(self, method, path, query, headers, body):
+        parts = path.strip("/").split("/")
+        if len(parts) != 5 or parts[:3] != ["api", "v2", "pods"] or parts[4] != "acStates":
+            return 404, {}, b""
+        if not query.get("apiKey"):
+            return 401, {}, b'{"status": "failed", "reason": "missing apiKey"}'
+        pod = parts[3]
+        if pod in self.missing:
+            return 404, {}, b'{"status": "failed", "reason": "no such pod"}'
+        with self.lock:
+            state = self.states.setdefault(pod, dict(self.recorded["result"][0]["acState"]))
+            if method == "POST":
+                state.update(json.loads(body)["acState"])
+                response = {"status": "success", "result": {"status": "Success", "acState": dict(state)}}
+            else:
+                result = dict(self.recorded["result"][0], acState=dict(state))
+                response = dict(self.recorded, result=[result])
+        return 200, {"Content-Type": "application/json"}, json.dumps(response).encode()
+
+
+class SmhiStub(Stub):
+    name = "smhi"
+
+    def __init__(self, delay=0.0):
+        super().__init__(delay)
+        data = json.loads(fixture("smhi_forecast.json"))
+        # The first forecast point becomes the next whole hour
+        first = _parse_time(data["timeSeries"][0]["validTime"])
+        shift = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0) + timedelta(hours=1) - first
+        for key in ("approvedTime", "referenceTime"):
+            data[key] = (_parse_time(data[key]) + shift).strftime("%Y-%m-%dT%H:%M:%SZ")
+        for point in data["timeSeries"]:
+            point["validTime"] = (_parse_time(point["validTime"]) + shift).strftime("%Y-%m-%dT%H:%M:%SZ")
+        self.body = json.dumps(data).encode()
+        self.etag = '"' + hashlib.sha1(self.body).hexdigest() + '"'
+        self.not_modified = 0  # Revalidations answered with 304
+
+    def route(self, method, path, query, headers, body):
+        if method != "GET" or not path.startswith("/api/category/pmp3g/") or not path.endswith("/data.json"):
+            return 404, {}, b""
+        if headers.get("If-None-Match") == self.etag:
+            self.not_modified += 1
+            return 304, {"ETag": self.etag}, b""
+        return 200, {"Content-Type": "application/json", "ETag": self.etag}, self.body
+
+
+class KmpStub(Stub):
+    name = "kmp"
+    COOKIE = "KMPSESSION=bench"
+    MODES = {False: ("AV", "22", "0", "start"), True: ("UPPVÄRMNING", "148", "60", "stop")}
+
+    def __init__(self, delay=0.0, settle=0.0):
+        super().__init__(delay)
+        self.login_page = fixture("kmp_login.html").encode()
+        self.stove_page = fixture("kmp_stove.html")
+        self.on = False
+        self.cookie = self.COOKIE  # The session cookie the portal accepts
+        self.logins = []  # Forms of the accepted logins
+        self.presses = []  # Forms posted with the power button
+        self.password = None  # The only password accepted when set
+        self.settle = settle  # Seconds before a press of the power button shows in the mode
+        self.switch_at = None  # When the pending press takes effect
+        self.lock = threading.Lock()
+
+    def _stove(self):
+        with self.lock:
+            if self.switch_at is not None and time.monotonic() >= self.switch_at:
+                self.on = not self.on
+                self.switch_at = None
+        mode, flue, power, button = self.MODES[self.on]
+        return self.stove_page.format(mode=mode, flue=flue, power=power, button=button).encode()
+
+    def expire(self):
+        """Drops the logged in sessions, like the portal does after a while."""
+        with self.lock:
+            self.cookie = f"{self.COOKIE}{len(self.logins)}"
+
+    def route(self, method, path, query, headers, body):
+        html = {"Content-Type": "text/html; charset=utf-8"}
+        logged_in = self.cookie in headers.get("Cookie", "").split("; ")
+        if path == "/kmp/login" and method == "POST":
+            form = parse_qs(body.decode())
+            if not form.get("user") or not form.get("pass") or self.password not in (None, form["pass"][0]):
+                return 200, html, self.login_page
+            self.logins.append(form)
+            return 302, {"Location": "/kmp/stove", "Set-Cookie": f"{self.cookie}; Path=/kmp"}, b""
+        if path == "/kmp/stove" and logged_in:
+            form = parse_qs(body.decode())
+            if method == "POST" and "startbild.x" in form:
+                with self.lock:
+                    self.presses.append(form)
+                    if self.switch_at is None:
+                        self.switch_at = time.monotonic() + self.settle
+            return 200, html, self._stove()
+        if path in ("/kmp/", "/kmp/stove"):
+            return 200, html, self.login_page
+        return 404, {}, b""
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real services
+    disable_nagle_algorithm = True  # Headers and body go out in separate writes, do not wait for delayed ACKs
+
+    def _handle(self, method):
+        stub = self.server.stub
+        url = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if stub.delay:
+            time.sleep(stub.delay)
+        stub.requests += 1
+        status, headers, payload = stub.route(method, url.path, query, self.headers, body)
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TibberLiveStub(socketserver.ThreadingTCPServer):
+    """
+    A websocket server speaking enough of graphql-transport-ws to stand in for Tibber's live
+    measurements: it acknowledges connection_init and answers a subscribe with rate samples per
+    second until count samples are sent, then stays idle until the client closes. drop_after drops
+    the first connection after that many samples, to exercise reconnects.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+    GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+    def __init__(self, rate=10.0, count=None, drop_after=None):
+        super().__init__(("127.0.0.1", 0), _LiveHandler)
+        self.rate = rate
+        self.count = count
+        self.drop_after = drop_after
+        self.connections = 0
+        self.sent = 0
+        self.url = f"ws://127.0.0.1:{self.server_address[1]}/v1-beta/gql/subscriptions"
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, name="stub-tibber-live", daemon=True).start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
+        self.server_close()
+        return False
+
+
+def _send_frame(connection, text):
+    payload = text.encode()
+    if len(payload) < 126:
+        header = struct.pack("!BB", 0x81, len(payload))
+    elif len(payload) < 65536:
+        header = struct.pack("!BBH", 0x81, 126, len(payload))
+    else:
+        header = struct.pack("!BBQ", 0x81, 127, len(payload))
+    connection.sendall(header + payload)
+
+
+def _read_frame(stream):
+    """Returns the text of the next client frame, or None when the client closes."""
+    head = stream.read(2)
+    if len(head) < 2:
+        return None
+    opcode, length = head[0] & 0x0F, head[1] & 0x7F
+    if length == 126:
+        length = struct.unpack("!H", stream.read(2))[0]
+    elif length == 127:
+        length = struct.unpack("!Q", stream.read(8))[0]
+    mask = stream.read(4) if head[1] & 0x80 else b"\0\0\0\0"
+    payload = bytes(b ^ mask[i % 4] for i, b in enumerate(stream.read(length)))
+    return None if opcode == 0x8 else payload.decode()
+
+
+class _LiveHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        server = self.server
+        headers = {}
+        self.rfile.readline()  # Request line
+        for line in iter(self.rfile.readline, b"\r\n"):
+            key, _, value = line.decode().partition(":")
+            headers[key.strip().lower()] = value.strip()
+        accept = base64.b64encode(hashlib.sha1((headers["sec-websocket-key"] + server.GUID).encode()).digest()).decode()
+        self.wfile.write((
+            "HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\nSec-WebSocket-Protocol: graphql-transport-ws\r\n\r\n").encode())
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        server.connections += 1
+        connection = server.connections
+
+        if json.loads(_read_frame(self.rfile) or "{}").get("type") != "connection_init":
+            return
+        _send_frame(self.request, '{"type": "connection_ack"}')
+        subscribe = json.loads(_read_frame(self.rfile) or "{}")
+        if subscribe.get("type") != "subscribe":
+            return
+
+        interval = 1.0 / server.rate
+        sent = 0
+        next_time = time.perf_counter()
+        try:
+            while server.count is None or server.sent < server.count:
+                if server.drop_after and connection == 1 and sent >= server.drop_after:
+                    return  # Drop the first connection without a close frame
+                power = 1500 + 500 * ((server.sent // 50) % 2)
+                _send_frame(self.request, json.dumps({"id": subscribe["id"], "type": "next", "payload": {
+                    "data": {"liveMeasurement": {"timestamp": datetime.now(timezone.utc).isoformat(), "power": power}}}}))
+                sent += 1
+                server.sent += 1
+                next_time += interval
+                delay = next_time - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            while _read_frame(self.rfile) is not None:
+                pass
+        except OSError:
+            pass  # The client went away
+
+
+class StubServers:
+    """Starts one stub server per integration. Use as a context manager."""
+
+    def __init__(self, delay=0.0):
+        self.stubs = [TibberStub(delay), SensiboStub(delay), SmhiStub(delay), KmpStub(delay)]
+        self.servers = []
+        self.urls = {}  # Integration -> base URL
+        self.hosts = {}  # host:port -> integration
+
+    def __enter__(self):
+        for stub in self.stubs:
+            server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+            server.daemon_threads = True
+            server.stub = stub
+            threading.Thread(target=server.serve_forever, name=f"stub-{stub.name}", daemon=True).start()
+            host = f"127.0.0.1:{server.server_address[1]}"
+            self.servers.append(server)
+            self.urls[stub.name] = f"http://{host}"
+            self.hosts[host] = stub.name
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        return False
+
+    def requests(self):
+        return {stub.name: stub.requests for stub in self.stubs}
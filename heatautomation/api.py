@@ -0,0 +1,264 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# module: api.py – Local status and control API of the running controller.
+#
+# GET /status and /status/<home> answer from what the controller already holds in memory: the
+# inputs and decision of the last cycle, the confirmed device states, the cached pod states and
+# the live power, each with the Unix time it was fetched or confirmed. A request never reaches
+# Tibber, SMHI, Sensibo or the stove portal, so dashboards can poll it as often as they like.
+#
+# POST /override with {"home": "hagge", "heater": "pelletstove", "minutes": 120} queues a heat
+# source that overrides the controller's decision until it expires, "auto" hands control back.
+# The control loop is woken and applies it with its next cycle of that home.
+
+import os
+import json
+import time
+import logging
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from . import cache
+from . import smhi
+from . import tibber
+from . import tibber_live
+from . import sensibo
+from . import breaker
+from . import devicestate
+
+API_HOST = os.getenv("HEATAUTOMATION_API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("HEATAUTOMATION_API_PORT", "9751"))  # 0 turns the API off
+OVERRIDES_FILE = "overrides.json"
+OVERRIDE_MINUTES = 60  # Length of an override that does not say
+MAX_OVERRIDE_MINUTES = 7 * 24 * 60
+
+_homes = {}  # Home name -> Home, the homes the controller runs
+_status = {}  # Home name -> what the last cycle published
+_overrides = {}  # Home name -> {"heater", "until", "queued", "applied"}, "heater" None hands back control
+_wake = None  # Called from the server thread when an override is queued
+_lock = threading.Lock()
+
+
+def _age(at, now):
+    return round(now - at, 1) if at is not None else None
+
+
+def _save_overrides():
+    cache.save(OVERRIDES_FILE, _overrides)
+
+
+def publish(home, inputs, next_cycle, reason):
+    """Records the outcome of a cycle of a home. inputs is what run_home returned, None if the cycle failed."""
+    with _lock:
+        status = _status.setdefault(home.name, {})
+        status["cycle"] = {"at": time.time(), "ok": inputs is not None}
+        if inputs is not None:
+            status["inputs"] = dict(inputs)
+        status["next_cycle"] = {"at": next_cycle.timestamp(), "reason": reason}
+
+
+def _breakers(home):
+    # The breakers the home's calls go through, sensibo has one per pod
+    return {
+        "tibber": breaker.get(breaker.key("tibber", home.price_area)).state,
+        "smhi": breaker.get("smhi").state,
+        "sensibo": {pod: breaker.get(breaker.key("sensibo", pod)).state for pod in home.sensibo_pods},
+        "kmp": breaker.get(breaker.key("kmp", home.name)).state,
+    }
+
+
+def status(home):
+    """Returns the status of a home, built from memory only."""
+    now = time.time()
+    with _lock:
+        published = dict(_status.get(home.name, {}))
+        override = dict(_overrides[home.name]) if home.name in _overrides else None
+    inputs = published.get("inputs", {})
+    cycle = published.get("cycle")
+
+    devices = {}
+    for device, record in devicestate.observed(home).items():
+        devices[device] = {"on": record["on"], "confirmed": record["at"], "age_s": _age(record["at"], now)}
+    pods = {}
+    for pod in home.sensibo_pods:
+        state, read = sensibo.cached_status(home, pod)
+        pods[pod] = dict(state or {}, read=read, age_s=_age(read, now))
+    latest = tibber_live.latest_power(home)
+    price_at, temperature_at = tibber.last_update(home) or None, smhi.last_update(home)
+
+    return {
+        "home": home.name,
+        "time": now,
+        "cycle": dict(cycle, age_s=_age(cycle["at"], now)) if cycle else None,
+        "next_cycle": published.get("next_cycle"),
+        "price": {"value": inputs.get("price"), "fetched": price_at, "age_s": _age(price_at, now)},
+        "temperature": {"value": inputs.get("temperature"), "fetched": temperature_at,
+                        "age_s": _age(temperature_at, now)},
+        "decision": inputs.get("decision"),
+        "overridden": inputs.get("overridden", False),
+        "heater": devicestate.current_heater(home),
+        "setpoint": inputs.get("setpoint"),
+        "strategies": inputs.get("strategies"),
+        "devices": devices,
+        "pods": pods,
+        "power": {"value": latest[1], "at": latest[0], "age_s": _age(latest[0], now)} if latest else None,
+        "override": override,
+        "breakers": _breakers(home),
+    }
+
+
+def queue_override(name, heater, minutes=None):
+    """
+    Queues an override of the heat source of a home, "auto" cancels it. Returns the queued override.
+    Raises KeyError for an unknown home and ValueError for an unknown heat source or length.
+    """
+    if name not in _homes:
+        raise KeyError(name)
+    if heater != "auto" and heater not in devicestate.HEATER_STATES:
+        raise ValueError(f"Unknown heat source {heater!r}, expected auto or one of {', '.join(devicestate.HEATER_STATES)}.")
+    minutes = OVERRIDE_MINUTES if minutes is None else float(minutes)
+    if not 0 < minutes <= MAX_OVERRIDE_MINUTES:
+        raise ValueError(f"An override lasts between 0 and {MAX_OVERRIDE_MINUTES} minutes.")
+    now = time.time()
+    override = {"heater": None if heater == "auto" else heater, "until": now + minutes * 60,
+                "queued": now, "applied": None}
+    with _lock:
+        _overrides[name] = override
+        _save_overrides()
+        wake = _wake
+    logging.info(f"Queued override of {name}: {heater} for {minutes:g} minutes.")
+    if wake is not None:
+        wake()
+    return dict(override)
+
+
+def queued():
+    """Returns the names of the homes with an override the control loop has not applied yet."""
+    with _lock:
+        return [name for name, override in _overrides.items() if override["applied"] is None]
+
+
+def override(home, now=None):
+    """
+    Returns the heat source an override forces on a home now, or None if the controller decides.
+    Marks a queued override as applied and drops expired ones.
+    """
+    now = time.time() if now is None else now
+    with _lock:
+        override = _overrides.get(home.name)
+        if override is None:
+            return None
+        if override["heater"] is None or override["until"] <= now:
+            if override["heater"] is not None:
+                logging.info(f"Override of {home.name} to {override['heater']} has expired.")
+            del _overrides[home.name]
+            _save_overrides()
+            return None
+        if override["applied"] is None:
+            override["applied"] = now
+            _save_overrides()
+        return override["heater"]
+
+
+def override_until(home):
+    """Returns the Unix time the active override of a home ends, or None."""
+    with _lock:
+        override = _overrides.get(home.name)
+        return override["until"] if override is not None and override["heater"] is not None else None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def _send(self, code, data):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0].rstrip("/")
+        if path == "/status":
+            self._send(200, {"homes": {name: status(home) for name, home in _homes.items()}})
+        elif path.startswith("/status/") and path[len("/status/"):] in _homes:
+            self._send(200, status(_homes[path[len("/status/"):]]))
+        else:
+            self._send(404, {"error": "Not found"})
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/override":
+            self._send(404, {"error": "Not found"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+            name = request.get("home") or next(iter(_homes))
+            override = queue_override(name, request.get("heater"), request.get("minutes"))
+        except KeyError as e:
+            self._send(404, {"error": f"Unknown home {e}"})
+        except (ValueError, TypeError, AttributeError) as e:
+            self._send(400, {"error": str(e)})
+        else:
+            self._send(202, dict(override, home=name))
+
+    def log_message(self, format, *args):
+        pass  # Dashboards poll every few seconds, that would flood the log
+
+
+def serve(homes, wake=None, host=API_HOST, port=API_PORT):
+    """
+    Starts the API for the homes in a background thread. wake is called from that thread when an
+    override is queued. Returns the server, or None if it is turned off.
+    """
+    global _wake
+    with _lock:
+        _homes.update((home.name, home) for home in homes)
+        _overrides.update((name, override) for name, override in (cache.load(OVERRIDES_FILE) or {}).items()
+                          if name in _homes)
+        _wake = wake
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _Handler)
+    except OSError as e:
+        logging.error(f"Could not start the API on {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="api", daemon=True).start()
+    logging.info(f"Serving the status API on http://{host}:{server.server_address[1]}/status")
+    return server
+
+
+def request(path, data=None, host=API_HOST, port=API_PORT, timeout=5):
+    """
+    Asks the API of a running controller, posting data as JSON if given. Returns the decoded answer,
+    or None if no controller is listening. Raises ValueError with the message of a rejected request.
+    """
+    body = json.dumps(data).encode() if data is not None else None
+    try:
+        with urllib.request.urlopen(urllib.request.Request(
+                f"http://{host}:{port}{path}", data=body, headers={"Content-Type": "application/json"}),
+                timeout=timeout) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        try:
+            message = json.load(e).get("error")
+        except ValueError:
+            message = e.reason
+        raise ValueError(message) from None
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,257 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# module: backtest.py – Replays historical prices and temperatures through the heating decision logic.
+#
+# Usage: python -m heatautomation.backtest prices.csv temperatures.csv [--strategy temperature] [--chunk 4096]
+#
+# Both files have a timestamp in the first column and a value in the second, as CSV with a header
+# row or as Parquet (needs pyarrow). The price slots drive a simulated clock: every slot is one
+# decision, the temperature is the latest one at or before it, and nothing sleeps.
+
+import csv
+import time
+import argparse
+import logging
+from datetime import datetime, timezone
+import numpy as np
+from . import costmodel
+from . import planner
+
+CHUNK = 4096  # Slots evaluated per call into the cost model
+MAX_SLOT = 3600.0  # Seconds, longer gaps in the price data count as one hour
+LATENCY_BUCKETS = 64  # Powers of two in nanoseconds
+
+
+def _to_epoch(value):
+    if isinstance(value, datetime):
+        ts = value
+    else:
+        ts = datetime.fromisoformat(str(value).strip().replace("Z", "+00:00"))
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.timestamp()
+
+
+def _read_csv(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        next(reader, None)  # Header
+        for row in reader:
+            if len(row) >= 2 and row[1].strip():
+                yield _to_epoch(row[0]), float(row[1])
+
+
+def _read_parquet(path):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("Reading Parquet files needs pyarrow, install it with 'pip install pyarrow'.")
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=CHUNK):
+        for ts, value in zip(batch.column(0).to_pylist(), batch.column(1).to_pylist()):
+            if value is not None:
+                yield _to_epoch(ts), float(value)
+
+
+def read_series(path):
+    """Yields (Unix time, value) rows from a CSV or Parquet file without loading it all."""
+    return _read_parquet(path) if path.endswith((".parquet", ".pq")) else _read_csv(path)
+
+
+def merge(prices, temperatures):
+    """Yields (time, price, temperature) for every price slot, with the latest temperature at or before it."""
+    temperatures = iter(temperatures)
+    current = None
+    upcoming = next(temperatures, None)
+    for ts, price in prices:
+        while upcoming is not None and upcoming[0] <= ts:
+            current = upcoming
+            upcoming = next(temperatures, None)
+        temp = current if current is not None else upcoming
+        if temp is None:
+            continue  # No temperatures at all
+        yield ts, price, temp[1]
+
+
+def chunks(rows, size=CHUNK):
+    """Groups rows into arrays of (times, prices, temperatures)."""
+    buffer = np.empty((size, 3))
+    count = 0
+    for row in rows:
+        buffer[count] = row
+        count += 1
+        if count == size:
+            yield buffer[:, 0].copy(), buffer[:, 1].copy(), buffer[:, 2].copy()
+            count = 0
+    if count:
+        yield buffer[:count, 0].copy(), buffer[:count, 1].copy(), buffer[:count, 2].copy()
+
+
+# Strategies take the chunk arrays and the mode in use before the chunk and return decision codes
+
+def price_strategy(model, prices, temps, hours, previous):
+    """evaluate_heater: spot price against the pellet price only."""
+    return model.decide(prices, max_price_threshold=costmodel.PELLET_PRICE)
+
+
+def temperature_strategy(model, prices, temps, hours, previous):
+    """evaluate_heater_with_temperature."""
+    return model.decide(prices, temps)
+
+
+def optimize_strategy(model, prices, temps, hours, previous):
+    """optimize_heating_system: the temperature rule, vetoed when heating at full capacity costs too much."""
+    decisions = model.decide(prices, temps)
+    cost = model.energy_cost(prices, model.capacity(temps), model.scop)
+    too_expensive = cost > model.pellet_price - model.price_adjustment
+    decisions[too_expensive] = costmodel.PELLETSTOVE
+    return decisions
+
+
+def plan_strategy(model, prices, temps, hours, previous):
+    """The look-ahead planner, planning one day at a time like with day-ahead prices."""
+    slot_costs = model.slot_costs(prices, temps, hours)
+    slot = float(np.median(hours)) * 3600
+    min_run = max(1, int(-(-planner.STOVE_MIN_RUN.total_seconds() // slot)))
+    window = max(1, int(round(86400 / slot)))
+    decisions = np.empty(len(prices), dtype=np.int8)
+    for start in range(0, len(prices), window):
+        costs = {mode: slot_costs[i, start:start + window].tolist() for i, mode in enumerate(costmodel.MODES)}
+        previous_mode = costmodel.MODES[previous] if previous is not None else None
+        modes, _ = planner.optimize(costs, min_run, previous_mode)
+        decisions[start:start + len(modes)] = [costmodel.MODES.index(mode) for mode in modes]
+        previous = decisions[start + len(modes) - 1]
+    return decisions
+
+
+STRATEGIES = {
+    "price": price_strategy,
+    "temperature": temperature_strategy,
+    "optimize": optimize_strategy,
+    "plan": plan_strategy,
+}
+
+
+def _percentile(histogram, fraction):
+    """Returns the upper bound in ns of the bucket holding the given fraction of the decisions."""
+    target = fraction * histogram.sum()
+    bucket = int(np.searchsorted(np.cumsum(histogram), target))
+    return 2.0 ** bucket
+
+
+def run_backtest(rows, strategy="temperature", model=costmodel.DEFAULT, chunk=CHUNK):
+    """
+    Runs a strategy over (time, price, temperature) rows chunk by chunk, so memory stays bounded.
+    Returns a dict with the total cost, the number of switches, the decisions per mode and the
+    decision latency percentiles.
+    """
+    decide = STRATEGIES[strategy]
+    total_cost = 0.0
+    switches = 0
+    slots = 0
+    per_mode = np.zeros(len(costmodel.MODES), dtype=np.int64)
+    latency = np.zeros(LATENCY_BUCKETS, dtype=np.int64)  # Decisions per power-of-two bucket of ns/decision
+    previous = None
+    pending = None  # Last row of the previous chunk, its slot length needs the next row
+    first_ts = last_ts = None
+
+    for times, prices, temps in chunks(rows, chunk):
+        if pending is not None:
+            times, prices, temps = (np.concatenate(([p], a)) for p, a in zip(pending, (times, prices, temps)))
+        pending = (times[-1], prices[-1], temps[-1])
+        if len(times) < 2:
+            continue
+        if first_ts is None:
+            first_ts = times[0]
+        last_ts = times[-2]
+        # Slot i lasts until row i + 1, the last row waits for the next chunk
+        hours = np.minimum(np.diff(times), MAX_SLOT) / 3600
+        total_cost, switches, previous = _evaluate(decide, model, prices[:-1], temps[:-1], hours, previous,
+                                                   total_cost, switches, per_mode, latency)
+        slots += len(hours)
+
+    if pending is not None:
+        # The very last slot is as long as the one before it
+        hours = np.array([hours[-1] if slots else 1.0])
+        total_cost, switches, previous = _evaluate(decide, model, np.array([pending[1]]), np.array([pending[2]]),
+                                                   hours, previous, total_cost, switches, per_mode, latency)
+        slots += 1
+        last_ts = pending[0]
+        first_ts = first_ts if first_ts is not None else pending[0]
+
+    return {
+        "strategy": strategy,
+        "slots": slots,
+        "start": datetime.fromtimestamp(first_ts, timezone.utc).isoformat() if slots else None,
+        "end": datetime.fromtimestamp(last_ts, timezone.utc).isoformat() if slots else None,
+        "total_cost": total_cost,
+        "switches": switches,
+        "decisions": {mode: int(count) for mode, count in zip(costmodel.MODES, per_mode)},
+        "latency_ns": {
+            "p50": _percentile(latency, 0.50) if slots else None,
+            "p90": _percentile(latency, 0.90) if slots else None,
+            "p99": _percentile(latency, 0.99) if slots else None,
+        },
+    }
+
+
+def _evaluate(decide, model, prices, temps, hours, previous, total_cost, switches, per_mode, latency):
+    started = time.perf_counter_ns()
+    decisions = decide(model, prices, temps, hours, previous)
+    elapsed = time.perf_counter_ns() - started
+    bucket = min(int(elapsed / len(decisions)).bit_length(), LATENCY_BUCKETS - 1)
+    latency[bucket] += len(decisions)
+
+    costs = np.choose(decisions, model.slot_costs(prices, temps, hours))
+    # A slot the chosen source cannot cover, e.g. off while heating is needed, is paid for with pellets
+    costs = np.where(np.isinf(costs), model.heat_demand(temps, hours) * model.pellet_cost, costs)
+    total_cost += float(costs.sum())
+    switches += int(np.count_nonzero(decisions[1:] != decisions[:-1]))
+    if previous is not None and decisions[0] != previous:
+        switches += 1
+    per_mode += np.bincount(decisions, minlength=len(costmodel.MODES))
+    return total_cost, switches, int(decisions[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay historical prices and temperatures through the heating decision logic.")
+    parser.add_argument("prices", help="CSV or Parquet file with timestamp and spot price (SEK/kWh)")
+    parser.add_argument("temperatures", help="CSV or Parquet file with timestamp and outdoor temperature (°C)")
+    parser.add_argument("--strategy", choices=sorted(STRATEGIES), default="temperature")
+    parser.add_argument("--chunk", type=int, default=CHUNK, help="slots evaluated at a time")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    rows = merge(read_series(args.prices), read_series(args.temperatures))
+    result = run_backtest(rows, args.strategy, chunk=args.chunk)
+    elapsed = time.perf_counter() - started
+
+    if not result["slots"]:
+        logging.error("No price slots to replay.")
+        return
+    print(f"Strategy:      {result['strategy']}")
+    print(f"Period:        {result['start']} – {result['end']} ({result['slots']} slots)")
+    print(f"Total cost:    {result['total_cost']:.2f} SEK")
+    print(f"Switches:      {result['switches']}")
+    print("Decisions:     " + ", ".join(f"{mode} {count}" for mode, count in result["decisions"].items()))
+    latency = result["latency_ns"]
+    print(f"Decision time: p50 < {latency['p50']:.0f} ns, p90 < {latency['p90']:.0f} ns, p99 < {latency['p99']:.0f} ns")
+    print(f"Replayed in {elapsed:.2f} s.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    main()
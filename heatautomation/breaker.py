@@ -0,0 +1,155 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# module: breaker.py – Circuit breakers that stop calling an integration that keeps failing.
+#
+# Every external source has a breaker per account it is called with: per price area for tibber, per
+# pod for sensibo and per home for kmp, so one home's wrong password does not cut off the others.
+# smhi is one public API with one breaker. After FAILURE_THRESHOLD failures in a row a breaker opens and calls are refused without touching the network, so the callers fall back to
+# their cached data at no cost. After RESET_TIMEOUT one call is let through as a probe (half-open):
+# if it succeeds the breaker closes, if it fails it opens again for twice as long, up to MAX_RESET_TIMEOUT.
+#
+#     with breaker.guard("smhi"):
+#         forecast = _fetch(point, previous)
+#
+# guard() raises CircuitOpen when the call is refused and counts an exception from the block as a
+# failure. Integrations that report failures by returning None go through call() instead.
+
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from . import metrics
+
+FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURES", "3"))  # Failures in a row that open a breaker
+RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "300"))  # Seconds before the first probe
+MAX_RESET_TIMEOUT = 3600.0  # Seconds, the longest wait between probes
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+
+class CircuitOpen(RuntimeError):
+    """Raised by guard() when the breaker of a source refuses the call."""
+
+
+class Breaker:
+    def __init__(self, name, threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.timeout = reset_timeout  # Current wait before the next probe
+        self.opened_at = 0.0
+        self.probing = False  # A half-open probe is in flight
+        self._lock = threading.Lock()
+
+    def _set_state(self, state):
+        if state != self.state:
+            log = logging.warning if state == OPEN else logging.info
+            log(f"Circuit breaker of {self.name} is now {state.replace('_', '-')}.")
+            self.state = state
+            metrics.breaker_state(self.name, state)
+
+    def allow(self):
+        """Returns True if a call may go out now. A True in the open state makes the caller the probe."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.timeout:
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def record(self, ok):
+        """Reports the outcome of a call that allow() let through."""
+        with self._lock:
+            self.probing = False
+            if ok:
+                self.failures = 0
+                self.timeout = self.reset_timeout
+                self._set_state(CLOSED)
+                return
+            self.failures += 1
+            if self.state == HALF_OPEN:
+                self.timeout = min(self.timeout * 2, MAX_RESET_TIMEOUT)
+            elif self.failures < self.threshold:
+                return
+            self.opened_at = time.monotonic()
+            self._set_state(OPEN)
+
+    def seconds_until_probe(self):
+        """Returns the seconds until a probe is let through, 0 if calls are allowed."""
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self.timeout - (time.monotonic() - self.opened_at))
+
+
+_breakers = {}  # Breaker name -> Breaker
+_lock = threading.Lock()
+
+
+def key(source, scope):
+    """Returns the name of the breaker of one account, pod or price area of a source."""
+    return f"{source}:{scope}"
+
+
+def get(name):
+    """Returns the breaker of a source, created closed on first use."""
+    with _lock:
+        if name not in _breakers:
+            _breakers[name] = Breaker(name)
+        return _breakers[name]
+
+
+def is_open(name):
+    """Returns True while the breaker of a source refuses calls."""
+    return get(name).state == OPEN
+
+
+@contextmanager
+def guard(name):
+    """Lets the block run if the breaker of the source allows it, and records its outcome."""
+    breaker = get(name)
+    if not breaker.allow():
+        raise CircuitOpen(f"{name} is unavailable, next attempt in {breaker.seconds_until_probe():.0f} seconds.")
+    try:
+        yield breaker
+    except BaseException:
+        breaker.record(False)
+        raise
+    breaker.record(True)
+
+
+def call(name, func, *args):
+    """
+    Calls func if the breaker of the source allows it, counting a None result or an exception as a
+    failure. Returns None without calling func when the breaker refuses.
+    """
+    breaker = get(name)
+    if not breaker.allow():
+        logging.info(f"Skipping {func.__name__}, {name} is unavailable for another {breaker.seconds_until_probe():.0f} seconds.")
+        return None
+    result = None
+    try:
+        result = func(*args)
+    finally:
+        breaker.record(result is not None)
+    return result
@@ -0,0 +1,59 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# module: cache.py – A small on-disk JSON cache shared by the integrations.
+
+import os
+import json
+import logging
+import tempfile
+
+CACHE_DIR = os.getenv("HEATAUTOMATION_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "heatautomation"))
+
+
+def path(name):
+    """Returns the path of a cache file, creating the cache directory if needed."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    return os.path.join(CACHE_DIR, name)
+
+
+def load(name):
+    """Returns the cached JSON data, or None if there is no usable cache file."""
+    try:
+        with open(path(name), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable cache file {name}: {e}")
+        return None
+
+
+def save(name, data):
+    """Writes JSON data to the cache. The file is replaced atomically so readers never see half a file."""
+    try:
+        target = path(name)
+        fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, prefix=f".{name}.")
+    except OSError as e:
+        logging.warning(f"Could not write cache file {name}: {e}")
+        return
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, target)
+    except (OSError, TypeError, ValueError) as e:
+        logging.warning(f"Could not write cache file {name}: {e}")
+        os.unlink(tmp)
@@ -0,0 +1,193 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# module: chromepool.py – A pool of long-lived headless Chrome sessions shared by the Selenium integrations.
+
+import os
+import time
+import atexit
+import logging
+import platform
+import shutil
+import threading
+from contextlib import contextmanager
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+from selenium.common.exceptions import WebDriverException
+from . import chromewatch
+from . import metrics
+
+# Session limits, a session is recycled when it passes any of them
+MAX_SESSION_AGE = float(os.getenv("CHROME_MAX_SESSION_AGE", 6 * 3600))  # Seconds since start
+MAX_SESSION_IDLE = float(os.getenv("CHROME_MAX_SESSION_IDLE", 3600))  # Seconds since last use
+MAX_SESSION_RSS_MB = float(os.getenv("CHROME_MAX_SESSION_RSS_MB", 400))  # Chromedriver + Chrome children
+
+_sessions = {}  # Session name -> _Session
+_locks = {}  # Session name -> lock held while the session is borrowed
+_pool_lock = threading.Lock()
+
+
+class _Session:
+    def __init__(self, driver):
+        self.driver = driver
+        self.started = time.monotonic()
+        self.last_used = self.started
+        self.uses = 0
+
+
+@metrics.timed("chrome", "start")
+def start_chrome():
+    """Starts a new headless Chrome session. Raises RuntimeError if it cannot be started."""
+    system = platform.system()
+    arch = platform.machine()
+    logging.info(f"Detected system: {system}, architecture: {arch}")
+
+    options = Options()
+    options.add_argument("--headless")  # Works well on Raspberry Pi
+    options.add_argument("--disable-gpu")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+
+    # Find local chromedriver
+    chromedriver_path = shutil.which("chromedriver")
+    if not chromedriver_path:
+        raise RuntimeError("chromedriver not found in PATH")
+
+    try:
+        driver = webdriver.Chrome(service=Service(chromedriver_path), options=options)
+    except WebDriverException as e:
+        raise RuntimeError(f"Failed to start ChromeDriver: {e}") from e
+    logging.info("ChromeDriver started successfully.")
+    return driver
+
+
+def _driver_pid(driver):
+    try:
+        return driver.service.process.pid
+    except AttributeError:
+        return None
+
+
+def session_rss_mb(driver):
+    """Returns the memory used by the chromedriver process of a driver and its Chrome children."""
+    pid = _driver_pid(driver)
+    return chromewatch.tree_usage(pid)[0] if pid else 0
+
+
+def _is_alive(driver):
+    try:
+        driver.current_url  # Round trip to the browser, fails if Chrome has crashed
+        return True
+    except Exception:  # A dead chromedriver raises urllib3 connection errors, not WebDriverException
+        return False
+
+
+def _recycle_reason(session):
+    pid = _driver_pid(session.driver)
+    killed = chromewatch.killed(pid) if pid else None
+    if killed:
+        return f"killed by the watchdog, {killed}"
+    now = time.monotonic()
+    if now - session.started > MAX_SESSION_AGE:
+        return "maximum lifetime reached"
+    if now - session.last_used > MAX_SESSION_IDLE:
+        return "idle for too long"
+    if MAX_SESSION_RSS_MB and session_rss_mb(session.driver) > MAX_SESSION_RSS_MB:
+        return f"memory cap of {MAX_SESSION_RSS_MB:.0f} MB exceeded"
+    if not _is_alive(session.driver):
+        return "browser not responding"
+    return None
+
+
+def _quit(driver):
+    """Quits a driver and kills whatever is left of its process tree."""
+    pid = _driver_pid(driver)
+    try:
+        driver.quit()
+    except Exception as e:
+        logging.warning(f"Error while closing ChromeDriver: {e}")
+    if pid:
+        chromewatch.untrack(pid)
+
+
+def _lock_for(name):
+    with _pool_lock:
+        return _locks.setdefault(name, threading.Lock())
+
+
+def discard(name):
+    """Closes the named session, the next borrower gets a fresh browser."""
+    with _pool_lock:
+        session = _sessions.pop(name, None)
+    if session:
+        _quit(session.driver)
+
+
+@contextmanager
+def session(name="default"):
+    """
+    Borrows the named Chrome session, starting or recycling the browser when needed.
+    Only one caller at a time can hold a session. A session that fails with a
+    WebDriverException, whose browser no longer answers or that the watchdog killed is
+    discarded so the next borrower gets a fresh browser.
+    The browser processes are supervised by chromewatch while the session lives, and
+    the ones a previous run left behind are killed before the first browser starts.
+    """
+    chromewatch.reap()
+    with _lock_for(name):
+        current = _sessions.get(name)
+        if current:
+            try:
+                reason = _recycle_reason(current)
+            except Exception as e:
+                reason = f"health check failed: {e!r}"
+            if reason:
+                logging.info(f"Recycling Chrome session '{name}': {reason}.")
+                discard(name)
+                current = None
+        if current is None:
+            current = _Session(start_chrome())
+            with _pool_lock:
+                _sessions[name] = current
+            if _driver_pid(current.driver):
+                chromewatch.track(name, _driver_pid(current.driver))
+
+        current.uses += 1
+        pid = _driver_pid(current.driver)
+        chromewatch.borrowed(pid)
+        try:
+            yield current.driver
+        except Exception as e:
+            # Connection errors from a dead chromedriver are not WebDriverExceptions, so check the browser
+            if isinstance(e, WebDriverException) or (pid and chromewatch.killed(pid)) or not _is_alive(current.driver):
+                logging.warning(f"Chrome session '{name}' failed, discarding it.")
+                discard(name)
+            raise
+        finally:
+            current.last_used = time.monotonic()
+            chromewatch.returned(pid)
+
+
+def shutdown():
+    """Closes all pooled sessions."""
+    with _pool_lock:
+        names = list(_sessions)
+    for name in names:
+        discard(name)
+
+
+atexit.register(shutdown)
@@ -0,0 +1,363 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# module: chromewatch.py – Tracks the chromedriver and Chrome processes we start, enforces their limits and reaps the ones left behind.
+#
+# chromepool registers every chromedriver it starts with track() and reports each borrow with
+# borrowed() and returned(). The process trees are written to PID_FILE, so after a crash the next
+# start can find and kill them with reap(). Processes of a tracked tree that lose their chromedriver
+# and are orphaned to init or the user's systemd are reaped too; Chrome processes this program did
+# not start are never touched. A watchdog thread kills a tree that is borrowed for longer than
+# MAX_USE_SECONDS or grows past KILL_RSS_MB and stops tracking it; the stuck Selenium call then
+# fails and chromepool, which asks killed(), discards the session. Everything is read from /proc, on
+# systems without it nothing is tracked. Selenium is not imported, so reaping is cheap at startup.
+
+import os
+import time
+import signal
+import logging
+import threading
+from . import cache
+from . import metrics
+
+PID_FILE = "chrome_pids_{pid}.json"  # One per controller process, so a CLI command does not overwrite the daemon's
+MAX_USE_SECONDS = float(os.getenv("CHROME_MAX_USE_SECONDS", 300))  # Wall-clock limit of one borrow
+KILL_RSS_MB = float(os.getenv("CHROME_KILL_RSS_MB", 800))  # Hard memory limit of a tree while in use
+WATCH_INTERVAL = 10  # Seconds between watchdog checks
+KILL_GRACE = 3  # Seconds between SIGTERM and SIGKILL
+
+_PAGE_MB = os.sysconf("SC_PAGE_SIZE") / (1024 * 1024) if hasattr(os, "sysconf") else 0.0
+_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def _stat(pid):
+    """Returns (comm, ppid, cpu seconds, start ticks, rss MB, state) of a process, or None if it is gone."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            data = f.read()
+    except OSError:
+        return None
+    # The command name may contain spaces and parentheses, the fields after it are plain numbers
+    comm = data[data.index("(") + 1:data.rindex(")")]
+    fields = data[data.rindex(")") + 2:].split()
+    return (comm, int(fields[1]), (int(fields[11]) + int(fields[12])) / _TICKS, int(fields[19]),
+            int(fields[21]) * _PAGE_MB, fields[0])
+
+
+def _processes():
+    """Returns {pid: stat} of all processes, empty on systems without /proc."""
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return {}
+    result = {}
+    for entry in entries:
+        if entry.isdigit():
+            stat = _stat(int(entry))
+            if stat is not None:
+                result[int(entry)] = stat
+    return result
+
+
+def child_pids(pid, processes=None):
+    """Returns the pid and all its descendants."""
+    processes = _processes() if processes is None else processes
+    children = {}
+    for child, stat in processes.items():
+        children.setdefault(stat[1], []).append(child)
+    pids = [pid]
+    for current in pids:
+        pids.extend(children.get(current, []))
+    return pids
+
+
+def tree_usage(pid, processes=None):
+    """Returns (rss MB, cpu seconds) of a process tree, the CPU of children that have exited is not counted."""
+    processes = _processes() if processes is None else processes
+    rss = cpu = 0.0
+    for child in child_pids(pid, processes):
+        if child in processes:
+            rss += processes[child][4]
+            cpu += processes[child][2]
+    return rss, cpu
+
+
+def _alive(pid, start_ticks):
+    # Same pid and the same start time, so a reused pid is never mistaken for ours
+    stat = _stat(pid)
+    return stat is not None and stat[3] == start_ticks and stat[5] != "Z"
+
+
+def kill_tree(pids):
+    """Kills {pid: start ticks} with SIGTERM, then SIGKILL after KILL_GRACE. Returns the pids that were still running."""
+    running = {pid: start for pid, start in pids.items() if _alive(pid, start)}
+    found = list(running)
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        for pid in list(running):
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                running.pop(pid)
+            except PermissionError:
+                running.pop(pid)
+                logging.warning(f"Not allowed to kill Chrome process {pid}.")
+        deadline = time.monotonic() + KILL_GRACE
+        while running and time.monotonic() < deadline:
+            _reap_children(running)
+            running = {pid: start for pid, start in running.items() if _alive(pid, start)}
+            if running:
+                time.sleep(0.1)
+        if not running:
+            break
+    return found
+
+
+def _reap_children(pids):
+    # Collects the killed processes that are our children, so chromedrivers do not linger as zombies
+    for pid in pids:
+        try:
+            os.waitpid(pid, os.WNOHANG)
+        except OSError:
+            pass
+
+
+class _Tracked:
+    """A chromedriver we started and what we know about its tree."""
+
+    def __init__(self, name, pid):
+        self.name = name
+        self.pid = pid
+        self.started = time.monotonic()
+        self.borrowed = None  # Monotonic time the current borrow began
+        self.pids = {}  # pid -> start ticks, every process seen in the tree
+        self.uses = 0
+        self.peak_rss_mb = 0.0
+        self.cpu_seconds = 0.0
+        self.killed = None  # Why the watchdog killed the tree
+
+    def refresh(self, processes=None):
+        processes = _processes() if processes is None else processes
+        for pid in child_pids(self.pid, processes):
+            if pid in processes:
+                self.pids.setdefault(pid, processes[pid][3])
+        rss, cpu = tree_usage(self.pid, processes)
+        self.peak_rss_mb = max(self.peak_rss_mb, rss)
+        self.cpu_seconds = max(self.cpu_seconds, cpu)
+        return rss
+
+    def report(self):
+        return {"name": self.name, "pid": self.pid, "age_s": round(time.monotonic() - self.started, 1),
+                "uses": self.uses, "processes": len(self.pids), "peak_rss_mb": round(self.peak_rss_mb, 1),
+                "cpu_s": round(self.cpu_seconds, 2)}
+
+
+_tracked = {}  # chromedriver pid -> _Tracked
+_killed = {}  # chromedriver pid -> why the watchdog killed its tree, until chromepool untracks it
+_lock = threading.Lock()
+_watchdog = None
+_reaped = False
+
+
+def _save():
+    # Called with _lock held
+    name = PID_FILE.format(pid=os.getpid())
+    if not _tracked:
+        try:
+            os.remove(cache.path(name))
+        except OSError:
+            pass
+        return
+    own = _stat(os.getpid())
+    if own is None:
+        return  # No /proc, there is nothing to find again after a crash
+    cache.save(name, {"owner": os.getpid(), "owner_start": own[3],
+                      "trees": {str(t.pid): {str(pid): start for pid, start in t.pids.items()}
+                                for t in _tracked.values()}})
+
+
+def _publish(tracked, rss):
+    metrics.gauge("chrome_session_rss_mb", rss, session=tracked.name)
+    metrics.gauge("chrome_session_cpu_seconds", tracked.cpu_seconds, session=tracked.name)
+
+
+def track(name, pid):
+    """
+    Starts supervising the chromedriver with the given pid, started for the named session. Does
+    nothing on systems without /proc.
+    """
+    global _watchdog
+    if _stat(os.getpid()) is None:
+        return
+    tracked = _Tracked(name, pid)
+    tracked.refresh()
+    with _lock:
+        _tracked[pid] = tracked
+        _save()
+        if _watchdog is None:
+            _watchdog = threading.Thread(target=_watch, name="chrome-watchdog", daemon=True)
+            _watchdog.start()
+
+
+def borrowed(pid):
+    with _lock:
+        tracked = _tracked.get(pid)
+        if tracked is not None:
+            tracked.borrowed = time.monotonic()
+            tracked.uses += 1
+
+
+def returned(pid):
+    """Ends a borrow and records the processes Chrome has started meanwhile. Also reaps orphans."""
+    with _lock:
+        tracked = _tracked.get(pid)
+        if tracked is not None:
+            tracked.borrowed = None
+            tracked.refresh()
+            _save()
+    reap_orphans()
+
+
+def untrack(pid):
+    """
+    Stops supervising a chromedriver after the driver has been quit. Kills what is left of its tree
+    and logs the usage of the session. Returns the usage report, or None if the pid was not tracked.
+    """
+    with _lock:
+        tracked = _tracked.pop(pid, None)
+        _killed.pop(pid, None)
+        _save()
+    if tracked is None:
+        return None
+    tracked.refresh()
+    leftovers = kill_tree(tracked.pids)
+    report = tracked.report()
+    logging.info(f"Chrome session '{tracked.name}' closed after {report['uses']} uses in {report['age_s'] / 60:.1f} minutes: "
+                 f"peak {report['peak_rss_mb']:.0f} MB, {report['cpu_s']:.1f} s CPU"
+                 + (f", killed {len(leftovers)} leftover processes" if leftovers else "") + ".")
+    metrics.gauge("chrome_session_rss_mb", 0.0, session=tracked.name)
+    return report
+
+
+def killed(pid):
+    """Returns why the watchdog killed the tree of a chromedriver, or None if it did not."""
+    with _lock:
+        return _killed.get(pid)
+
+
+def usage():
+    """Returns the usage report of every supervised session."""
+    processes = _processes()
+    with _lock:
+        for tracked in _tracked.values():
+            _publish(tracked, tracked.refresh(processes))
+        return [tracked.report() for tracked in _tracked.values()]
+
+
+def _watch():
+    while True:
+        time.sleep(WATCH_INTERVAL)
+        try:
+            _check()
+        except Exception as e:
+            logging.error(f"Chrome watchdog check failed: {e!r}")
+
+
+def _check():
+    processes = _processes()
+    victims = []
+    with _lock:
+        for tracked in _tracked.values():
+            rss = tracked.refresh(processes)
+            _publish(tracked, rss)
+            if tracked.borrowed is None:
+                continue
+            if time.monotonic() - tracked.borrowed > MAX_USE_SECONDS:
+                tracked.killed = f"borrowed for more than {MAX_USE_SECONDS:.0f} seconds"
+            elif KILL_RSS_MB and rss > KILL_RSS_MB:
+                tracked.killed = f"using {rss:.0f} MB, over the limit of {KILL_RSS_MB:.0f} MB"
+            else:
+                continue
+            victims.append(tracked)
+        for tracked in victims:
+            # Killed trees are not tracked any longer, chromepool discards the session on its next borrow
+            del _tracked[tracked.pid]
+            _killed[tracked.pid] = tracked.killed
+        if victims:
+            _save()
+    for tracked in victims:
+        logging.error(f"Killing Chrome session '{tracked.name}': {tracked.killed}.")
+        kill_tree(tracked.pids)
+        metrics.gauge("chrome_session_rss_mb", 0.0, session=tracked.name)
+
+
+def reap_orphans(processes=None):
+    """
+    Kills the processes of the tracked trees that have lost their chromedriver and been orphaned to
+    init or systemd. Only processes recorded in this process's pid file are candidates, identified
+    by pid and start time. Returns the number of processes killed.
+    """
+    processes = _processes() if processes is None else processes
+    victims = {}
+    with _lock:
+        for tracked in _tracked.values():
+            tree = set(child_pids(tracked.pid, processes))
+            for pid, start in tracked.pids.items():
+                stat = processes.get(pid)
+                if pid in tree or stat is None or stat[3] != start or stat[5] == "Z":
+                    continue
+                parent = processes.get(stat[1])
+                if stat[1] == 1 or (parent is not None and parent[0] == "systemd"):
+                    victims.update((child, processes[child][3]) for child in child_pids(pid, processes)
+                                   if child in processes and child in tracked.pids)
+    if victims:
+        logging.warning(f"Killing {len(victims)} orphaned Chrome processes.")
+        kill_tree(victims)
+    return len(victims)
+
+
+def reap():
+    """
+    Kills the Chrome trees recorded by previous runs of the controller that are no longer running,
+    then the orphans of our own trees.
+    Runs once per process, later calls do nothing. Returns the number of processes killed.
+    """
+    global _reaped
+    with _lock:
+        if _reaped:
+            return 0
+        _reaped = True
+    killed = 0
+    prefix, suffix = PID_FILE.split("{pid}")
+    try:
+        names = [name for name in os.listdir(cache.CACHE_DIR) if name.startswith(prefix) and name.endswith(suffix)]
+    except OSError:
+        names = []
+    for name in names:
+        data = cache.load(name) or {}
+        owner = data.get("owner")
+        if not owner or owner == os.getpid() or _alive(owner, data.get("owner_start")):
+            continue  # Ours, or a controller that is still running
+        leftovers = {int(pid): start for tree in data.get("trees", {}).values() for pid, start in tree.items()}
+        running = {pid: start for pid, start in leftovers.items() if _alive(pid, start)}
+        if running:
+            logging.warning(f"Killing {len(running)} Chrome processes left behind by process {owner}.")
+            killed += len(kill_tree(running))
+        try:
+            os.remove(cache.path(name))
+        except OSError:
+            pass
+    killed += reap_orphans()
+    return killed
@@ -0,0 +1,151 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# module: cli.py – The heatautomation command: run the control loop or query a single integration.
+#
+# Usage: heatautomation {run,status,price,temp,stove,override} (or python -m heatautomation ...)
+#
+# The integrations read their configuration from the environment when they are imported, so the
+# .env file is loaded first and each subcommand only imports the modules it uses. A one-shot price
+# lookup does not load Selenium, numpy or the control loop.
+
+import sys
+import argparse
+import logging
+import importlib
+from datetime import datetime
+
+
+def setup():
+    """Loads the .env file and sets up logging. Call it before importing any integration."""
+    from dotenv import load_dotenv
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+
+def _module(name):
+    return importlib.import_module(f".{name}", __package__)
+
+
+def run(args):
+    _module("main").main_loop()  # Controls every home in the homes file
+
+
+def _home(args):
+    return _module("config").get(args.home)
+
+
+def _age(item):
+    return f"({item['age_s'] / 60:.0f} min old)" if item and item.get("age_s") is not None else "(never)"
+
+
+def _print_cached(status):
+    print("Home:       ", status["home"])
+    print("Heat source:", status["heater"], "(overridden)" if status["overridden"] else "")
+    print("Price:      ", status["price"]["value"], _age(status["price"]))
+    print("Temperature:", status["temperature"]["value"], _age(status["temperature"]))
+    for device, record in status["devices"].items():
+        print(f"{device + ':':12}", "on" if record["on"] else "off", _age(record))
+    if status["next_cycle"]:
+        print("Next cycle: ", f"{datetime.fromtimestamp(status['next_cycle']['at']):%H:%M:%S}", status["next_cycle"]["reason"])
+
+
+def status(args):
+    home = _home(args)
+    # A running controller answers from memory, only without one are the devices asked
+    cached = _module("api").request(f"/status/{home.name}")
+    if cached is not None:
+        _print_cached(cached)
+        return
+    sensibo = _module("sensibo")
+    cycle = _module("cache").load(_module("metrics").CYCLE_FILE)
+    print("Home:       ", home.name)
+    print("Heat source:", _module("devicestate").current_heater(home))
+    for pod in home.sensibo_pods:
+        print("Heat pump:  ", pod, sensibo.getSystemStatus(home, pod))
+    print("Läge:       ", _module("kmp").status(home))
+    if cycle:
+        print(f"Last cycle:  {cycle['seconds']:.1f} s, phases {cycle['phases']}")
+
+
+def price(args):
+    total = _module("tibber").get_spot_price(_home(args))
+    if total is None:
+        return 1
+    print(total)
+
+
+def temp(args):
+    temperature = _module("smhi").get_outdoor_temp(_home(args))
+    if temperature is None:
+        logging.error("Failed to fetch the temperature.")
+        return 1
+    print(f"{temperature}°")
+
+
+def stove(args):
+    kmp = _module("kmp")
+    home = _home(args)
+    try:
+        if args.command == "on":
+            kmp.on(home)
+        elif args.command == "off":
+            kmp.off(home)
+        elif args.command == "error":
+            print(kmp.pelletstove_error(home))
+        else:
+            print("Läge:", kmp.status(home))
+    except RuntimeError as e:  # Also breaker.CircuitOpen
+        logging.error(e)
+        return 1
+
+
+def override(args):
+    try:
+        data = {"home": _home(args).name, "heater": args.heater, "minutes": args.minutes}
+        answer = _module("api").request("/override", data)
+    except ValueError as e:
+        logging.error(f"The controller rejected the override: {e}")
+        return 1
+    if answer is None:
+        logging.error("No controller is running.")
+        return 1
+    print(f"Queued {args.heater} until {datetime.fromtimestamp(answer['until']):%Y-%m-%d %H:%M}.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="heatautomation")
+    parser.add_argument("--home", help="name of the home in the homes file, the first one by default")
+    commands = parser.add_subparsers(dest="subcommand", required=True)
+    commands.add_parser("run", help="run the control loop").set_defaults(func=run)
+    commands.add_parser("status", help="show the heat source and the state of both devices").set_defaults(func=status)
+    commands.add_parser("price", help="print the current spot price").set_defaults(func=price)
+    commands.add_parser("temp", help="print the current outdoor temperature").set_defaults(func=temp)
+    stove_parser = commands.add_parser("stove", help="control the pellet stove directly")
+    stove_parser.add_argument("command", choices=["on", "off", "status", "error"])
+    stove_parser.set_defaults(func=stove)
+    override_parser = commands.add_parser("override", help="force a heat source in the running controller")
+    override_parser.add_argument("heater", choices=["heatpump", "pelletstove", "off", "auto"])
+    override_parser.add_argument("--minutes", type=float, help="how long the override lasts, 60 by default")
+    override_parser.set_defaults(func=override)
+    args = parser.parse_args(argv)
+
+    setup()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# module: config.py – The homes the controller runs, each with its own price area, pods, stove account and location.
+#
+# The homes are read from the JSON file in HEATAUTOMATION_HOMES (homes.json by default):
+#
+#     {"homes": [{"name": "hagge", "price_area": "SE3", "tibber_home_id": "...",
+#                 "sensibo_pods": ["abc123"], "kmp_username": "...", "kmp_password": "...",
+#                 "lat": 60.1333, "lon": 15.2667}]}
+#
+# Missing fields fall back to the environment variables of the single-home setup, so without the
+# file the controller runs one home configured entirely from the environment. The integrations
+# take the home as an argument and share what homes have in common: one price series per price
+# area, one forecast per SMHI grid point and one Chrome session for all stove accounts.
+
+import os
+import json
+
+HOMES_FILE = os.getenv("HEATAUTOMATION_HOMES", "homes.json")
+DEFAULT_NAME = "default"
+
+
+class Home:
+    def __init__(self, name=DEFAULT_NAME, price_area=None, tibber_home_id=None, tibber_api_key=None,
+                 sensibo_pods=None, sensibo_api_key=None, kmp_username=None, kmp_password=None,
+                 kmp_url=None, lat=None, lon=None):
+        self.name = name
+        self.tibber_home_id = tibber_home_id or os.getenv("TIBBER_HOME_ID")
+        # Homes in one price area share their prices, a home without an area gets its own series
+        self.price_area = price_area or os.getenv("TIBBER_PRICE_AREA") or self.tibber_home_id or name
+        self.tibber_api_key = tibber_api_key or os.getenv("TIBBER_API_KEY")
+        if sensibo_pods is None:
+            sensibo_pods = [os.getenv("SENSIBO_DEVICE_ID")] if os.getenv("SENSIBO_DEVICE_ID") else []
+        self.sensibo_pods = list(sensibo_pods)
+        self.sensibo_api_key = sensibo_api_key or os.getenv("SENSIBO_API_KEY")
+        self.kmp_username = kmp_username or os.getenv("KMP_USERNAME")
+        self.kmp_password = kmp_password or os.getenv("KMP_PASSWORD")
+        self.kmp_url = kmp_url or os.getenv("KMP_PORTAL_URL", "http://portal.kmp-ab.se")
+        self.lat = float(lat if lat is not None else os.getenv("SMHI_LAT", "60.1333"))  # Defaults to Hagge
+        self.lon = float(lon if lon is not None else os.getenv("SMHI_LON", "15.2667"))
+
+    def __repr__(self):
+        return f"Home({self.name!r}, area={self.price_area!r}, pods={self.sensibo_pods}, lat={self.lat}, lon={self.lon})"
+
+
+_default = None
+
+
+def default():
+    """Returns the home configured from the environment, used when an integration is called without a home."""
+    global _default
+    if _default is None:
+        _default = Home()
+    return _default
+
+
+def load(path=None):
+    """
+    Returns the configured homes, or a single home from the environment if the file does not exist.
+    Raises ValueError if the file is malformed.
+    """
+    path = path or HOMES_FILE
+    if not os.path.exists(path):
+        return [Home()]
+    try:
+        with open(path, encoding="utf-8") as f:
+            entries = json.load(f)["homes"]
+        homes = [Home(**entry) for entry in entries]
+    except (OSError, KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid homes file {path}: {e}") from e
+    names = [home.name for home in homes]
+    if not homes or len(set(names)) != len(names):
+        raise ValueError(f"Invalid homes file {path}: the homes need unique names.")
+    return homes
+
+
+def get(name=None, path=None):
+    """Returns the home with the given name, or the first one. Raises KeyError if there is no such home."""
+    homes = load(path)
+    if name is None:
+        return homes[0]
+    for home in homes:
+        if home.name == name:
+            return home
+    raise KeyError(f"No home named {name!r}.")
@@ -0,0 +1,105 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# module: costmodel.py – A vectorized cost model for comparing the heat sources over arrays of prices and temperatures.
+
+import numpy as np
+
+MODES = ("off", "heatpump", "pelletstove")  # Decision codes are the indexes in this tuple
+OFF, HEATPUMP, PELLETSTOVE = range(len(MODES))
+
+# Heat pump capacity in kW at outdoor temperatures in °C, from the specification
+CAPACITY_CURVE = ((-20.0, 2.6), (-15.0, 3.6), (-10.0, 4.0), (0.0, 6.5))
+# Heat pump COP at outdoor temperatures in °C, about the SCOP of 3.8 over a heating season
+COP_CURVE = ((-20.0, 2.0), (-15.0, 2.3), (-7.0, 2.8), (2.0, 3.6), (7.0, 4.4), (12.0, 5.0))
+
+PELLET_PRICE = 2.99  # Spot price equivalent of heating with pellets, SEK/kWh
+PRICE_ADJUSTMENT = 0.94875  # Fixed cost per kWh on top of the spot price
+SCOP = 3.8
+
+
+class CostModel:
+    """
+    Heat pump and pellet stove costs over numpy arrays of spot prices (SEK/kWh) and outdoor temperatures (°C).
+    Scalars are accepted too and give 0-d arrays back.
+    """
+
+    def __init__(self, capacity_curve=CAPACITY_CURVE, cop_curve=COP_CURVE, pellet_price=PELLET_PRICE,
+                 price_adjustment=PRICE_ADJUSTMENT, max_price_threshold=3.0, min_capacity=3.0,
+                 balance_temp=17.0, heat_loss=0.25, scop=SCOP):
+        self.capacity_temps, self.capacity_values = (np.asarray(v, dtype=float) for v in zip(*capacity_curve))
+        self.cop_temps, self.cop_values = (np.asarray(v, dtype=float) for v in zip(*cop_curve))
+        self.pellet_price = pellet_price
+        self.price_adjustment = price_adjustment
+        self.max_price_threshold = max_price_threshold
+        self.min_capacity = min_capacity  # kW, below this the heat pump cannot heat the house on its own
+        self.balance_temp = balance_temp  # °C, above this the house needs no heating
+        self.heat_loss = heat_loss  # kW heat demand per degree below balance_temp
+        self.scop = scop
+        # SEK per kWh heat from pellets, breaks even with the heat pump at the adjusted pellet price
+        self.pellet_cost = (pellet_price - price_adjustment) / scop
+
+    def capacity(self, temps):
+        """Heat pump capacity in kW, interpolated from the capacity curve and flat outside it."""
+        return np.interp(temps, self.capacity_temps, self.capacity_values)
+
+    def cop(self, temps):
+        return np.interp(temps, self.cop_temps, self.cop_values)
+
+    def heat_demand(self, temps, slot_hours=1.0):
+        """Heat needed by the house in kWh per slot."""
+        return self.heat_loss * np.maximum(0.0, self.balance_temp - np.asarray(temps, dtype=float)) * slot_hours
+
+    @staticmethod
+    def energy_cost(prices, heat, cop):
+        """Cost in SEK of producing heat kWh with a heat pump at the given COP."""
+        return np.asarray(heat, dtype=float) / cop * prices
+
+    def decide(self, prices, temps=None, max_price_threshold=None):
+        """
+        Returns HEATPUMP where the heat pump is cheaper than pellets at the adjusted threshold price
+        and has enough capacity at the outdoor temperature, PELLETSTOVE elsewhere.
+        Without temperatures only the price is compared.
+        """
+        threshold = self.max_price_threshold if max_price_threshold is None else max_price_threshold
+        use_heatpump = np.asarray(prices, dtype=float) <= threshold - self.price_adjustment
+        if temps is not None:
+            use_heatpump &= self.capacity(temps) >= self.min_capacity
+        return np.where(use_heatpump, HEATPUMP, PELLETSTOVE).astype(np.int8)
+
+    def slot_costs(self, prices, temps, slot_hours=1.0):
+        """
+        Returns an array of shape (len(MODES), slots) with the cost in SEK of each heat source per slot,
+        inf where a source cannot be used: off while heat is needed, the heat pump below min_capacity.
+        """
+        prices = np.asarray(prices, dtype=float)
+        temps = np.asarray(temps, dtype=float)
+        demand = self.heat_demand(temps, slot_hours)
+        costs = np.empty((len(MODES),) + demand.shape)
+        costs[OFF] = np.where(demand > 0, np.inf, 0.0)
+        costs[HEATPUMP] = np.where(self.capacity(temps) >= self.min_capacity,
+                                   self.energy_cost(prices, demand, self.cop(temps)), np.inf)
+        costs[PELLETSTOVE] = demand * self.pellet_cost
+        return costs
+
+    def evaluate(self, prices, temps, slot_hours=1.0, max_price_threshold=None):
+        """Returns (decisions, cost per slot) of the threshold rule for arrays of prices and temperatures."""
+        decisions = self.decide(prices, temps, max_price_threshold)
+        costs = self.slot_costs(prices, temps, slot_hours)
+        return decisions, np.choose(decisions, costs)
+
+
+DEFAULT = CostModel()
@@ -0,0 +1,149 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# module: devicestate.py – Persisted desired and observed state of the heat sources, and a reconciler between them.
+#
+# The desired state says which devices should be on. The observed state is the last state a device
+# was confirmed to be in, with the time it was confirmed. Both survive restarts. converge() only
+# acts on a device when its confirmation is missing, disagrees with the desired state or has
+# expired, and the device commands it uses check the device before changing anything, so running
+# it again is harmless. Every home has its own state, the home configured from the environment
+# is used when none is given.
+
+import time
+import logging
+import threading
+from . import cache
+from . import config
+from . import sensibo
+from . import kmp
+
+STATE_FILE = "device_state_{home}.json"
+
+
+def _heatpump(home, on):
+    # Sensibo returns None instead of raising when it rejects a state
+    for pod in home.sensibo_pods:
+        if (sensibo.on(home=home, pod=pod) if on else sensibo.off(home=home, pod=pod)) is None:
+            raise RuntimeError(f"Sensibo pod {pod} did not accept the new AC state.")
+
+
+def _pelletstove(home, on):
+    # kmp raises unless the stove's mode confirms the change, an unreadable mode included
+    if on:
+        kmp.on(home)
+    else:
+        kmp.off(home)
+
+
+# Per device: command that turns it on or off, seconds a confirmation is trusted.
+# Sensibo reads are cheap and cached, the stove portal is not, so manual stove changes are noticed hourly.
+DEVICES = {
+    "heatpump": (_heatpump, 0),
+    "pelletstove": (_pelletstove, 3600),
+}
+
+# Desired on/off per device for each heat source
+HEATER_STATES = {
+    "off": {"heatpump": False, "pelletstove": False},
+    "heatpump": {"heatpump": True, "pelletstove": False},
+    "pelletstove": {"heatpump": False, "pelletstove": True},
+}
+
+_states = {}  # Home name -> {"heater": name, "desired": {device: on}, "observed": {device: {"on", "at"}}}
+_lock = threading.Lock()
+
+
+def _load(home):
+    if home.name not in _states:
+        data = cache.load(STATE_FILE.format(home=home.name)) or {}
+        _states[home.name] = {
+            "heater": data.get("heater"),
+            "desired": data.get("desired", {}),
+            "observed": data.get("observed", {}),
+        }
+    return _states[home.name]
+
+
+def _save(home):
+    cache.save(STATE_FILE.format(home=home.name), _states[home.name])
+
+
+def current_heater(home=None):
+    """Returns the heat source we last asked for, also across restarts, or None."""
+    with _lock:
+        return _load(home or config.default())["heater"]
+
+
+def observed(home=None):
+    """Returns a copy of the last confirmed state of each device."""
+    with _lock:
+        return {device: dict(record) for device, record in _load(home or config.default())["observed"].items()}
+
+
+def set_heater(heater_type, home=None):
+    """Makes heater_type the desired heat source."""
+    home = home or config.default()
+    with _lock:
+        state = _load(home)
+        if state["heater"] == heater_type:
+            return
+        logging.info(f"Desired heat source of {home.name} changed from {state['heater']} to {heater_type}.")
+        state["heater"] = heater_type
+        state["desired"] = dict(HEATER_STATES[heater_type])
+        _save(home)
+
+
+def _confirmed(state, device, now):
+    record = state["observed"].get(device)
+    trusted_for = DEVICES[device][1]
+    return record is not None and record["on"] == state["desired"][device] and now - record["at"] < trusted_for
+
+
+def pending(home=None):
+    """Returns the devices that converge() has to act on."""
+    with _lock:
+        state = _load(home or config.default())
+        now = time.time()
+        return [device for device in state["desired"] if not _confirmed(state, device, now)]
+
+
+def converge(device, home=None):
+    """
+    Brings a device to its desired state and confirms it, call it for the devices in pending().
+    Raises whatever the device command raises, the device then stays unconfirmed and is tried
+    again next time.
+    """
+    home = home or config.default()
+    with _lock:
+        state = _load(home)
+        desired = state["desired"].get(device)
+    if desired is None:
+        return
+    command, _ = DEVICES[device]
+
+    try:
+        command(home, desired)
+    except Exception:
+        with _lock:
+            state["observed"].pop(device, None)
+            _save(home)
+        raise
+
+    with _lock:
+        if state["desired"].get(device) == desired:
+            state["observed"][device] = {"on": desired, "at": time.time()}
+            _save(home)
@@ -0,0 +1,89 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# module: httppool.py – Shared keep-alive HTTP sessions with retries and per-host latency counters.
+
+import time
+import threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from . import metrics
+
+# Retry policy per host. Connection errors are retried for every method, status codes only for the listed ones.
+RETRIES = {
+    "api.tibber.com": {"total": 3, "backoff_factor": 1.0, "allowed_methods": ("GET", "POST")},  # GraphQL queries are reads
+    "home.sensibo.com": {"total": 2, "backoff_factor": 0.5, "allowed_methods": ("GET",)},
+}
+DEFAULT_RETRY = {"total": 2, "backoff_factor": 0.5, "allowed_methods": ("GET",)}
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_sessions = {}  # Host -> _Session
+_stats = {}  # Host -> {"requests", "errors", "total_seconds", "max_seconds"}
+_lock = threading.Lock()
+
+
+def _record(host, method, seconds, error):
+    metrics.observe(host, method.lower(), seconds, error)
+    with _lock:
+        stats = _stats.setdefault(host, {"requests": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        stats["requests"] += 1
+        stats["errors"] += int(error)
+        stats["total_seconds"] += seconds
+        stats["max_seconds"] = max(stats["max_seconds"], seconds)
+
+
+class _Session(requests.Session):
+    """A requests.Session that records the latency of every request, including its retries."""
+
+    def __init__(self, host):
+        super().__init__()
+        self.host = host
+        policy = RETRIES.get(host, DEFAULT_RETRY)
+        retry = Retry(status_forcelist=RETRY_STATUSES, raise_on_status=False, **policy)
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=4)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        self.headers["Accept-Encoding"] = "gzip, deflate"
+
+    def request(self, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = super().request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            _record(self.host, method, time.perf_counter() - started, True)
+            raise
+        _record(self.host, method, time.perf_counter() - started, response.status_code >= 400)
+        return response
+
+
+def session(url):
+    """Returns the shared keep-alive session for the host of a URL."""
+    host = urlsplit(url).netloc
+    with _lock:
+        if host not in _sessions:
+            _sessions[host] = _Session(host)
+        return _sessions[host]
+
+
+def stats():
+    """Returns the request count, error count and mean and max latency in seconds per host."""
+    with _lock:
+        return {
+            host: dict(values, mean_seconds=values["total_seconds"] / values["requests"])
+            for host, values in _stats.items()
+        }
@@ -14,154 +14,118 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-# module: kmp.py – A module for interacting with the KMP pellet stove portal using Selenium.
+# module: kmp.py – A module for interacting with the KMP pellet stove portal using Selenium or plain HTTP.
+#
+# The backend is imported on first use, so reading the configuration or importing this module does
+# not load Selenium. Every function takes the home whose stove account to use, the home configured
+# from the environment by default.
 
 import os
-import platform
 import time
 import logging
-import sys
-import shutil
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import ElementClickInterceptedException
-#from webdriver_manager.chrome import ChromeDriverManager
-
-# Initialize logging
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
-
-USERNAME = os.getenv("KMP_USERNAME")
-PASSWORD = os.getenv("KMP_PASSWORD")
-PORTAL_URL = "http://portal.kmp-ab.se"
-
-def start_chrome():
-    try:
-        system = platform.system()
-        arch = platform.machine()
-        logging.info(f"Detected system: {system}, architecture: {arch}")
-
-        options = Options()
-        options.add_argument("--headless")  # Works well on Raspberry Pi
-        options.add_argument("--no-sandbox")
-        options.add_argument("--disable-dev-shm-usage")
-
-        # Find local chromedriver
-        chromedriver_path = shutil.which("chromedriver")
-        if not chromedriver_path:
-            logging.error("Could not find chromedriver in PATH.")
-            return None
-
-        service = Service(executable_path=chromedriver_path)
-        chromedriver_path = shutil.which("chromedriver")
-        if not chromedriver_path:
-            raise RuntimeError("chromedriver not found in PATH")
-        driver = webdriver.Chrome(service=Service(chromedriver_path), options=options)
-        logging.info("ChromeDriver started successfully.")
-        return driver
-
-    except Exception as e:
-        logging.error(f"Failed to start ChromeDriver: {e}", exc_info=True)
-        return None
-
-def login(driver):
-    try:
-        driver.get(PORTAL_URL)
-        wait = WebDriverWait(driver, 15)
-        wait.until(EC.presence_of_element_located((By.ID, "kmac"))).send_keys(USERNAME)
-        driver.find_element(By.ID, "kpwd").send_keys(PASSWORD)
-        driver.find_element(By.NAME, "stove").click()
-        wait.until(EC.presence_of_element_located((By.ID, "mode")))
-        time.sleep(10)
-    except Exception as e:
-        logging.error(f"Login failed: {e}", exc_info=True)
-        raise
-
-def get_mode(driver):
-    try:
-        time.sleep(10)  # Wait for full load
-        return driver.find_element(By.ID, "mode").text
-    except Exception as e:
-        logging.error(f"Could not find the mode element: {e}", exc_info=True)
-        return None
-
-def click_start(driver):
-    try:
-        button = WebDriverWait(driver, 10).until(
-            EC.element_to_be_clickable((By.ID, "startbild"))
-        )
-        button.click()
-        logging.info("Power button clicked.")
-    except ElementClickInterceptedException:
-        logging.error("Could not click the power button, something is blocking it.")
-    except Exception as e:
-        logging.error(f"Error while clicking the power button: {e}")
-
-def off():
-    driver = start_chrome()
-    try:
-        login(driver)
-        mode = get_mode(driver)
-
-        if mode in ["AV", "AVSTÄNGD, SLÄCKER NED"]:
-            logging.info(f"Pellet stove is already off.")
+import functools
+import importlib
+from . import breaker
+from . import config
+from . import metrics
+
+BACKEND = os.getenv("KMP_BACKEND", "selenium").lower()  # "selenium" or "http"
+
+BACKENDS = {"selenium": ".kmp_selenium", "http": ".kmp_http"}
+PRESS_TIMEOUT = 60  # Seconds the stove gets to show the mode a press of the power button asked for
+PRESS_POLL = 5  # Seconds between reloads of the portal page while waiting for that
+
+def _backend(home=None):
+    """
+    Returns the portal session for the home's stove account, the mode reader, the power button and
+    the page reload of the configured backend.
+    """
+    home = home or config.default()
+    module = importlib.import_module(BACKENDS.get(BACKEND, BACKENDS["selenium"]), __package__)
+    return (module.session(home.kmp_url, home.kmp_username, home.kmp_password), module.get_mode,
+            module.click_start, module.reload)
+
+OFF_MODES = ("AV", "AVSTÄNGD, SLÄCKER NED")
+ON_MODES = ("LADDAR", "TÄNDNING", "UPPVÄRMNING", "HÖGEFFEKT", "VILOLÄGE, SLÄCKER NED", "VILAR...")
+
+def _guarded(func):
+    """Runs a stove command under the breaker of the home, a portal that keeps failing is not waited on every cycle."""
+    @functools.wraps(func)
+    def wrapper(home=None):
+        home = home or config.default()
+        with breaker.guard(breaker.key("kmp", home.name)):
+            return func(home)
+    return wrapper
+
+def _read_mode(read_mode, handle):
+    mode = read_mode(handle)
+    if mode is None:
+        raise RuntimeError("Could not read the mode of the pellet stove.")
+    return mode
+
+def _press(handle, read_mode, press_start, reload, expected):
+    """
+    Presses the power button, then reloads the page until the mode is one of expected. The page
+    still shows the old mode for a while, so raises only if it does not change within PRESS_TIMEOUT.
+    """
+    press_start(handle)
+    deadline = time.monotonic() + PRESS_TIMEOUT
+    mode = read_mode(handle)
+    while mode not in expected and time.monotonic() < deadline:
+        time.sleep(PRESS_POLL)
+        reload(handle)
+        mode = read_mode(handle)
+    if mode not in expected:
+        # Not confirmed, the reconciler reads the stove again and only presses if it is still needed
+        raise RuntimeError(f"Pellet stove is in mode {mode} after pressing the power button.")
+    logging.info(f"Pellet stove is now in mode {mode}.")
+
+@_guarded
+@metrics.timed("kmp", "off")
+def off(home=None):
+    """Turns the stove off. Raises RuntimeError if its mode is unknown or the press did not take."""
+    portal, read_mode, press_start, reload = _backend(home)
+    with portal as handle:
+        mode = _read_mode(read_mode, handle)
+
+        if mode in OFF_MODES:
+            logging.info("Pellet stove is already off.")
+        elif mode in ON_MODES:
+            logging.info("Pellet stove is on, turning it off.")
+            _press(handle, read_mode, press_start, reload, OFF_MODES)
         else:
-            logging.info(f"Pellet stove is on, turning it off.")
-            click_start(driver)
-    finally:
-        driver.quit()
-
-def on():
-    driver = start_chrome()
-    try:
-        login(driver)
-        mode = get_mode(driver)
-
-        if mode in ["AV", "AVSTÄNGD, SLÄCKER NED"]:
-            click_start(driver)
-        elif mode in ["LADDAR", "TÄNDNING", "UPPVÄRMNING", "HÖGEFFEKT", "VILOLÄGE, SLÄCKER NED", "VILAR..."]:
+            raise RuntimeError(f"Pellet stove is in the unknown mode {mode}, not pressing the power button.")
+
+@_guarded
+@metrics.timed("kmp", "on")
+def on(home=None):
+    """Turns the stove on. Raises RuntimeError if its mode is unknown or the press did not take."""
+    portal, read_mode, press_start, reload = _backend(home)
+    with portal as handle:
+        mode = _read_mode(read_mode, handle)
+
+        if mode in OFF_MODES:
+            _press(handle, read_mode, press_start, reload, ON_MODES)
+        elif mode in ON_MODES:
             logging.info(f"Pellet stove is already on in mode: {mode}")
         else:
-            logging.warning(f"Warning, unknown mode: {mode}")
-    finally:
-        driver.quit()
-
-def pelletstove_error():
-    driver = start_chrome()
-    try:
-        login(driver)
-        mode = get_mode(driver)
-        return "error" in mode.lower() if mode else False
-    finally:
-        driver.quit()
-
-def check_connection():
+            raise RuntimeError(f"Pellet stove is in the unknown mode {mode}, not pressing the power button.")
+
+@_guarded
+@metrics.timed("kmp", "status")
+def status(home=None):
+    """
+    Returns the current mode text of the pellet stove, or None if it could not be read.
+    Raises breaker.CircuitOpen while the portal is considered down.
+    """
+    portal, read_mode, _, _ = _backend(home)
+    with portal as handle:
+        return read_mode(handle)
+
+def pelletstove_error(home=None):
+    mode = status(home)
+    return "error" in mode.lower() if mode else False
+
+def check_connection(home=None):
     # TODO: Implement a check to see if the pellet stove is reachable
     return True
-
-if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python pelletstove.py [on|off|status|error]")
-        sys.exit(1)
-
-    command = sys.argv[1].lower()
-
-    if command == "on":
-        on()
-    elif command == "off":
-        off()
-    elif command == "status":
-        driver = start_chrome()
-        try:
-            login(driver)
-            print("Läge:", get_mode(driver))
-        finally:
-            driver.quit()
-    elif command == "error":
-        print("Felstatus:", pelletstove_error())
-    else:
-        print(f"Unknown command: {command}")
-
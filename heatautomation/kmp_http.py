@@ -0,0 +1,222 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# module: kmp_http.py – A browserless backend for the KMP pellet stove portal using plain HTTP requests.
+
+import re
+import logging
+import threading
+from contextlib import contextmanager
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+import requests
+from . import metrics
+
+TIMEOUT = 15  # Seconds per request
+
+_VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "wbr"}
+
+_portals = {}  # (url, username) -> logged in _Portal kept between calls
+_locks = {}  # (url, username) -> lock held while the portal is used
+_lock = threading.Lock()
+
+
+class _PageParser(HTMLParser):
+    """Collects the forms, the mode text and the power button of a portal page."""
+
+    def __init__(self):
+        super().__init__()
+        self.forms = []
+        self.mode = None
+        self.start_button = None
+        self._form = None
+        self._mode_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        self._start(tag, attrs, tag in _VOID_TAGS)
+
+    def handle_startendtag(self, tag, attrs):
+        self._start(tag, attrs, True)
+
+    def _start(self, tag, attrs, closed):
+        attrs = {k: v if v is not None else "" for k, v in attrs}
+        if self._mode_depth:
+            if not closed:
+                self._mode_depth += 1
+        elif attrs.get("id") == "mode":
+            self.mode = ""
+            self._mode_depth = 0 if closed else 1
+
+        if tag == "form":
+            self._form = {"action": attrs.get("action", ""), "method": attrs.get("method", "get").lower(),
+                          "fields": {}, "ids": {}, "buttons": {}}
+            self.forms.append(self._form)
+        elif tag in ("input", "button", "select", "textarea") and self._form is not None:
+            name = attrs.get("name") or attrs.get("id")
+            kind = attrs.get("type", "submit" if tag == "button" else "text").lower()
+            if name and kind in ("submit", "image"):
+                self._form["buttons"][name] = attrs.get("value", "")
+            elif name and (kind not in ("checkbox", "radio") or "checked" in attrs):
+                self._form["fields"][name] = attrs.get("value", "")
+            if attrs.get("id"):
+                self._form["ids"][attrs["id"]] = name
+
+        if attrs.get("id") == "startbild":
+            kind = attrs.get("type", "submit" if tag == "button" else "").lower()
+            self.start_button = dict(attrs, tag=tag, type=kind, form=self._form)
+
+    def handle_endtag(self, tag):
+        if tag == "form":
+            self._form = None
+        if self._mode_depth:
+            self._mode_depth -= 1
+
+    def handle_data(self, data):
+        if self._mode_depth:
+            self.mode += data
+
+
+def _parse(response):
+    parser = _PageParser()
+    parser.feed(response.text)
+    parser.url = response.url
+    return parser
+
+
+def _login_form(page):
+    for form in page.forms:
+        if "kmac" in form["ids"] and "kpwd" in form["ids"]:
+            return form
+    return None
+
+
+def _submit(session, page, form, extra):
+    data = dict(form["fields"])
+    data.update(extra)
+    url = urljoin(page.url, form["action"] or page.url)
+    if form["method"] == "post":
+        response = session.post(url, data=data, timeout=TIMEOUT)
+    else:
+        response = session.get(url, params=data, timeout=TIMEOUT)
+    response.raise_for_status()
+    return response
+
+
+class _Portal:
+    def __init__(self, url, username, password):
+        self.url = url
+        self.username = username
+        self.password = password
+        self.session = requests.Session()
+        self.stove_url = None  # Page with the stove status, known after login
+        self.page = None  # Last parsed stove page
+
+    @metrics.timed("kmp_http", "login")
+    def login(self):
+        response = self.session.get(self.url, timeout=TIMEOUT)
+        response.raise_for_status()
+        page = _parse(response)
+        form = _login_form(page)
+        if form is None:
+            raise RuntimeError("Login form not found on the portal page.")
+
+        fields = {form["ids"]["kmac"]: self.username, form["ids"]["kpwd"]: self.password}
+        fields["stove"] = form["buttons"].get("stove", "")
+        page = _parse(_submit(self.session, page, form, fields))
+        if page.mode is None:
+            raise RuntimeError("Login failed, the stove page was not returned.")
+        self.stove_url = page.url
+        self.page = page
+
+    @metrics.timed("kmp_http", "reload")
+    def refresh(self):
+        """Reloads the stove page, logging in again only if the portal has dropped the session."""
+        if self.stove_url:
+            response = self.session.get(self.stove_url, timeout=TIMEOUT)
+            response.raise_for_status()
+            page = _parse(response)
+            if page.mode is not None and _login_form(page) is None:
+                self.page = page
+                return
+            logging.info("Portal session has expired, logging in again.")
+        self.login()
+
+
+@contextmanager
+def session(url, username, password):
+    """
+    Yields the logged in portal of an account, reusing the session from earlier calls when it is
+    still valid. Each account has its own session, so several stoves can be controlled at once.
+    """
+    key = (url, username)
+    with _lock:
+        lock = _locks.setdefault(key, threading.Lock())
+    with lock:
+        portal = _portals.get(key)
+        if portal is None or portal.password != password:
+            portal = _portals[key] = _Portal(url, username, password)
+        try:
+            portal.refresh()
+            yield portal
+        except requests.exceptions.RequestException:
+            _portals.pop(key, None)  # Start over with a new connection next time
+            raise
+
+
+def get_mode(portal):
+    mode = portal.page.mode.strip() if portal.page and portal.page.mode else ""
+    if not mode:
+        logging.error("The mode element is empty on the portal page.")
+        return None
+    return mode
+
+
+def reload(portal):
+    """Fetches the stove page again, get_mode then reads the fresh mode."""
+    portal.refresh()
+
+
+def click_start(portal):
+    button = portal.page.start_button if portal.page else None
+    if button is None:
+        raise RuntimeError("Could not find the power button on the portal page.")
+    page = portal.page
+
+    try:
+        if button["form"] is not None and button["tag"] in ("input", "button") and button["type"] in ("submit", "image"):
+            name = button.get("name") or "startbild"
+            if button["type"] == "image":
+                extra = {f"{name}.x": 1, f"{name}.y": 1}
+            else:
+                extra = {name: button.get("value", "")}
+            response = _submit(portal.session, page, button["form"], extra)
+        else:
+            # Links and buttons that navigate with a script, e.g. onclick="location.href='...'"
+            target = button.get("href")
+            if not target:
+                match = re.search(r"""location(?:\.href)?\s*=\s*['"]([^'"]+)['"]""", button.get("onclick", ""))
+                target = match.group(1) if match else None
+            if not target:
+                raise RuntimeError("Could not work out what the power button does.")
+            response = portal.session.get(urljoin(page.url, target), timeout=TIMEOUT)
+            response.raise_for_status()
+        logging.info("Power button clicked.")
+    except requests.exceptions.RequestException as e:
+        raise RuntimeError(f"Error while clicking the power button: {e}") from e
+
+    new_page = _parse(response)
+    if new_page.mode is not None:
+        portal.page = new_page
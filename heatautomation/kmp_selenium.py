@@ -0,0 +1,119 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# module: kmp_selenium.py – A backend for the KMP pellet stove portal that drives a pooled headless Chrome.
+
+import logging
+from contextlib import contextmanager
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import (
+    ElementClickInterceptedException,
+    NoSuchElementException,
+    StaleElementReferenceException,
+    TimeoutException,
+)
+from . import chromepool
+from . import metrics
+
+MODE_TIMEOUT = 20  # Seconds to wait for the stove status to load
+
+# All stove accounts share one browser, this is the account each browser session is logged in as
+_accounts = {}  # WebDriver session id -> (url, username)
+
+def _mode_text(driver):
+    """Wait condition: returns the text of the mode element once it has been filled in, False until then."""
+    try:
+        return driver.find_element(By.ID, "mode").text.strip() or False
+    except (NoSuchElementException, StaleElementReferenceException):
+        return False
+
+def _page_loaded(driver):
+    """Wait condition: the stove status or the login form is shown."""
+    if driver.find_elements(By.ID, "kmac"):
+        return "login"
+    return "stove" if _mode_text(driver) else False
+
+@metrics.timed("kmp", "login")
+def login(driver, url, username, password):
+    try:
+        driver.get(url)
+        wait = WebDriverWait(driver, 15)
+        wait.until(EC.presence_of_element_located((By.ID, "kmac"))).send_keys(username)
+        driver.find_element(By.ID, "kpwd").send_keys(password)
+        driver.find_element(By.NAME, "stove").click()
+        WebDriverWait(driver, MODE_TIMEOUT).until(_mode_text)
+    except Exception as e:
+        logging.error(f"Login failed: {e}", exc_info=True)
+        raise
+
+@metrics.timed("kmp", "reload")
+def ensure_logged_in(driver, url, username, password):
+    """
+    Reuses the logged in portal page of a pooled browser and reloads it to get a fresh status.
+    Logs in again only if the portal has dropped the session, no page has been loaded yet or the
+    browser is logged in as another account.
+    """
+    account = (url, username)
+    if _accounts.get(driver.session_id) != account:
+        if driver.session_id in _accounts:
+            driver.delete_all_cookies()  # Log out the other account
+    elif driver.find_elements(By.ID, "mode"):
+        driver.refresh()
+        try:
+            page = WebDriverWait(driver, MODE_TIMEOUT).until(_page_loaded)
+        except TimeoutException:
+            page = None
+        if page == "stove":
+            return
+        logging.info("Portal session has expired, logging in again.")
+    _accounts.pop(driver.session_id, None)
+    login(driver, url, username, password)
+    _accounts[driver.session_id] = account
+
+@metrics.timed("kmp", "read_mode")
+def get_mode(driver):
+    try:
+        return WebDriverWait(driver, MODE_TIMEOUT).until(_mode_text)
+    except Exception as e:
+        logging.error(f"Could not find the mode element: {e}", exc_info=True)
+        return None
+
+@metrics.timed("kmp", "poll")
+def reload(driver):
+    """Reloads the portal page, get_mode then waits for the fresh mode."""
+    driver.refresh()
+
+@metrics.timed("kmp", "click_start")
+def click_start(driver):
+    try:
+        button = WebDriverWait(driver, 10).until(
+            EC.element_to_be_clickable((By.ID, "startbild"))
+        )
+        button.click()
+        logging.info("Power button clicked.")
+    except ElementClickInterceptedException as e:
+        raise RuntimeError("Could not click the power button, something is blocking it.") from e
+    except Exception as e:
+        raise RuntimeError(f"Error while clicking the power button: {e}") from e
+
+@contextmanager
+def session(url, username, password):
+    """Yields the logged in portal page of the pooled browser."""
+    with chromepool.session("kmp") as driver:
+        ensure_logged_in(driver, url, username, password)
+        yield driver
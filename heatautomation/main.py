@@ -16,186 +16,469 @@
 
 # main.py - Main script for the Heat Automation program.
 
-import tibber
-import sensibo
-import kmp
-import smhi
+from . import api
+from . import breaker
+from . import config
+from . import tibber
+from . import tibber_live
+from . import sensibo
+from . import kmp
+from . import smhi
+from . import planner
+from . import costmodel
+from . import scheduler
+from . import shadow
+from . import devicestate
+from . import metrics
+from . import store
+from . import thermal
+import os
+import asyncio
+import bisect
+import functools
 import time
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import logging
 
-# Setup logging
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+PLAN_HORIZON = timedelta(days=2)
+_plans = {}  # Home name -> (plan, (prices fetched, forecast fetched))
 
-# Retry helper function with dynamic delays
-def retry_function(func, retries=3, delay=5):
-    """Tries a function with retries in case of failure."""
-    for attempt in range(retries):
-        try:
-            return func()
-        except Exception as e:
-            logging.error(f"Attempt {attempt + 1} failed: {e}")
-            if attempt < retries - 1:
-                next_delay = delay * (2 ** attempt)  # Exponential backoff
-                logging.info(f"Retrying in {next_delay} seconds...")
-                time.sleep(next_delay)
-            else:
-                logging.error("Max retries reached. Function failed.")
-                return None
-
-def get_spot_price_safe():
-    """Safely fetches the spot price from Tibber with retry logic."""
-    return retry_function(tibber.get_spot_price)
-
-def wait_until_next_quarter():
-    """Waits until the next full quarter hour (00, 15, 30, 45)."""
-    now = datetime.now()
-    
-    # Calculate the next quarter hour
-    next_quarter_minute = (now.minute // 15 + 1) * 15
-    if next_quarter_minute == 60:
-        # If next quarter is 60, reset to next hour and set minute to 00
-        next_quarter_minute = 0
-        if now.hour == 23:
-            # If it's 23:59, set to 00:00 of the next day
-            next_time = now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
-        else:
-            # Otherwise, just increment the hour
-            next_time = now.replace(hour=now.hour + 1, minute=next_quarter_minute, second=0, microsecond=0)
-    else:
-        # Otherwise, just update the minute to the next quarter
-        next_time = now.replace(minute=next_quarter_minute, second=0, microsecond=0)
-    
-    # If next time exceeds 23:59 (midnight), we need to move to the next day
-    if next_time.hour == 24:
-        next_time = next_time.replace(hour=0, minute=0)
-    
-    # Calculate the sleep time
-    wait_time = (next_time - now).total_seconds()
-    logging.info(f"Waiting for {wait_time:.2f} seconds until the next quarter hour.")
-    
-    # Sleep until next quarter hour
-    time.sleep(wait_time)
+def get_plan(current_mode, home=None):
+    """Returns the heating plan of a home, recomputed only when its prices or forecast have been updated."""
+    home = home or config.default()
+    now = datetime.now(timezone.utc)
+    prices = tibber.get_prices(now - timedelta(hours=1), now + PLAN_HORIZON, home)
+    temperatures = smhi.get_temperature_series(now - timedelta(hours=1), now + PLAN_HORIZON, home)
+    key = (tibber.last_update(home), smhi.last_update(home))
+    plan, plan_key = _plans.get(home.name, (None, None))
+    if plan is not None and key == plan_key and plan.decision_at(now) is not None:
+        return plan
+
+    # Start the plan at the slot we are in now
+    while len(prices) > 1 and prices[1][0] <= now:
+        prices = prices[1:]
+    plan = planner.make_plan(prices, temperatures, current_mode)
+    _plans[home.name] = (plan, key)
+    return plan
 
 def evaluate_heater(spot_price):
-    adjusted_price = 2.99 - 0.94875  # Fixed cost adjustment
+    adjusted_price = costmodel.PELLET_PRICE - costmodel.PRICE_ADJUSTMENT  # Fixed cost adjustment
     logging.info(f"Spot price: {spot_price}, adjusted price: {adjusted_price}")
-    if spot_price <= adjusted_price:
+    if costmodel.DEFAULT.decide(spot_price, max_price_threshold=costmodel.PELLET_PRICE) == costmodel.HEATPUMP:
         logging.info("Electricity is cheaper than pellets.")
         return "heatpump"
     else:
         logging.info("The pellet stove is cheaper than the heatpump.")
         return "pelletstove"
 
-def check_systems():
-    """Check if systems are available and functioning."""
+_available = {}  # Home name -> (Sensibo reachable, KMP reachable) at the last check
+
+def check_systems(home=None):
+    """
+    Check if systems are available and functioning. The result is kept for fallback_heater, the
+    devices themselves are only ever switched by the reconciler.
+    """
+    home = home or config.default()
     try:
-        sensibo_status = sensibo.check_connection()
-        kmp_status = kmp.check_connection()
+        sensibo_status = sensibo.check_connection(home)
+        kmp_status = kmp.check_connection(home)
 
         if not sensibo_status and not kmp_status:
             logging.error("Both systems are down.")
         elif not sensibo_status:
             logging.warning("Sensibo is down. Using pellet stove.")
-            kmp.on()
         elif not kmp_status:
             logging.warning("KMP is down. Using heat pump.")
-            sensibo.on()
-
-        return sensibo_status, kmp_status
     except Exception as e:
         logging.error(f"Error checking system connections: {e}")
-        return False, False
+        sensibo_status, kmp_status = False, False
+    _available[home.name] = (sensibo_status, kmp_status)
+    return sensibo_status, kmp_status
 
-def main_loop():
-    heatType = "none"
+def fallback_heater(heater_type, home=None):
+    """Returns the other heat source if the system of heater_type was down at the last check and the other was not."""
+    sensibo_status, kmp_status = _available.get((home or config.default()).name, (True, True))
+    if heater_type == "heatpump" and not sensibo_status and kmp_status:
+        return "pelletstove"
+    if heater_type == "pelletstove" and not kmp_status and sensibo_status:
+        return "heatpump"
+    return heater_type
 
-    while True:
-        # Get the spot price and evaluate the best heating system
-        spot_price = get_spot_price_safe()
-        outdoor_temp = smhi.get_outdoor_temp()
-        if spot_price is None:
-            logging.warning("No spot price available. Skipping this cycle.")
-            time.sleep(30)  # Retry sooner, adjust based on needs
-            continue
+FETCH_TIMEOUT = 60  # Seconds for fetching the price or the temperature
+DEVICE_TIMEOUT = 180  # Seconds for a device command, Selenium actions are slow
+
+# When a source has nothing for now, not even from its cache, the last value it gave stands in for
+# at most this many seconds. Prices hold for their slot and temperatures change slowly.
+MAX_STALENESS = {"price": 2 * 3600, "temperature": 6 * 3600}
+_last_good = {}  # (home name, input) -> (value, Unix time)
+
+def _last_known_good(home, name, value):
+    """Returns (value, age in seconds): the fresh value, or the last known good one within MAX_STALENESS."""
+    key = (home.name, name)
+    now = time.time()
+    if value is not None:
+        _last_good[key] = (value, now)
+        return value, 0.0
+    if key in _last_good:
+        value, at = _last_good[key]
+        if now - at <= MAX_STALENESS[name]:
+            logging.warning(f"No {name} for {home.name}, using the last known {value} from {(now - at) / 60:.0f} minutes ago.")
+            return value, now - at
+    return None, None
+
+async def fetch_inputs(home=None):
+    """
+    Fetches the spot price and the outdoor temperature of a home concurrently. A source that fails
+    is replaced by its last known value while that is recent enough, otherwise it is None.
+    """
+    home = home or config.default()
+    # Not retried here: the HTTP pool retries the requests, the breakers and the next wakeup the fetch
+    results = await asyncio.gather(
+        scheduler.run_blocking(tibber.get_spot_price, home, timeout=FETCH_TIMEOUT),
+        scheduler.run_blocking(smhi.get_outdoor_temp, home, timeout=FETCH_TIMEOUT),
+        return_exceptions=True,
+    )
+    for name, result in zip(("price", "temperature"), results):
+        if isinstance(result, Exception):
+            logging.error(f"Error fetching the {name} of {home.name}: {result!r}")
+    spot_price, outdoor_temp = (None if isinstance(result, Exception) else result for result in results)
+    return _last_known_good(home, "price", spot_price)[0], _last_known_good(home, "temperature", outdoor_temp)[0]
+
+def choose_heater(spot_price, outdoor_temp, plan):
+    """Returns the heat source the plan has for now, or the one evaluate_heater_with_temperature picks if there is no plan."""
+    heater_type = plan.decision_at(datetime.now(timezone.utc)) if plan else None
+    if heater_type is None:
+        heater_type = evaluate_heater_with_temperature(outdoor_temp, spot_price, max_price_threshold=3.0)
+    return heater_type
+
+async def reconcile_devices(deadline, home=None):
+    """
+    Runs the device commands still needed to reach the desired heat source of a home, in parallel.
+    Returns False if a device could not be brought to its desired state.
+    """
+    devices = devicestate.pending(home)
+    if not devices:
+        logging.info(f"{devicestate.current_heater(home)} is already running.")
+        return True
+
+    timeout = scheduler.remaining(deadline, DEVICE_TIMEOUT)
+    results = await asyncio.gather(
+        *(scheduler.run_blocking(devicestate.converge, device, home, timeout=timeout) for device in devices),
+        return_exceptions=True,
+    )
+    converged = True
+    for device, result in zip(devices, results):
+        if isinstance(result, Exception):
+            logging.error(f"Error bringing the {device} to its desired state: {result!r}")
+            converged = False
+    return converged
+
+THERMAL_SETPOINTS = os.getenv("THERMAL_SETPOINTS", "1") != "0"  # 0 leaves the heat pump setpoint alone
+_setpoints = {}  # Home name -> [(start, setpoint)], the setpoint schedule of the heat pump
+_shifted = {}  # Home name -> the setpoint sent to the pods while it differs from the base setpoint
+
+def _restore_base(home, house):
+    """Puts the base setpoint back on the pods of a home if a shifted one was left on them."""
+    if home.name not in _shifted or house.base is None:
+        return
+    results = [sensibo.setTemp(house.base, home=home, pod=pod) for pod in home.sensibo_pods]
+    if all(result is not None for result in results):
+        logging.info(f"Restored the base setpoint {house.base}°C of {home.name}.")
+        del _shifted[home.name]  # Otherwise tried again next cycle
+
+def adjust_setpoint(home, heater_type, outdoor_temp):
+    """
+    Feeds the indoor temperature of the pods to the thermal model of a home and, while the heat pump
+    heats, moves its setpoint with the prices. The base setpoint is THERMAL_BASE_SETPOINT, or the one
+    the pod had the first time, and is put back once the heat pump stops heating or has no schedule.
+    Returns the setpoint in effect, or None if nothing could be done.
+    """
+    if not THERMAL_SETPOINTS or not home.sensibo_pods:
+        return None
+    if heater_type != "heatpump":
+        _restore_base(home, thermal.model(home))
+    if outdoor_temp is None:
+        return None
+    readings = [sensibo.getTemp(home=home, pod=pod) for pod in home.sensibo_pods]
+    readings = [reading for reading in readings if reading is not None]
+    if not readings:
+        return None
+    house = thermal.model(home)
+    if house.base is None:
+        status = sensibo.getSystemStatus(home, home.sensibo_pods[0]) or {}
+        target = os.getenv("THERMAL_BASE_SETPOINT") or status.get("target_temperature")
+        if not isinstance(target, (int, float, str)) or target == "N/A":
+            return None
+        house.base = float(target)
+        logging.info(f"Base setpoint of {home.name} is {house.base}°C.")
+
+    now = datetime.now(timezone.utc)
+    prices = tibber.get_prices(now - timedelta(hours=1), now + timedelta(days=1), home)
+    while len(prices) > 1 and prices[1][0] <= now:
+        prices = prices[1:]
+    temperatures = smhi.get_temperature_series(now - timedelta(hours=1), now + timedelta(days=1), home)
+    plan = thermal.schedule(house, house.base, prices, temperatures) if heater_type == "heatpump" else []
+    setpoint = plan[0][1] if plan else None
+
+    indoor = sum(readings) / len(readings)
+    error = house.observe(now.timestamp(), indoor, outdoor_temp, heater_type, setpoint)
+    thermal.save(home)
+    if error is not None:
+        logging.info(f"Indoor {indoor:.1f}°C in {home.name}, thermal model off by {error:+.2f}°C.")
+    _setpoints[home.name] = plan
+    if setpoint is None:
+        _restore_base(home, house)
+        return None
+    for pod in home.sensibo_pods:
+        sensibo.setTemp(setpoint, home=home, pod=pod)
+    if setpoint != house.base:
+        _shifted[home.name] = setpoint
+    else:
+        _shifted.pop(home.name, None)
+    return setpoint
+
+POWER_WINDOW = 300  # Seconds of live measurements averaged into the power of a cycle
+
+async def run_home(home, deadline):
+    """Runs one control cycle for a home. Returns its inputs and decision, or None if it had to be skipped for lack of a spot price."""
+    # Get the spot price and evaluate the best heating system
+    with metrics.phase("fetch"):
+        spot_price, outdoor_temp = await fetch_inputs(home)
+    forced = api.override(home)  # A heat source forced through the API
+    if spot_price is None and forced is None:
+        logging.warning(f"No spot price available for {home.name}. Skipping this cycle.")
+        return None
+
+    with metrics.phase("decide"):
+        decide_ns = None
+        if forced is None:
+            # Only the decision is timed, the shadow strategies are also handed inputs fetched beforehand
+            plan = get_plan(devicestate.current_heater(home), home)
+            started = time.perf_counter_ns()
+            heater_type = choose_heater(spot_price, outdoor_temp, plan)
+            decide_ns = time.perf_counter_ns() - started
+            heater_type = fallback_heater(heater_type, home)
         else:
-            heater_type = evaluate_heater_with_temperature(outdoor_temp, spot_price, max_price_threshold=3.0)
-            if heater_type == "heatpump":
-                if heatType != "heatpump":
-                    logging.info("Starting the heat pump...")
-                    try:
-                        sensibo.on()
-                        kmp.off()
-                        heatType = "heatpump"
-                    except Exception as e:
-                        logging.error(f"Error starting the heat pump: {e}")
-                else:
-                    logging.info("Heat pump is already running.")
-            else:
-                if heatType != "pelletstove":
-                    logging.info("Starting the pellet stove...")
-                    try:
-                        kmp.on()
-                        sensibo.off()
-                        heatType = "pelletstove"
-                    except Exception as e:
-                        logging.error(f"Error starting the pellet stove: {e}")
-                else:
-                    logging.info("Pellet stove is already running.")
-
-        # Check system status periodically (could be adjusted for more frequent checks)
-        sensibo_status, kmp_status = check_systems() # TODO
-        if not sensibo_status or not kmp_status:
-            logging.warning("One or more systems are unavailable. Taking necessary action.")
-
-        # Wait until the next full quarter hour (00, 15, 30, 45)
-        wait_until_next_quarter()
+            logging.info(f"Heat source of {home.name} is overridden to {forced}.")
+            heater_type = forced
+        devicestate.set_heater(heater_type, home)
+    strategies = None
+    with metrics.phase("shadow"):
+        # The other strategies only see the inputs fetched above and never reach the devices
+        if spot_price is not None:
+            try:
+                strategies = shadow.evaluate(spot_price, outdoor_temp, heater_type, decide_ns, home)
+            except Exception as e:
+                logging.error(f"Error evaluating the shadow strategies of {home.name}: {e!r}")
+    if strategies and len(strategies) > 1:
+        logging.info(f"Shadow decisions for {home.name}: " + ", ".join(
+            f"{name} {result['decision']}" for name, result in strategies.items() if name != shadow.PRIMARY))
+    with metrics.phase("devices"):
+        converged = await reconcile_devices(deadline, home)
+    setpoint = None
+    with metrics.phase("setpoint"):
+        try:
+            setpoint = await scheduler.run_blocking(adjust_setpoint, home, heater_type, outdoor_temp,
+                                                    timeout=scheduler.remaining(deadline, FETCH_TIMEOUT))
+        except Exception as e:
+            logging.error(f"Error adjusting the setpoint of {home.name}: {e!r}")
+
+    # Check system status periodically (could be adjusted for more frequent checks)
+    with metrics.phase("check"):
+        try:
+            sensibo_status, kmp_status = await scheduler.run_blocking(
+                check_systems, home, timeout=scheduler.remaining(deadline, DEVICE_TIMEOUT))
+        except asyncio.TimeoutError:
+            logging.error("Timed out checking the systems.")
+            sensibo_status, kmp_status = False, False
+    if not sensibo_status or not kmp_status:
+        logging.warning("One or more systems are unavailable. Taking necessary action.")
+        fallback = fallback_heater(heater_type, home) if forced is None else heater_type
+        if fallback != heater_type:
+            heater_type = fallback
+            devicestate.set_heater(heater_type, home)
+            with metrics.phase("devices"):
+                converged = await reconcile_devices(deadline, home)
+    healthy = converged and sensibo_status and kmp_status
+    # With a Tibber Pulse streaming, the actual draw shows whether the heat pump really runs
+    power = tibber_live.average_power(POWER_WINDOW, home)
+    if power is not None:
+        logging.info(f"{home.name} drew {power:.0f} W on average over the last {POWER_WINDOW // 60} minutes.")
+    return {"price": spot_price, "temperature": outdoor_temp, "decision": heater_type, "healthy": healthy,
+            "power": power, "setpoint": setpoint, "overridden": forced is not None, "strategies": strategies}
+
+async def run_cycle(deadline, homes=None):
+    """
+    Runs one control cycle for all homes in parallel. Returns the inputs and decision of each home
+    by name, None for the homes that had to be skipped. Homes in the same price area or on the same
+    forecast grid point share one fetch.
+    """
+    homes = [config.default()] if homes is None else homes
+    results = await asyncio.gather(*(run_home(home, deadline) for home in homes), return_exceptions=True)
+    cycle = {}
+    for home, result in zip(homes, results):
+        if isinstance(result, Exception):
+            logging.error(f"Error in the control cycle of {home.name}: {result!r}")
+            result = None
+        cycle[home.name] = result
+    return cycle
+
+def record_cycle(inputs, home=None):
+    """Queues the inputs, decision, confirmed device states and latencies of the last cycle for the store."""
+    home = home or config.default()
+    summary = metrics.last_cycle() or {}
+    observed = devicestate.observed(home)
+    store.record(
+        summary.get("started", time.time()),
+        price=inputs["price"],
+        temperature=inputs["temperature"],
+        decision=inputs["decision"],
+        heatpump_on=observed.get("heatpump", {}).get("on"),
+        pelletstove_on=observed.get("pelletstove", {}).get("on"),
+        cycle_seconds=summary.get("seconds"),
+        devices_seconds=summary.get("phases", {}).get("devices"),
+        details={"calls": summary.get("calls", {}), "retries": summary.get("retries", {}),
+                 "power_w": inputs.get("power"), "strategies": inputs.get("strategies")},
+        home=home.name,
+    )
+
+# Wakeups. A home only runs a cycle when its decision could have changed: at a planned switch, at a
+# price slot where the threshold rule flips, at a forecast point where the heat pump capacity crosses
+# min_capacity, when new prices can be fetched, when an override is queued or ends, or for the
+# periodic health check, which also picks up revised forecasts and manual changes to the devices.
+HEALTH_INTERVAL = float(os.getenv("HEATAUTOMATION_HEALTH_INTERVAL", 3600))  # Seconds between cycles when nothing changes
+CYCLE_TIMEOUT = timedelta(minutes=15)  # Every cycle has to finish within this
+MIN_INTERVAL = timedelta(seconds=30)  # Shortest sleep between cycles of a home, also the retry after a failed cycle
+
+def _next_flip(times, flags, now):
+    """Returns the first time after now where flags differs from its value at now, or None."""
+    # The forecast starts at the next whole hour, its first point also stands for the current one
+    index = max(bisect.bisect_right(times, now) - 1, 0)
+    for i in range(index + 1, len(times)):
+        if flags[i] != flags[index]:
+            return times[i]
+    return None
+
+def next_wakeup(home, now, inputs):
+    """
+    Returns (time, reason) of the next cycle of a home: the earliest moment its decision could change,
+    given the inputs of the cycle that just ran, None if it failed.
+    """
+    if inputs is None:
+        # Without a price there is nothing to decide on, wait at least until Tibber may be probed again
+        probe = timedelta(seconds=breaker.get(breaker.key("tibber", home.price_area)).seconds_until_probe())
+        return now + max(MIN_INTERVAL, probe), "retry after a failed cycle"
+    candidates = [(now + timedelta(seconds=HEALTH_INTERVAL), "health check")]
+    if not inputs.get("healthy", True):
+        candidates.append((scheduler.next_quarter(now), "recheck of the devices"))
+
+    plan = _plans.get(home.name, (None, None))[0]
+    if plan is not None and plan.decision_at(now) is not None:
+        candidates.append((plan.next_change(now), "planned switch"))
+
+    until = api.override_until(home)
+    if until is not None:
+        candidates.append((datetime.fromtimestamp(until, timezone.utc), "end of the override"))
+
+    setpoints = _setpoints.get(home.name) or []
+    candidates.append((_next_flip([start for start, _ in setpoints], [value for _, value in setpoints], now),
+                       "setpoint change"))
+
+    prices = tibber.get_prices(now - timedelta(hours=1), now + PLAN_HORIZON, home)
+    if prices:
+        flags = costmodel.DEFAULT.decide([price for _, price in prices], max_price_threshold=3.0).tolist()
+        candidates.append((_next_flip([start for start, _ in prices], flags, now), "price crossing"))
+    candidates.append((tibber.next_refresh(home) or scheduler.next_quarter(now), "new prices"))
+
+    temperatures = smhi.get_temperature_series(now - timedelta(hours=1), now + PLAN_HORIZON, home)
+    flags = [get_effective_heating_capacity(temp) >= costmodel.DEFAULT.min_capacity for _, temp in temperatures]
+    candidates.append((_next_flip([ts for ts, _ in temperatures], flags, now), "capacity crossing"))
+
+    wakeup, reason = min((candidate for candidate in candidates if candidate[0] is not None), key=lambda c: c[0])
+    return max(wakeup, now + MIN_INTERVAL), reason
+
+async def run_forever(homes=None):
+    homes = homes or config.load()
+    logging.info(f"Controlling {len(homes)} home(s): {', '.join(home.name for home in homes)}.")
+    metrics.serve()
+    wake = asyncio.Event()  # Set when an override is queued through the API
+    api.serve(homes, wake=functools.partial(asyncio.get_running_loop().call_soon_threadsafe, wake.set))
+    for home in homes:
+        tibber_live.start(home)
+    due = {home.name: datetime.now(timezone.utc) for home in homes}
+    while True:
+        now = datetime.now(timezone.utc)
+        wake.clear()  # Overrides queued from here on wake the next sleep
+        for name in api.queued():
+            due[name] = min(due[name], now)
+        running = [home for home in homes if due[home.name] <= now]
+        if running:
+            with metrics.cycle():
+                cycle = await run_cycle(now + CYCLE_TIMEOUT, running)
+
+        now = datetime.now(timezone.utc)
+        for home in running:
+            inputs = cycle[home.name]
+            try:
+                if inputs is not None:
+                    record_cycle(inputs, home)
+                due[home.name], reason = next_wakeup(home, now, inputs)
+                api.publish(home, inputs, due[home.name], reason)
+            except Exception as e:
+                # Like a failed cycle, this must not stop the loop or the other homes
+                logging.error(f"Error after the control cycle of {home.name}: {e!r}")
+                due[home.name], reason = scheduler.next_quarter(now), "next quarter hour after an error"
+            logging.info(f"Next cycle of {home.name} at {due[home.name].astimezone():%Y-%m-%d %H:%M:%S} ({reason}).")
+
+        wakeup = min(due.values())
+        logging.info(f"Sleeping for {scheduler.remaining(wakeup):.0f} seconds.")
+        await scheduler.sleep_until(wakeup, wake)
+
+def main_loop():
+    asyncio.run(run_forever())
 
 def get_effective_heating_capacity(outdoor_temp):
-    """Calculates the heating effect based on outdoor temperature according to specification."""
-    if outdoor_temp >= 0:
-        return 6.5  # Max heating effect
-    elif outdoor_temp >= -12.5:
-        return 4.0  # Heating effect at -10°C
-    elif outdoor_temp >= -17.5:
-        return 3.6  # Heating effect at -15°C
-    else:
-        return 2.6  # Heating effect at -20°C
+    """Calculates the heating effect based on outdoor temperature, interpolated from the specification."""
+    return float(costmodel.DEFAULT.capacity(outdoor_temp))
 
 def evaluate_heater_with_temperature(outdoor_temp, spot_price, max_price_threshold=3.0):
     """Evaluates whether the heat pump or the pellet stove is more effective based on outdoor temperature and spot price."""
-    effective_heating_capacity = get_effective_heating_capacity(outdoor_temp)
-    adjusted_price = max_price_threshold - 0.94875  # Dynamic price adjustment
+    decision = costmodel.DEFAULT.decide(spot_price, outdoor_temp, max_price_threshold)
 
-    if spot_price <= adjusted_price and effective_heating_capacity >= 3.0:
-        logging.info(f"The heat pump is the most effective at {outdoor_temp}°C with {effective_heating_capacity} kW heating effect.")
+    if outdoor_temp is None:
+        logging.warning("No outdoor temperature, choosing the heat source by the price alone.")
+        return "heatpump" if decision == costmodel.HEATPUMP else "pelletstove"
+    if decision == costmodel.HEATPUMP:
+        effective_heating_capacity = get_effective_heating_capacity(outdoor_temp)
+        logging.info(f"The heat pump is the most effective at {outdoor_temp}°C with {effective_heating_capacity:.1f} kW heating effect.")
         return "heatpump"
     else:
         logging.info(f"The pellet stove is more effective than the heat pump at {outdoor_temp}°C with 5 kW heating effect.")
         return "pelletstove"
     
-def calculate_energy_cost_with_scop(spot_price, heating_capacity, scop=3.8):
+def calculate_energy_cost_with_scop(spot_price, heating_capacity, scop=costmodel.SCOP):
     """Calculates energy use based on SCOP (Seasonal Coefficient of Performance)."""
     # Effective energy use per kWh
     energy_used = heating_capacity / scop
     # Calculating the cost for generating the necessary amount of heat
-    cost = energy_used * spot_price
+    cost = float(costmodel.CostModel.energy_cost(spot_price, heating_capacity, scop))
     logging.info(f"To generate {heating_capacity} kWh heat, {energy_used:.2f} kWh electricity is used. Cost: {cost:.2f} SEK.")
     return cost
 
 def optimize_heating_system(outdoor_temp, spot_price):
     heater_type = evaluate_heater_with_temperature(outdoor_temp, spot_price)
-    if heater_type == "heatpump":
+    if heater_type == "heatpump" and outdoor_temp is not None:
         heating_capacity = get_effective_heating_capacity(outdoor_temp)
         cost = calculate_energy_cost_with_scop(spot_price, heating_capacity)
-        threshold_cost = (2.99 - 0.94875)  # Adjust this threshold as needed
+        threshold_cost = (costmodel.PELLET_PRICE - costmodel.PRICE_ADJUSTMENT)  # Adjust this threshold as needed
         if cost > threshold_cost:
             logging.info("The heat pump is too expensive, starting the pellet stove instead.")
             return "pelletstove"
         else:
             return "heatpump"
-    else:
-        return "pelletstove"
+    return heater_type
 
-if __name__ == "__main__":
-    main_loop()
+# The shadow strategies are the decision rules above, run on the price and temperature of each cycle
+shadow.register("price", lambda price, temperature: evaluate_heater(price))
+shadow.register("temperature", lambda price, temperature: evaluate_heater_with_temperature(temperature, price))
+shadow.register("optimize", lambda price, temperature: optimize_heating_system(temperature, price))
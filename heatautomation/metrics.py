@@ -0,0 +1,244 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# module: metrics.py – Latency histograms, error and retry counters for the integrations and the control cycle.
+#
+# Wrap external calls with @timed("integration", "operation") or "with timed(...)", and the phases of
+# a cycle with "with cycle():" and "with phase(name):". The numbers are served in the Prometheus text
+# format on http://METRICS_HOST:METRICS_PORT/metrics and the summary of the last cycle as JSON on /cycle.
+
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from contextlib import ContextDecorator, contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from . import cache
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9750"))  # 0 turns the endpoint off
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)  # Seconds
+CYCLE_FILE = "last_cycle.json"
+
+_calls = {}  # (integration, operation) -> _Histogram
+_errors = {}  # (integration, operation) -> count
+_retries = {}  # integration -> count
+_phases = {}  # phase -> _Histogram
+_breakers = {}  # source -> circuit breaker state
+_gauges = {}  # (name, labels) -> value
+_cycles = 0
+_cycle = None  # Summary of the cycle in progress
+_last_cycle = None
+_lock = threading.Lock()
+
+
+class _Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # Last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+def observe(integration, operation, seconds, error=False):
+    """Records one call to an integration."""
+    key = (integration, operation)
+    with _lock:
+        _calls.setdefault(key, _Histogram()).observe(seconds)
+        if error:
+            _errors[key] = _errors.get(key, 0) + 1
+        if _cycle is not None:
+            name = f"{integration}.{operation}"
+            call = _cycle["calls"].setdefault(name, {"count": 0, "seconds": 0.0, "errors": 0})
+            call["count"] += 1
+            call["seconds"] += seconds
+            call["errors"] += int(error)
+
+
+def count_retry(integration):
+    with _lock:
+        _retries[integration] = _retries.get(integration, 0) + 1
+        if _cycle is not None:
+            _cycle["retries"][integration] = _cycle["retries"].get(integration, 0) + 1
+
+
+def breaker_state(source, state):
+    """Records the state of the circuit breaker of a source: closed, half_open or open."""
+    with _lock:
+        _breakers[source] = state
+
+
+def gauge(name, value, **labels):
+    """Sets the gauge heatautomation_<name> with the given labels."""
+    with _lock:
+        _gauges[(name, _labels(**labels))] = value
+
+
+class timed(ContextDecorator):
+    """Times a call to an integration, as a decorator or a context manager. Exceptions count as errors."""
+
+    def __init__(self, integration, operation):
+        self.integration = integration
+        self.operation = operation
+        self._local = threading.local()  # Decorated functions can run in several threads at once
+
+    def __enter__(self):
+        self._local.started = getattr(self._local, "started", [])
+        self._local.started.append(time.perf_counter())
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self._local.started.pop()
+        observe(self.integration, self.operation, seconds, exc_type is not None)
+        return False
+
+
+@contextmanager
+def phase(name):
+    """Times a phase of the control cycle."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        with _lock:
+            _phases.setdefault(name, _Histogram()).observe(seconds)
+            if _cycle is not None:
+                _cycle["phases"][name] = _cycle["phases"].get(name, 0.0) + seconds
+
+
+@contextmanager
+def cycle():
+    """Collects the calls, retries and phases of one control cycle into a JSON summary."""
+    global _cycle, _last_cycle, _cycles
+    started = time.perf_counter()
+    with _lock:
+        _cycle = {"started": time.time(), "phases": {}, "calls": {}, "retries": {}}
+    try:
+        yield
+    finally:
+        with _lock:
+            summary, _cycle = _cycle, None
+            summary["seconds"] = time.perf_counter() - started
+            _last_cycle = summary
+            _cycles += 1
+        logging.info(f"Cycle summary: {json.dumps(summary, sort_keys=True)}")
+        cache.save(CYCLE_FILE, summary)
+
+
+def last_cycle():
+    with _lock:
+        return _last_cycle
+
+
+def snapshot():
+    """Returns the call count, total seconds and errors so far per "integration.operation"."""
+    with _lock:
+        return {
+            f"{integration}.{operation}": {"count": histogram.count, "seconds": histogram.sum,
+                                           "errors": _errors.get((integration, operation), 0)}
+            for (integration, operation), histogram in _calls.items()
+        }
+
+
+def _labels(**labels):
+    return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+
+def _histogram_lines(name, histogram, labels):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(BUCKETS + ("+Inf",), histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+    return lines
+
+
+def render():
+    """Returns all metrics in the Prometheus text exposition format."""
+    with _lock:
+        lines = ["# HELP heatautomation_call_seconds Latency of calls to the integrations.",
+                 "# TYPE heatautomation_call_seconds histogram"]
+        for (integration, operation), histogram in sorted(_calls.items()):
+            lines += _histogram_lines("heatautomation_call_seconds", histogram,
+                                      _labels(integration=integration, operation=operation))
+        lines += ["# HELP heatautomation_call_errors_total Failed calls to the integrations.",
+                  "# TYPE heatautomation_call_errors_total counter"]
+        for (integration, operation), count in sorted(_errors.items()):
+            lines.append(f"heatautomation_call_errors_total{{{_labels(integration=integration, operation=operation)}}} {count}")
+        lines += ["# HELP heatautomation_retries_total Retried calls to the integrations.",
+                  "# TYPE heatautomation_retries_total counter"]
+        for integration, count in sorted(_retries.items()):
+            lines.append(f"heatautomation_retries_total{{{_labels(integration=integration)}}} {count}")
+        lines += ["# HELP heatautomation_breaker_open Circuit breaker of a source, 0 closed, 1 half-open, 2 open.",
+                  "# TYPE heatautomation_breaker_open gauge"]
+        for source, state in sorted(_breakers.items()):
+            level = {"closed": 0, "half_open": 1, "open": 2}[state]
+            lines.append(f"heatautomation_breaker_open{{{_labels(source=source)}}} {level}")
+        lines += ["# HELP heatautomation_cycle_phase_seconds Time spent in each phase of the control cycle.",
+                  "# TYPE heatautomation_cycle_phase_seconds histogram"]
+        for name, histogram in sorted(_phases.items()):
+            lines += _histogram_lines("heatautomation_cycle_phase_seconds", histogram, _labels(phase=name))
+        for (name, labels), value in sorted(_gauges.items()):
+            if not any(line == f"# TYPE heatautomation_{name} gauge" for line in lines):
+                lines.append(f"# TYPE heatautomation_{name} gauge")
+            lines.append(f"heatautomation_{name}{{{labels}}} {value}")
+        lines += ["# HELP heatautomation_cycles_total Completed control cycles.",
+                  "# TYPE heatautomation_cycles_total counter",
+                  f"heatautomation_cycles_total {_cycles}"]
+    return "\n".join(lines) + "\n"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = render().encode(), "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path == "/cycle":
+            body, content_type = json.dumps(last_cycle()).encode(), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes every few seconds would flood the log
+
+
+def serve(host=METRICS_HOST, port=METRICS_PORT):
+    """Starts the metrics endpoint in a background thread. Returns the server, or None if it is turned off."""
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _Handler)
+    except OSError as e:
+        logging.error(f"Could not start the metrics endpoint on {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logging.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
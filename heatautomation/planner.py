@@ -0,0 +1,171 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# module: planner.py – A look-ahead planner that picks the cheapest heat source for every slot of the price horizon.
+
+import bisect
+import logging
+from datetime import timedelta
+from . import costmodel
+from .costmodel import MODES  # Ties go to the first mode
+
+INF = float("inf")
+
+# Switching
+SWITCH_PENALTY = 0.5  # SEK charged for every change of heat source
+STOVE_IGNITION_COST = 2.0  # SEK in pellets and wear for every ignition of the stove
+STOVE_MIN_RUN = timedelta(hours=3)  # Once ignited the stove keeps running at least this long
+
+
+class Plan:
+    """A heating schedule on a regular slot grid, looked up in O(1) by time."""
+
+    def __init__(self, start, slot, modes, cost):
+        self.start = start
+        self.slot = slot
+        self.modes = modes
+        self.cost = cost
+
+    @property
+    def end(self):
+        return self.start + self.slot * len(self.modes)
+
+    def decision_at(self, ts):
+        """Returns the planned heat source at ts, or None if ts is outside the plan."""
+        index = int((ts - self.start) / self.slot)
+        if 0 <= index < len(self.modes) and ts >= self.start:
+            return self.modes[index]
+        return None
+
+    def next_change(self, ts):
+        """Returns the start of the first slot after ts with another heat source, or the end of the plan."""
+        index = max(int((ts - self.start) / self.slot), 0)
+        for i in range(index + 1, len(self.modes)):
+            if self.modes[i] != self.modes[index]:
+                return self.start + self.slot * i
+        return self.end
+
+    def switches(self):
+        return sum(1 for a, b in zip(self.modes, self.modes[1:]) if a != b)
+
+
+def optimize(costs, min_run, current_mode=None, switch_penalty=SWITCH_PENALTY, ignition_cost=STOVE_IGNITION_COST):
+    """
+    Returns (modes, total cost) of the cheapest schedule by dynamic programming over the slots.
+    The state is the heat source plus how many slots the stove has been running, capped at min_run,
+    so the stove can only be turned off once it has run for min_run slots.
+    """
+    slots = len(costs[MODES[0]])
+    if slots == 0:
+        return [], 0.0
+    states = [(mode, run) for mode in MODES for run in (range(1, min_run + 1) if mode == "pelletstove" else (0,))]
+    index = {state: i for i, state in enumerate(states)}
+
+    def successors(state):
+        mode, run = state
+        if mode == "pelletstove" and run < min_run:
+            return [("pelletstove", run + 1)]
+        result = []
+        for new_mode in MODES:
+            if new_mode == "pelletstove":
+                result.append(("pelletstove", min(run + 1, min_run) if mode == "pelletstove" else 1))
+            else:
+                result.append((new_mode, 0))
+        return result
+
+    def transition_cost(state, new_state):
+        if state is None or state[0] == new_state[0]:
+            return 0.0
+        return switch_penalty + (ignition_cost if new_state[0] == "pelletstove" else 0.0)
+
+    # The stove is assumed to have run long enough already when it is the current source
+    start_state = None
+    if current_mode in MODES:
+        start_state = (current_mode, min_run if current_mode == "pelletstove" else 0)
+
+    best = [INF] * len(states)
+    back = []
+    for new_state in (successors(start_state) if start_state else [s for s in states if s[1] <= 1]):
+        cost = costs[new_state[0]][0] + transition_cost(start_state, new_state)
+        i = index[new_state]
+        if cost < best[i]:
+            best[i] = cost
+    back.append([None] * len(states))
+
+    for t in range(1, slots):
+        new_best = [INF] * len(states)
+        pointers = [None] * len(states)
+        for i, state in enumerate(states):
+            if best[i] == INF:
+                continue
+            for new_state in successors(state):
+                cost = best[i] + costs[new_state[0]][t] + transition_cost(state, new_state)
+                j = index[new_state]
+                if cost < new_best[j]:
+                    new_best[j] = cost
+                    pointers[j] = i
+        best = new_best
+        back.append(pointers)
+
+    i = min(range(len(states)), key=best.__getitem__)
+    total = best[i]
+    modes = []
+    for t in range(slots - 1, -1, -1):
+        modes.append(states[i][0])
+        i = back[t][i]
+    modes.reverse()
+    return modes, total
+
+
+def _temperature_for(times, temps, ts):
+    # Forecast points are hourly or sparser, each slot takes the latest point at or before it
+    index = max(bisect.bisect_right(times, ts) - 1, 0)
+    return temps[index]
+
+
+def make_plan(prices, temperatures, current_mode=None, model=costmodel.DEFAULT):
+    """
+    Computes the cheapest heating plan over the price horizon.
+    prices is a list of (startsAt, price) on a regular grid and temperatures a list of (time, temperature).
+    Returns a Plan, or None if there is not enough data.
+    """
+    if len(prices) < 2 or not temperatures:
+        logging.warning("Not enough price or temperature data to make a heating plan.")
+        return None
+
+    slot = prices[1][0] - prices[0][0]
+    # Only plan over the regular part of the grid, a gap in the prices ends the horizon
+    count = 1
+    while count < len(prices) and prices[count][0] - prices[count - 1][0] == slot:
+        count += 1
+    prices = prices[:count]
+
+    times = [t for t, _ in temperatures]
+    temps = [v for _, v in temperatures]
+    slot_temps = [_temperature_for(times, temps, start) for start, _ in prices]
+    slot_hours = slot.total_seconds() / 3600
+    slot_costs = model.slot_costs([p for _, p in prices], slot_temps, slot_hours)
+    costs = {mode: slot_costs[i].tolist() for i, mode in enumerate(MODES)}
+    min_run = max(1, -(-STOVE_MIN_RUN // slot))  # Round up to whole slots
+
+    modes, total = optimize(costs, min_run, current_mode)
+    if total == INF:
+        logging.warning("No feasible heating plan found.")
+        return None
+    plan = Plan(prices[0][0], slot, modes, total)
+    logging.info(f"New heating plan for {len(modes)} slots until {plan.end.isoformat()}: "
+                 f"{plan.switches()} switches, estimated cost {total:.2f} SEK.")
+    return plan
@@ -0,0 +1,71 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# module: scheduler.py – Asyncio helpers for running the blocking integrations concurrently with timeouts and deadlines.
+
+import os
+import asyncio
+import functools
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+# Integrations are blocking (requests, Selenium), they run on this pool so the event loop never waits on them.
+# Every home runs its fetches and device commands at the same time, raise it when controlling many homes.
+WORKERS = int(os.getenv("HEATAUTOMATION_WORKERS", "8"))
+_executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="heatautomation")
+
+
+async def run_blocking(func, *args, timeout=None):
+    """
+    Runs a blocking function on the worker pool and waits at most timeout seconds for it.
+    Raises asyncio.TimeoutError on timeout. The worker thread cannot be interrupted and finishes
+    the call in the background, its result is then dropped.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(_executor, functools.partial(func, *args))
+    return await asyncio.wait_for(future, timeout)
+
+
+def next_quarter(now):
+    """Returns the next full quarter hour (00, 15, 30, 45) after now."""
+    return now.replace(minute=now.minute // 15 * 15, second=0, microsecond=0) + timedelta(minutes=15)
+
+
+def remaining(deadline, limit=None):
+    """Returns the seconds left until the deadline, at most limit and never negative."""
+    left = max(0.0, (deadline - datetime.now(deadline.tzinfo)).total_seconds())
+    return left if limit is None else min(left, limit)
+
+
+async def sleep_until(deadline, wake=None):
+    """
+    Sleeps until the wall-clock deadline, or until the asyncio.Event wake is set, which it clears.
+    The remaining time is measured again after every step, so clock adjustments and a suspended Pi
+    do not make us oversleep.
+    """
+    while True:
+        left = remaining(deadline)
+        if left <= 0:
+            return
+        if wake is None:
+            await asyncio.sleep(min(left, 60))
+            continue
+        try:
+            await asyncio.wait_for(wake.wait(), min(left, 60))
+        except asyncio.TimeoutError:
+            continue
+        wake.clear()
+        return
@@ -16,101 +16,205 @@
 
 # module: sensibo.py – A module for interacting with the Sensibo API to control air conditioning units (heat pump).
 
-import os
+import time
 import requests
 import logging
+import threading
+from . import breaker
+from . import config
+from . import httppool
 
-# Static global variables
-DEVICE_ID = os.getenv("SENSIBO_DEVICE_ID")
-URL = f"https://home.sensibo.com/api/v2/pods/{DEVICE_ID}/acStates" # Sensibo API endpoint for fetching user pod information
-SENSIBO_API_KEY = os.getenv("SENSIBO_API_KEY")
+URL = "https://home.sensibo.com/api/v2/pods/{pod}/acStates"  # Sensibo API endpoint for fetching user pod information
 
-# Set up logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+STATE_TTL = 10  # Seconds a read state is reused, reads within this window share one request
+FIELDS = "acState,mainMeasurementsSensor"  # The only fields we read
+
+
+class _Pod:
+    """A Sensibo pod and its cached state."""
+
+    def __init__(self, pod, api_key):
+        self.url = URL.format(pod=pod)
+        self.api_key = api_key
+        self.breaker = breaker.key("sensibo", pod)  # A pod that is gone does not hold up the others
+        self.state = None  # Last acStates response
+        self.state_time = 0.0  # time.monotonic() when state was read or updated
+        self.reading = None  # threading.Event of the read in progress, if any
+
+
+_pods = {}  # Pod id -> _Pod
+_lock = threading.Lock()
 
 def handle_error(response):
     logging.error(f"Error {response.status_code}: {response.text}")
 
 
-def status():
-    # Define the parameters to include in the request
-    params = {
-        'fields': '*',  # Fetch all fields
-        'apiKey': SENSIBO_API_KEY
-    }
-    
-    # Send a GET request to the Sensibo API
-    response = requests.get(URL, params=params, timeout=10)
+def _pod(home=None, pod=None):
+    """Returns the given pod of a home, its first pod by default."""
+    home = home or config.default()
+    if pod is None:
+        if not home.sensibo_pods:
+            raise ValueError(f"No Sensibo pod configured for {home.name}.")
+        pod = home.sensibo_pods[0]
+    with _lock:
+        if pod not in _pods:
+            _pods[pod] = _Pod(pod, home.sensibo_api_key)
+        return _pods[pod]
+
+
+def _cached_state(pod, max_age):
+    if pod.state is not None and time.monotonic() - pod.state_time < max_age:
+        return pod.state
+    return None
+
+
+def _get_state(pod):
+    params = {'fields': FIELDS, 'limit': 1, 'apiKey': pod.api_key}
+    response = httppool.session(pod.url).get(pod.url, params=params, timeout=10)
+    if response.status_code != 200:
+        handle_error(response)
+        return None
+    return response.json()
+
+
+def _read_state(max_age=STATE_TTL, home=None, pod=None):
+    """
+    Returns the latest acStates response of a pod, or None if it could not be read.
+    A state younger than max_age seconds is reused, and callers that ask while a read is
+    in progress wait for it instead of sending their own request.
+    """
+    pod = _pod(home, pod)
+    with _lock:
+        cached = _cached_state(pod, max_age)
+        if cached is not None:
+            return cached
+        reading = pod.reading
+        if reading is None:
+            pod.reading = threading.Event()
+
+    if reading is not None:
+        reading.wait(timeout=15)
+        with _lock:
+            return _cached_state(pod, max_age)
 
-    # Check if the request was successful
-    if response.status_code == 200:
-        # Parse the JSON response
-        data = response.json()
+    try:
+        data = breaker.call(pod.breaker, _get_state, pod)
+        if data is None:
+            return None
+        with _lock:
+            pod.state = data
+            pod.state_time = time.monotonic()
         return data
-    else:
+    finally:
+        with _lock:
+            event, pod.reading = pod.reading, None
+        event.set()
+
+
+def status(home=None, pod=None):
+    data = _read_state(home=home, pod=pod)
+    if data is None:
         # If the request failed, print the status code and error message
-        print(f"Failed to retrieve data. Status code: {response.status_code}")
-        return None
+        print("Failed to retrieve data.")
+    return data
 
-def send_post_request(data):
+def _post_state(pod, data):
     headers = {'Content-Type': 'application/json'}
-    response = requests.post(URL, headers=headers, json=data, params={'apiKey': SENSIBO_API_KEY}, timeout=10)
+    response = httppool.session(pod.url).post(pod.url, headers=headers, json=data, params={'apiKey': pod.api_key}, timeout=10)
+    if response.status_code != 200:
+        handle_error(response)
+        return None
+    return response.json()
+
+def send_post_request(data, home=None, pod=None):
+    pod = _pod(home, pod)
+    result = breaker.call(pod.breaker, _post_state, pod, data)
 
-    if response.status_code == 200:
+    if result is not None:
         logging.info("AC state updated successfully!")
-        return response.json()
+        with _lock:
+            try:
+                # Keep the cache in step with what we just sent
+                pod.state['result'][0]['acState'].update(data['acState'])
+                pod.state_time = time.monotonic()
+            except (KeyError, IndexError, TypeError):
+                pod.state_time = 0.0
+        return result
     else:
-        handle_error(response)
+        with _lock:
+            pod.state_time = 0.0  # The device state is uncertain, read it again next time
         return None
 
-def on(mode="heat"):
-    data = {"acState": {"on": True, "mode": mode}}
-    return send_post_request(data)
+def _set_state(ac_state, home=None, pod=None):
+    """
+    Sends the requested acState unless the device is already in it.
+    Returns the response, or the cached state when nothing had to be sent.
+    """
+    data = _read_state(home=home, pod=pod)
+    if data is not None:
+        current = data['result'][0]['acState']
+        if all(current.get(key) == value for key, value in ac_state.items()):
+            logging.info(f"AC state already {ac_state}, nothing to send.")
+            return data
+    return send_post_request({"acState": ac_state}, home, pod)
 
-def off():
-    data = {"acState": {"on": False}}
-    return send_post_request(data)
+def on(mode="heat", home=None, pod=None):
+    return _set_state({"on": True, "mode": mode}, home, pod)
 
-def setTemp(temp):
-    data = {"acState": {"targetTemperature": temp}}
-    return send_post_request(data)        
+def off(home=None, pod=None):
+    return _set_state({"on": False}, home, pod)
 
-def getTemp():
-    params = {'fields': '*', 'apiKey': SENSIBO_API_KEY}
-    response = requests.get(URL, params=params, timeout=10)
+def setTemp(temp, home=None, pod=None):
+    return _set_state({"targetTemperature": temp}, home, pod)
 
-    if response.status_code == 200:
-        data = response.json()
+def getTemp(home=None, pod=None):
+    data = _read_state(home=home, pod=pod)
+
+    if data is not None:
         try:
             target_temperature = data['result'][0]['mainMeasurementsSensor']['measurements']['temperature']
             return target_temperature
-        except KeyError:
+        except (KeyError, IndexError):
             logging.error("Temperature data not found in the response")
             return None
     else:
-        handle_error(response)
         return None
     
 
-def getSystemStatus():
-    data = status()  # Using the status function
+def _system_status(data):
+    ac_state = data['result'][0]['acState']
+    return {
+        "is_on": ac_state['on'],
+        "mode": ac_state['mode'],
+        "target_temperature": ac_state.get('targetTemperature', 'N/A')
+    }
+
+def getSystemStatus(home=None, pod=None):
+    data = status(home, pod)  # Using the status function
     if data:
-        ac_state = data['result'][0]['acState']
-        return {
-            "is_on": ac_state['on'],
-            "mode": ac_state['mode'],
-            "target_temperature": ac_state.get('targetTemperature', 'N/A')
-        }
+        return _system_status(data)
     return None
 
-def check_connection():
+def cached_status(home=None, pod=None):
+    """
+    Returns (status, Unix time it was read) of a pod from the last state read or set, without a
+    request. Returns (None, None) if nothing has been read yet or the last command left the state uncertain.
+    """
+    pod = _pod(home, pod)
+    with _lock:
+        data, read = pod.state, pod.state_time
+    if data is None or not read:
+        return None, None
+    return _system_status(data), time.time() - (time.monotonic() - read)
+
+def check_connection(home=None):
     """
-    Check if the Sensibo API is reachable.
+    Check if the Sensibo API is reachable for every pod of a home, using recently read states when there are any.
     Returns True if reachable, False otherwise.
     """
+    home = home or config.default()
     try:
-        response = requests.get(URL, params={'apiKey': SENSIBO_API_KEY}, timeout=5)
-        return response.status_code == 200
+        return all(_read_state(home=home, pod=pod) is not None for pod in home.sensibo_pods)
     except requests.exceptions.RequestException as e:
         logging.error(f"Error checking connection: {e}")
-        return False
\ No newline at end of file
+        return False
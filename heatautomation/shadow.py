@@ -0,0 +1,105 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# module: shadow.py – Runs other decision strategies next to the one that drives the devices, on the same inputs.
+#
+# Every cycle the price and temperature the controller fetched are handed to each strategy in
+# SHADOW. Only the primary decision reaches the devices, the others are recorded with the cost per
+# hour of the heat source they picked and the time they took to decide. Between cycles every
+# strategy is charged its last cost per hour, so the totals show what each would have cost since
+# they started. The strategies are the decision functions of main, which registers them when it is
+# imported, so the shadow decisions are the ones those rules would really make. They take the price
+# and temperature of the cycle and never touch the network.
+#
+#     shadow.register("cautious", lambda price, temperature: main.evaluate_heater(price + 0.2))
+
+import os
+import time
+import threading
+from . import cache
+from . import config
+from . import costmodel
+from . import metrics
+
+# Strategies evaluated next to the primary one, "" turns shadow mode off
+SHADOW = [name for name in os.getenv("HEATAUTOMATION_SHADOW", "price,temperature,optimize").split(",") if name]
+TOTALS_FILE = "shadow_{home}.json"
+MAX_GAP = 2 * 3600  # Seconds, a longer gap between cycles is only charged this long
+PRIMARY = "primary"
+
+# Name -> function(price, temperature) returning "heatpump" or "pelletstove", filled in by main.
+# The planner is left out, the primary decision already is the plan.
+STRATEGIES = {}
+
+_totals = {}  # Home name -> {strategy: {"cost": SEK, "since": Unix time, "rate": SEK/h, "at": Unix time}}
+_lock = threading.Lock()
+
+
+def register(name, strategy):
+    """Adds a strategy that can be listed in HEATAUTOMATION_SHADOW."""
+    STRATEGIES[name] = strategy
+
+
+def _cost_per_hour(model, heater, price, temperature):
+    if temperature is None:
+        return None  # Without a temperature the heat demand is unknown
+    cost = float(model.slot_costs(price, temperature)[costmodel.MODES.index(heater)])
+    if cost == float("inf"):
+        cost = float(model.heat_demand(temperature) * model.pellet_cost)  # Made up with pellets, like in the backtest
+    return cost
+
+
+def _charge(totals, name, rate, now):
+    """Charges a strategy for the time since its last decision at its last rate, then starts its new rate."""
+    total = totals.setdefault(name, {"cost": 0.0, "since": now, "rate": None, "at": now})
+    if total["rate"] is not None:
+        total["cost"] += total["rate"] * min(now - total["at"], MAX_GAP) / 3600
+    total["rate"] = rate
+    total["at"] = now
+    return total["cost"]
+
+
+def evaluate(price, temperature, primary, primary_ns=None, home=None, model=costmodel.DEFAULT, now=None):
+    """
+    Evaluates the SHADOW strategies on the inputs of a cycle and records them next to the primary
+    decision, which took primary_ns to make. Returns {strategy: {"decision", "cost_per_hour", "cost",
+    "us"}}, where cost is the total since the strategy was first recorded.
+    """
+    home = home or config.default()
+    now = time.time() if now is None else now
+    results = {PRIMARY: {"decision": primary, "us": primary_ns / 1000 if primary_ns is not None else None}}
+    for name in SHADOW:
+        strategy = STRATEGIES.get(name)
+        if strategy is None:
+            continue
+        started = time.perf_counter_ns()
+        decision = strategy(price, temperature)
+        results[name] = {"decision": decision, "us": (time.perf_counter_ns() - started) / 1000}
+
+    with _lock:
+        if home.name not in _totals:
+            _totals[home.name] = cache.load(TOTALS_FILE.format(home=home.name)) or {}
+        totals = _totals[home.name]
+        for name, result in results.items():
+            result["cost_per_hour"] = _cost_per_hour(model, result["decision"], price, temperature)
+            result["cost"] = _charge(totals, name, result["cost_per_hour"], now)
+        cache.save(TOTALS_FILE.format(home=home.name), totals)
+
+    for name, result in results.items():
+        metrics.gauge("shadow_cost_sek", result["cost"], home=home.name, strategy=name)
+        if result["us"] is not None:
+            metrics.gauge("shadow_decision_microseconds", round(result["us"], 1), home=home.name, strategy=name)
+    return results
@@ -14,70 +14,189 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-# module: smhi.py – A module for fetching outdoor temperature from SMHI using Selenium.
-
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.options import Options
+# module: smhi.py – A module for fetching the outdoor temperature forecast from the SMHI open data API.
+
+import os
+import math
+import time
+import bisect
 import logging
-import shutil
+import threading
+from datetime import datetime, timedelta, timezone
+import requests
+from . import breaker
+from . import cache
+from . import config
+from . import httppool
+from . import metrics
+
+FORECAST_URL = os.getenv(
+    "SMHI_FORECAST_URL",
+    "https://opendata-download-metfcst.smhi.se/api/category/pmp3g/version/2/geotype/point/lon/{lon}/lat/{lat}/data.json",
+)
+CACHE_TTL = float(os.getenv("SMHI_CACHE_TTL", 3600))  # Seconds before the forecast is revalidated
+MAX_AGE = float(os.getenv("SMHI_MAX_AGE", 24 * 3600))  # Seconds an unrevalidated forecast is still used
+CACHE_FILE = "smhi_forecast_{lat}_{lon}.json"
+GRID_STEP = 0.02  # Degrees, homes closer than the SMHI grid spacing (about 2.5 km) share one forecast
+
+_forecasts = {}  # Grid point -> {"fetched", "etag", "last_modified", "times", "temps"}, times as aware UTC datetimes
+_locks = {}  # Grid point -> lock held while its forecast is revalidated
+_lock = threading.Lock()
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).astimezone(timezone.utc)
+
 
-# Setup logging for better error tracking
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+def _parse_forecast(data):
+    """Returns (times, temperatures) from an SMHI point forecast, sorted by time."""
+    series = []
+    for point in data.get("timeSeries", []):
+        temp = None
+        if "parameters" in point:  # pmp3g format
+            for parameter in point["parameters"]:
+                if parameter.get("name") == "t":
+                    temp = parameter["values"][0]
+                    break
+            valid_time = point.get("validTime")
+        else:  # snow1g format
+            temp = point.get("data", {}).get("air_temperature")
+            valid_time = point.get("time")
+        if temp is not None and valid_time:
+            series.append((_parse_time(valid_time), float(temp)))
+    series.sort()
+    return [t for t, _ in series], [v for _, v in series]
 
-def get_outdoor_temp():
-    url = "https://www.smhi.se/vader/prognoser-och-varningar/vaderprognos/q/hagge/2709191"
 
-    # Configure Chrome to run in headless mode
-    options = Options()
-    options.add_argument("--headless")  # Run without opening a window
-    options.add_argument("--disable-gpu")  # Disable GPU acceleration
-    options.add_argument("--no-sandbox")  # Needed for running as root in some environments
-    options.add_argument("--disable-dev-shm-usage")  # Prevent issues with shared memory
+def grid_point(home=None):
+    """Returns the (lat, lon) forecast point of a home, snapped to GRID_STEP."""
+    home = home or config.default()
+    return tuple(round(math.floor(value / GRID_STEP + 0.5) * GRID_STEP, 4) for value in (home.lat, home.lon))
 
-    chromedriver_path = shutil.which("chromedriver")
-    if not chromedriver_path:
-        raise RuntimeError("chromedriver not found in PATH")
-    driver = webdriver.Chrome(service=Service(chromedriver_path), options=options)
 
+def _load_cached(point):
+    data = cache.load(CACHE_FILE.format(lat=point[0], lon=point[1]))
+    if not data:
+        return None
     try:
-        # Open the target URL
-        driver.get(url)
-
-        # Wait until the temperature element is present
-        wait = WebDriverWait(driver, 10)
-        temperature_element = wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, 'span._asH1_1bwlw_168')))
-        
-        # Get the temperature text
-        temperature = temperature_element.text.strip()
-        
-        if not temperature:
-            logging.warning("Temperature value is empty!")
+        return {
+            "fetched": data["fetched"],
+            "etag": data.get("etag"),
+            "last_modified": data.get("last_modified"),
+            "times": [_parse_time(t) for t in data["times"]],
+            "temps": data["temps"],
+        }
+    except (KeyError, TypeError, ValueError) as e:
+        logging.warning(f"Ignoring malformed SMHI forecast cache: {e}")
+        return None
+
+
+def _save_cached(point, forecast):
+    data = dict(forecast, times=[t.isoformat() for t in forecast["times"]])
+    cache.save(CACHE_FILE.format(lat=point[0], lon=point[1]), data)
+
+
+@metrics.timed("smhi", "fetch")
+def _fetch(point, previous):
+    """Fetches the forecast for a grid point, revalidating the cached copy with ETag/Last-Modified when there is one."""
+    url = FORECAST_URL.format(lat=f"{point[0]:.4f}", lon=f"{point[1]:.4f}")
+    headers = {}
+    if previous:
+        if previous.get("etag"):
+            headers["If-None-Match"] = previous["etag"]
+        if previous.get("last_modified"):
+            headers["If-Modified-Since"] = previous["last_modified"]
+
+    response = httppool.session(url).get(url, headers=headers, timeout=10)
+    if response.status_code == 304 and previous:
+        logging.info("SMHI forecast not modified, keeping the cached copy.")
+        return dict(previous, fetched=time.time())
+    response.raise_for_status()
+
+    times, temps = _parse_forecast(response.json())
+    if not times:
+        raise ValueError("No temperatures found in the SMHI forecast.")
+    logging.info(f"Fetched SMHI forecast with {len(times)} points.")
+    return {
+        "fetched": time.time(),
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "times": times,
+        "temps": temps,
+    }
+
+
+def get_forecast(home=None):
+    """
+    Returns the current forecast for the grid point of the home, served from memory and revalidated
+    against SMHI at most once per CACHE_TTL. Falls back to the last known forecast if SMHI cannot be
+    reached, for at most MAX_AGE. Returns None if there is none.
+    """
+    point = grid_point(home)
+    with _lock:
+        lock = _locks.setdefault(point, threading.Lock())
+    # Homes on the same grid point wait for one fetch instead of each sending their own
+    with lock:
+        forecast = _forecasts.get(point)
+        if forecast is None:
+            forecast = _forecasts[point] = _load_cached(point)
+        if forecast is None or time.time() - forecast["fetched"] >= CACHE_TTL:
+            try:
+                with breaker.guard("smhi"):
+                    forecast = _forecasts[point] = _fetch(point, forecast)
+                _save_cached(point, forecast)
+            except breaker.CircuitOpen as e:
+                logging.info(f"Using the cached SMHI forecast: {e}")
+            except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                logging.error(f"Error occurred while fetching the SMHI forecast: {e}")
+        if forecast is not None and time.time() - forecast["fetched"] >= MAX_AGE:
+            logging.warning(f"The SMHI forecast is {(time.time() - forecast['fetched']) / 3600:.0f} hours old, not using it.")
             return None
+        return forecast
+
+
+def _as_utc(ts):
+    # Naive timestamps are taken as local time, like datetime.now()
+    return ts.astimezone(timezone.utc)
 
-        # Remove the degree symbol and handle special minus characters
-        temperature = temperature.replace("°", "").replace("−", "-")
-        temperature_int = int(temperature)
 
-        logging.info(f"Current temperature: {temperature_int}°")
-        return temperature_int
+def get_temperature_at(ts, home=None):
+    """Returns the forecast temperature for the hour containing ts, or None if it is not covered."""
+    forecast = get_forecast(home)
+    if not forecast:
+        return None
+    times = forecast["times"]
+    ts = _as_utc(ts)
+    index = bisect.bisect_right(times, ts) - 1
+    if index < 0:
+        # The forecast starts at the next whole hour, let its first point cover the current one
+        return forecast["temps"][0] if times[0] - ts <= timedelta(hours=1) else None
+    if index == len(times) - 1 and ts - times[index] >= timedelta(hours=1):
+        return None
+    return forecast["temps"][index]
+
 
-    except Exception as e:
-        logging.error(f"Error occurred while fetching the temperature: {e}")
+def get_outdoor_temp(home=None):
+    temperature = get_temperature_at(datetime.now(timezone.utc), home)
+    if temperature is None:
+        logging.warning("No temperature available for the current hour!")
         return None
+    logging.info(f"Current temperature: {temperature}°")
+    return temperature
+
+
+def get_temperature_series(start, end, home=None):
+    """Returns the forecast points as a list of (time, temperature) with start <= time < end."""
+    forecast = get_forecast(home)
+    if not forecast:
+        return []
+    times = forecast["times"]
+    first = bisect.bisect_left(times, _as_utc(start))
+    last = bisect.bisect_left(times, _as_utc(end))
+    return list(zip(times[first:last], forecast["temps"][first:last]))
+
 
-    finally:
-        # Always close the browser session
-        driver.quit()
-
-# Example usage
-if __name__ == "__main__":
-    temperature = get_outdoor_temp()
-    if temperature is not None:
-        logging.info(f"Fetched temperature: {temperature}°")
-    else:
-        logging.error("Failed to fetch the temperature.")
+def last_update(home=None):
+    """Returns when the forecast for the home's grid point was fetched or revalidated, as a Unix timestamp."""
+    forecast = _forecasts.get(grid_point(home))
+    return forecast["fetched"] if forecast else None
@@ -0,0 +1,225 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# module: store.py – An append-only SQLite time-series store for the inputs, decisions and device states of every cycle.
+#
+# record() only puts the row on a queue, a background thread writes the queue in batches, so the
+# control loop never waits on the disk. Rows are keyed by their Unix time, which makes time ranges
+# index range scans. Rows older than RAW_RETENTION are rolled up into hourly averages, which are
+# kept for HOURLY_RETENTION. Every home has its own database, the unnamed default home uses DB_PATH
+# (heatautomation.db in the cache directory by default).
+
+import os
+import json
+import time
+import queue
+import atexit
+import sqlite3
+import logging
+import threading
+from contextlib import closing, contextmanager
+from . import cache
+from . import config
+
+DB_PATH = os.getenv("HEATAUTOMATION_DB")  # The cache directory's heatautomation.db when not set
+RAW_RETENTION = 90 * 86400  # Seconds cycle rows are kept as they are
+HOURLY_RETENTION = 5 * 365 * 86400  # Seconds hourly averages are kept
+BATCH_SIZE = 100
+FLUSH_INTERVAL = 5.0  # Seconds a row may wait in the queue
+MAINTENANCE_INTERVAL = 86400  # Seconds between roll-ups
+
+COLUMNS = ("ts", "price", "temperature", "decision", "heatpump_on", "pelletstove_on",
+           "cycle_seconds", "devices_seconds", "details")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cycles (
+    ts INTEGER PRIMARY KEY,  -- Unix time of the cycle
+    price REAL,              -- Spot price, SEK/kWh
+    temperature REAL,        -- Outdoor temperature, °C
+    decision TEXT,           -- Chosen heat source
+    heatpump_on INTEGER,     -- Confirmed device states, NULL when unknown
+    pelletstove_on INTEGER,
+    cycle_seconds REAL,
+    devices_seconds REAL,
+    details TEXT             -- JSON with the per-call latencies of the cycle
+);
+CREATE TABLE IF NOT EXISTS cycles_hourly (
+    hour INTEGER PRIMARY KEY,  -- Unix time of the start of the hour
+    samples INTEGER,
+    price REAL,
+    temperature REAL,
+    heatpump_share REAL,       -- Share of the cycles that chose the heat pump
+    pelletstove_share REAL,
+    cycle_seconds REAL
+);
+"""
+
+_queue = queue.Queue()
+_writer = None
+_lock = threading.Lock()
+
+
+def db_path(home=None):
+    """Returns the database file of the named home. The cache directory is only created when it is used."""
+    path = DB_PATH or cache.path("heatautomation.db")
+    if home is None or home == config.DEFAULT_NAME:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}_{home}{ext}"
+
+
+def connect(path=None):
+    """Opens the store, creating the tables if needed."""
+    connection = sqlite3.connect(path or db_path(), timeout=30)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")  # Safe with WAL, a power cut loses at most the last batch
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def record(ts, price=None, temperature=None, decision=None, heatpump_on=None, pelletstove_on=None,
+           cycle_seconds=None, devices_seconds=None, details=None, home=None):
+    """Queues one cycle of the named home for writing. Never blocks on the disk."""
+    _start_writer()
+    row = (int(ts), price, temperature, decision,
+           None if heatpump_on is None else int(heatpump_on),
+           None if pelletstove_on is None else int(pelletstove_on),
+           cycle_seconds, devices_seconds, json.dumps(details) if details is not None else None)
+    _queue.put((db_path(home), row))
+
+
+def flush():
+    """Waits until every queued row has been written."""
+    if _writer is not None:
+        _queue.join()
+
+
+def _start_writer():
+    global _writer
+    with _lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_write_loop, name="store-writer", daemon=True)
+            _writer.start()
+            atexit.register(flush)
+
+
+def _write_loop():
+    connections = {}  # Database file -> connection
+    last_maintenance = {}  # Database file -> time.time() of the last roll-up
+    while True:
+        batch = [_queue.get()]
+        deadline = time.monotonic() + FLUSH_INTERVAL
+        while len(batch) < BATCH_SIZE:
+            try:
+                batch.append(_queue.get(timeout=max(0.0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        rows = {}  # Database file -> rows, one transaction each
+        for path, row in batch:
+            rows.setdefault(path, []).append(row)
+        for path, values in rows.items():
+            try:
+                if path not in connections:
+                    connections[path] = connect(path)
+                connection = connections[path]
+                with connection:
+                    connection.executemany(
+                        f"INSERT OR REPLACE INTO cycles ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                        values)
+                if time.time() - last_maintenance.get(path, 0.0) > MAINTENANCE_INTERVAL:
+                    maintain(connection)
+                    last_maintenance[path] = time.time()
+            except sqlite3.Error as e:
+                logging.error(f"Could not write {len(values)} cycles to {path}: {e}")
+        for _ in batch:
+            _queue.task_done()
+
+
+def maintain(connection, now=None):
+    """Rolls cycle rows older than RAW_RETENTION up into hourly averages and drops expired data."""
+    now = time.time() if now is None else now
+    cutoff = int(now - RAW_RETENTION) // 3600 * 3600  # Only whole hours are rolled up
+    with connection:
+        connection.execute("""
+            INSERT OR REPLACE INTO cycles_hourly
+            SELECT ts / 3600 * 3600, COUNT(*), AVG(price), AVG(temperature),
+                   AVG(decision = 'heatpump'), AVG(decision = 'pelletstove'), AVG(cycle_seconds)
+            FROM cycles WHERE ts < ? GROUP BY ts / 3600
+        """, (cutoff,))
+        connection.execute("DELETE FROM cycles WHERE ts < ?", (cutoff,))
+        connection.execute("DELETE FROM cycles_hourly WHERE hour < ?", (int(now - HOURLY_RETENTION),))
+
+
+@contextmanager
+def _connection(connection, home):
+    # The given connection, or one to the home's store that is closed afterwards
+    if connection is not None:
+        yield connection
+        return
+    with closing(connect(db_path(home))) as connection:
+        yield connection
+
+
+def query(start, end, connection=None, home=None):
+    """Returns the cycles of the named home with start <= ts < end as dicts, oldest first."""
+    with _connection(connection, home) as connection:
+        rows = connection.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM cycles WHERE ts >= ? AND ts < ? ORDER BY ts",
+            (int(start), int(end))).fetchall()
+    result = []
+    for row in rows:
+        item = dict(zip(COLUMNS, row))
+        item["details"] = json.loads(item["details"]) if item["details"] else None
+        result.append(item)
+    return result
+
+
+def downsample(start, end, bucket_seconds=3600, connection=None, home=None):
+    """
+    Returns averages per bucket with start <= ts < end, from the cycle rows and the hourly
+    roll-ups together, as dicts with bucket, samples, price, temperature and heatpump_share.
+    Buckets shorter than an hour only have data for the period still kept as cycle rows.
+    """
+    bucket = int(bucket_seconds)
+    # Every average only counts the samples that have the value, cycles without a price are not zeros
+    with _connection(connection, home) as connection:
+        rows = connection.execute("""
+            SELECT ts / :bucket * :bucket AS b, SUM(n),
+                   SUM(price * n) / SUM(CASE WHEN price IS NOT NULL THEN n END),
+                   SUM(temperature * n) / SUM(CASE WHEN temperature IS NOT NULL THEN n END),
+                   SUM(hp * n) / SUM(CASE WHEN hp IS NOT NULL THEN n END)
+            FROM (
+                SELECT hour AS ts, samples AS n, price, temperature, heatpump_share AS hp
+                FROM cycles_hourly WHERE hour >= :start AND hour < :end
+                UNION ALL
+                SELECT ts, 1, price, temperature, decision = 'heatpump'
+                FROM cycles WHERE ts >= :start AND ts < :end
+            )
+            GROUP BY b ORDER BY b
+        """, {"bucket": bucket, "start": int(start), "end": int(end)}).fetchall()
+    keys = ("bucket", "samples", "price", "temperature", "heatpump_share")
+    return [dict(zip(keys, row)) for row in rows]
+
+
+def last(connection=None, home=None):
+    """Returns the most recent cycle of the named home, or None."""
+    with _connection(connection, home) as connection:
+        row = connection.execute(f"SELECT {', '.join(COLUMNS)} FROM cycles ORDER BY ts DESC LIMIT 1").fetchone()
+    if row is None:
+        return None
+    item = dict(zip(COLUMNS, row))
+    item["details"] = json.loads(item["details"]) if item["details"] else None
+    return item
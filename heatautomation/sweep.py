@@ -0,0 +1,228 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# module: sweep.py – Tunes the decision parameters by replaying historical data for many candidates in parallel.
+#
+# Usage: python -m heatautomation.sweep prices.csv temperatures.csv [--param max_price_threshold=2:4:0.25 ...]
+#            [--random 5000] [--strategy optimize] [--workers 8] [--top 20] [--csv results.csv]
+#
+# A parameter is swept over start:stop:step (stop included) or a list a,b,c. Without --param the
+# whole SPACE is searched, a full grid by default or --random candidates drawn from it. The price
+# and temperature history is written once to a .npy file that every worker maps read-only, so a
+# task carries only its parameters. Each candidate decides with its own parameters, but its cost
+# is always counted with the reference cost model, so the candidates are compared on the same bill.
+
+import os
+import csv
+import time
+import random
+import argparse
+import itertools
+import logging
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from . import backtest
+from . import costmodel
+from . import planner
+
+# Parameter -> (start, stop, step) searched by default, stop included
+SPACE = {
+    "max_price_threshold": (2.0, 4.0, 0.25),  # SEK/kWh, evaluate_heater_with_temperature's max_price_threshold
+    "price_adjustment": (0.75, 1.15, 0.05),  # SEK/kWh, fixed cost on top of the spot price
+    "min_capacity": (2.5, 4.5, 0.25),  # kW, heat pump capacity below which the stove takes over
+    "capacity_scale": (0.8, 1.2, 0.1),  # Factor on the heat pump capacity curve
+    "scop": (3.0, 4.6, 0.4),  # Used by the optimize strategy's cost veto
+}
+BATCH = 64  # Candidates per task
+
+# Set in every worker by _attach
+_data = None  # Read-only memory map of TIMES, PRICES, TEMPS, HOURS and the reference costs per mode
+TIMES, PRICES, TEMPS, HOURS = range(4)
+COSTS = 4  # First of the len(costmodel.MODES) rows of reference costs
+
+
+def _values(spec):
+    """Parses start:stop:step or a,b,c into a list of values."""
+    if ":" in spec:
+        start, stop, step = (float(part) for part in spec.split(":"))
+        if step <= 0:
+            raise ValueError(f"Step of {spec} must be positive.")
+        return [round(value, 10) for value in np.arange(start, stop + step / 2, step)]
+    return [float(part) for part in spec.split(",")]
+
+
+def grid(space):
+    """Yields every combination of a space of parameter -> list of values, as dicts."""
+    names = list(space)
+    for values in itertools.product(*(space[name] for name in names)):
+        yield dict(zip(names, values))
+
+
+def sample(space, count, seed=None):
+    """Yields count candidates drawn uniformly between the lowest and highest value of every parameter."""
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield {name: round(rng.uniform(min(values), max(values)), 4) for name, values in space.items()}
+
+
+def model_for(params, base=costmodel.DEFAULT):
+    """Returns the cost model with the candidate's parameters, the reference values for the rest."""
+    scale = params.get("capacity_scale", 1.0)
+    return costmodel.CostModel(
+        capacity_curve=[(temp, value * scale) for temp, value in zip(base.capacity_temps, base.capacity_values)],
+        cop_curve=list(zip(base.cop_temps, base.cop_values)),
+        pellet_price=base.pellet_price,
+        price_adjustment=params.get("price_adjustment", base.price_adjustment),
+        max_price_threshold=params.get("max_price_threshold", base.max_price_threshold),
+        min_capacity=params.get("min_capacity", base.min_capacity),
+        balance_temp=base.balance_temp,
+        heat_loss=base.heat_loss,
+        scop=params.get("scop", base.scop),
+    )
+
+
+def load(rows, path, reference=costmodel.DEFAULT):
+    """
+    Writes (time, price, temperature) rows and their reference costs per mode to a .npy file at path.
+    Returns the number of slots.
+    """
+    table = np.array(list(rows), dtype=float).reshape(-1, 3)
+    data = np.empty((COSTS + len(costmodel.MODES), len(table)))
+    data[[TIMES, PRICES, TEMPS]] = table.T
+    if len(table):
+        gaps = np.minimum(np.diff(data[TIMES]), backtest.MAX_SLOT) / 3600
+        # The very last slot is as long as the one before it, like in the backtest
+        data[HOURS] = np.append(gaps, gaps[-1] if len(gaps) else 1.0)
+        costs = reference.slot_costs(data[PRICES], data[TEMPS], data[HOURS])
+        # A slot the chosen source cannot cover is paid for with pellets, like in the backtest
+        data[COSTS:] = np.where(np.isinf(costs), costs[costmodel.PELLETSTOVE], costs)
+    np.save(path, data)
+    return len(table)
+
+
+def _attach(path):
+    global _data
+    _data = np.load(path, mmap_mode="r")
+
+
+def evaluate(params, strategy="optimize"):
+    """Returns (total cost in SEK, switches) of a candidate over the data of this worker."""
+    decisions = backtest.STRATEGIES[strategy](model_for(params), _data[PRICES], _data[TEMPS], _data[HOURS], None)
+    cost = float(np.take_along_axis(_data[COSTS:], decisions[np.newaxis].astype(np.intp), 0).sum())
+    return cost, int(np.count_nonzero(decisions[1:] != decisions[:-1]))
+
+
+def _evaluate_batch(batch, strategy):
+    return [evaluate(params, strategy) for params in batch]
+
+
+def _batches(candidates, size=BATCH):
+    candidates = iter(candidates)
+    while True:
+        batch = list(itertools.islice(candidates, size))
+        if not batch:
+            return
+        yield batch
+
+
+def sweep(rows, candidates, strategy="optimize", workers=None, switch_penalty=planner.SWITCH_PENALTY):
+    """
+    Evaluates the candidates over the rows on a process pool. Returns (reference, results): the
+    result of the reference parameters and those of the candidates, cheapest first counting
+    switch_penalty SEK per switch. A result is a dict with params, cost, switches and score.
+    """
+    global _data
+    with tempfile.TemporaryDirectory(prefix="heatautomation-sweep-") as directory:
+        path = os.path.join(directory, "data.npy")
+        if not load(rows, path):
+            return None, []
+        _attach(path)
+        reference = dict(zip(("cost", "switches"), evaluate({}, strategy)), params={})
+
+        candidates = list(candidates)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach, initargs=(path,)) as pool:
+            outcomes = pool.map(_evaluate_batch, _batches(candidates), itertools.repeat(strategy))
+            results = [{"params": params, "cost": cost, "switches": switches}
+                       for params, (cost, switches) in zip(candidates, itertools.chain.from_iterable(outcomes))]
+        _data = None  # Release the map before the file is removed
+
+    for result in results + [reference]:
+        result["score"] = result["cost"] + switch_penalty * result["switches"]
+    results.sort(key=lambda result: (result["score"], result["switches"]))
+    return reference, results
+
+
+def _print_table(reference, results, top):
+    names = list(results[0]["params"]) if results else []
+    print(f"{'rank':>4} {'score':>10} {'cost SEK':>10} {'vs now':>8} {'switches':>8}  "
+          + "  ".join(f"{name:>{len(name)}}" for name in names))
+    for rank, result in enumerate(results[:top], 1):
+        print(f"{rank:>4} {result['score']:>10.2f} {result['cost']:>10.2f} {result['cost'] - reference['cost']:>+8.2f} "
+              f"{result['switches']:>8}  " + "  ".join(f"{result['params'][name]:>{len(name)}g}" for name in names))
+    print(f"{'now':>4} {reference['score']:>10.2f} {reference['cost']:>10.2f} {0.0:>+8.2f} {reference['switches']:>8}  "
+          "(the current parameters)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep the decision parameters over historical prices and temperatures.")
+    parser.add_argument("prices", help="CSV or Parquet file with timestamp and spot price (SEK/kWh)")
+    parser.add_argument("temperatures", help="CSV or Parquet file with timestamp and outdoor temperature (°C)")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=SPEC",
+                        help=f"start:stop:step or a,b,c for one of {', '.join(SPACE)}; repeat for several")
+    parser.add_argument("--random", type=int, metavar="N", help="draw N random candidates instead of the full grid")
+    parser.add_argument("--seed", type=int, help="seed of the random search")
+    parser.add_argument("--strategy", choices=sorted(backtest.STRATEGIES), default="optimize")
+    parser.add_argument("--workers", type=int, help="processes, one per CPU by default")
+    parser.add_argument("--switch-penalty", type=float, default=planner.SWITCH_PENALTY,
+                        help="SEK per switch added to the cost when ranking")
+    parser.add_argument("--top", type=int, default=20, help="rows of the table")
+    parser.add_argument("--csv", help="write every result to this CSV file")
+    args = parser.parse_args()
+
+    space = {name: _values(f"{start}:{stop}:{step}") for name, (start, stop, step) in SPACE.items()}
+    if args.param:
+        space = {}
+        for param in args.param:
+            name, _, spec = param.partition("=")
+            if name not in SPACE:
+                parser.error(f"Unknown parameter {name}, expected one of {', '.join(SPACE)}.")
+            space[name] = _values(spec)
+    candidates = sample(space, args.random, args.seed) if args.random else grid(space)
+
+    started = time.perf_counter()
+    rows = backtest.merge(backtest.read_series(args.prices), backtest.read_series(args.temperatures))
+    reference, results = sweep(rows, candidates, args.strategy, args.workers, args.switch_penalty)
+    elapsed = time.perf_counter() - started
+    if reference is None:
+        logging.error("No price slots to replay.")
+        return
+
+    _print_table(reference, results, args.top)
+    print(f"Evaluated {len(results)} candidates with the {args.strategy} strategy in {elapsed:.1f} s.")
+    if args.csv:
+        with open(args.csv, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            names = list(space)
+            writer.writerow(["rank", "cost", "switches", "score"] + names)
+            for rank, result in enumerate(results, 1):
+                writer.writerow([rank, f"{result['cost']:.4f}", result["switches"], f"{result['score']:.4f}"]
+                                + [result["params"][name] for name in names])
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    main()
@@ -0,0 +1,286 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# module: thermal.py – An online thermal model of the house, used to move heat pump load into cheap slots through the Sensibo setpoint.
+#
+# Usage: python -m heatautomation.thermal [--days 14] [--seed 1]   (runs the simulated house)
+#
+# The house is modelled as one thermal mass. Over dt hours the indoor temperature changes by
+#
+#     dT = loss * (T_out - T_in) * dt + pump * max(0, T_set - T_in) * dt + stove * dt
+#
+# with the heat pump term only while it heats and the stove term only while the stove burns. The
+# three coefficients are fitted by recursive least squares from the indoor temperature the Sensibo
+# pod measures every cycle, O(1) per sample. Once the fit is trusted, schedule() raises the setpoint
+# ahead of expensive slots, as early as the model says the house needs to store the extra heat, and
+# lowers it during them.
+
+import os
+import math
+import time
+import random
+import logging
+import argparse
+from . import cache
+
+STATE_FILE = "thermal_{home}.json"
+
+# Recursive least squares
+FORGETTING = 0.998  # Per sample, about a week of half-hourly samples carries the fit
+INITIAL = (0.05, 0.5, 1.0)  # loss, pump, stove per hour, a guess for a Swedish house
+INITIAL_VARIANCE = 10.0
+MIN_SAMPLES = 48  # Samples before the model is used for setpoints
+MAX_GAP = 2.0  # Hours, samples further apart do not update the model
+
+# Setpoints
+PREHEAT = float(os.getenv("THERMAL_PREHEAT", 2))  # °C above the base setpoint before expensive slots
+SETBACK = float(os.getenv("THERMAL_SETBACK", 1.0))  # °C below the base setpoint during expensive slots
+EXPENSIVE_FRACTION = 0.25  # The most expensive part of the horizon is avoided
+MIN_SPREAD = 0.3  # SEK/kWh, smaller differences between cheap and expensive slots are not worth shifting for
+MAX_LEAD = 4.0  # Hours, the longest pre-heating before an expensive stretch
+MIN_SETPOINT, MAX_SETPOINT = 10, 30  # What the Sensibo accepts in heat mode
+
+
+def _dot(a, b):
+    return sum(x * y for x, y in zip(a, b))
+
+
+def features(indoor, outdoor, heater, setpoint, hours):
+    """Returns the regressors of one interval in which the house was heated by heater."""
+    pump = max(0.0, setpoint - indoor) if heater == "heatpump" and setpoint is not None else 0.0
+    stove = 1.0 if heater == "pelletstove" else 0.0
+    return [(outdoor - indoor) * hours, pump * hours, stove * hours]
+
+
+class ThermalModel:
+    """A recursive least squares fit of the loss, heat pump and stove coefficients of a house."""
+
+    def __init__(self, theta=INITIAL, covariance=None, samples=0, last=None, base=None):
+        self.theta = list(theta)
+        self.covariance = covariance or [[INITIAL_VARIANCE if i == j else 0.0 for j in range(3)] for i in range(3)]
+        self.samples = samples
+        self.last = last  # (Unix time, indoor, outdoor, heater, setpoint) of the previous sample
+        self.base = base  # Setpoint the user wants, shifted up and down around it
+
+    @property
+    def loss(self):
+        return self.theta[0]
+
+    @property
+    def pump(self):
+        return self.theta[1]
+
+    def trusted(self):
+        """Returns True once the fit has enough samples and is physically plausible."""
+        return self.samples >= MIN_SAMPLES and self.loss > 0 and self.pump > 0
+
+    def update(self, x, y):
+        """Adds one sample: regressors x and the observed change in indoor temperature y. Returns the prediction error."""
+        P = self.covariance
+        Px = [_dot(row, x) for row in P]
+        gain_denominator = FORGETTING + _dot(x, Px)
+        k = [v / gain_denominator for v in Px]
+        error = y - _dot(x, self.theta)
+        self.theta = [t + ki * error for t, ki in zip(self.theta, k)]
+        # P = (P - k x'P) / forgetting, with x'P = (Px)' since P is symmetric
+        self.covariance = [[(P[i][j] - k[i] * Px[j]) / FORGETTING for j in range(3)] for i in range(3)]
+        self.samples += 1
+        return error
+
+    def observe(self, ts, indoor, outdoor, heater, setpoint):
+        """
+        Records the indoor temperature measured at ts, with the outdoor temperature, heat source and
+        setpoint that apply from now on. Updates the fit from the interval since the previous sample.
+        Returns the prediction error of that interval, or None if it could not be used.
+        """
+        error = None
+        if self.last is not None:
+            last_ts, last_indoor, last_outdoor, last_heater, last_setpoint = self.last
+            hours = (ts - last_ts) / 3600
+            if 0 < hours <= MAX_GAP:
+                x = features(last_indoor, (last_outdoor + outdoor) / 2, last_heater, last_setpoint, hours)
+                error = self.update(x, indoor - last_indoor)
+        self.last = (ts, indoor, outdoor, heater, setpoint)
+        return error
+
+    def predict(self, indoor, outdoor, heater, setpoint, hours, steps=4):
+        """Returns the indoor temperature after hours, integrating the model in small steps."""
+        dt = hours / steps
+        for _ in range(steps):
+            indoor += _dot(self.theta, features(indoor, outdoor, heater, setpoint, dt))
+        return indoor
+
+    def lead_time(self, base, outdoor):
+        """Hours the heat pump needs to lift the house from base to base + PREHEAT, at most MAX_LEAD."""
+        indoor, hours, dt = base, 0.0, 0.25
+        target = base + PREHEAT * 0.9  # The approach is asymptotic
+        while indoor < target and hours < MAX_LEAD:
+            indoor = self.predict(indoor, outdoor, "heatpump", base + PREHEAT, dt, steps=1)
+            hours += dt
+        return hours
+
+    def to_json(self):
+        return {"theta": self.theta, "covariance": self.covariance, "samples": self.samples,
+                "last": self.last, "base": self.base}
+
+    @classmethod
+    def from_json(cls, data):
+        last = tuple(data["last"]) if data.get("last") else None
+        return cls(data["theta"], data["covariance"], data["samples"], last, data.get("base"))
+
+
+def schedule(model, base, prices, temperatures):
+    """
+    Returns the setpoint for each price slot as a list of (start, setpoint): base - SETBACK in the
+    expensive slots, base + PREHEAT in the lead time before each expensive stretch and base otherwise.
+    prices is a list of (start, price), temperatures a list of (time, temperature), both sorted.
+    Everything stays at base while the model is not trusted or the prices are flat. Only the
+    shifted setpoints are rounded to the whole degrees the pods take, base is returned as it is.
+    """
+    if not prices:
+        return []
+    values = sorted(price for _, price in prices)
+    threshold = values[min(len(values) - 1, int(len(values) * (1 - EXPENSIVE_FRACTION)))]
+    if not model.trusted() or threshold - values[0] < MIN_SPREAD:
+        return [(start, base) for start, _ in prices]
+
+    expensive = [price >= threshold and price - values[0] >= MIN_SPREAD for _, price in prices]
+    setpoints = [base - SETBACK if flag else base for flag in expensive]
+    slot_hours = (prices[1][0] - prices[0][0]).total_seconds() / 3600 if len(prices) > 1 else 1.0
+    for i in range(len(prices)):
+        if not expensive[i] or (i > 0 and expensive[i - 1]):
+            continue
+        # Pre-heat for the lead time before an expensive stretch, in the slots that are not expensive themselves
+        outdoor = _temperature_at(temperatures, prices[i][0])
+        lead = model.lead_time(base, outdoor) if outdoor is not None else 0.0
+        for j in range(i - 1, max(-1, i - 1 - math.ceil(lead / slot_hours)), -1):
+            if expensive[j]:
+                break
+            setpoints[j] = base + PREHEAT
+    # The pods take whole degrees
+    return [(start, setpoint if setpoint == base else min(MAX_SETPOINT, max(MIN_SETPOINT, int(math.floor(setpoint + 0.5)))))
+            for (start, _), setpoint in zip(prices, setpoints)]
+
+
+def _temperature_at(temperatures, ts):
+    value = None
+    for t, temperature in temperatures:
+        if t > ts:
+            break
+        value = temperature
+    return value if value is not None else (temperatures[0][1] if temperatures else None)
+
+
+_models = {}  # Home name -> ThermalModel
+
+
+def model(home):
+    """Returns the thermal model of a home, loaded from the cache on first use."""
+    if home.name not in _models:
+        data = cache.load(STATE_FILE.format(home=home.name))
+        try:
+            _models[home.name] = ThermalModel.from_json(data) if data else ThermalModel()
+        except (KeyError, TypeError, ValueError) as e:
+            logging.warning(f"Ignoring malformed thermal model of {home.name}: {e}")
+            _models[home.name] = ThermalModel()
+    return _models[home.name]
+
+
+def save(home):
+    cache.save(STATE_FILE.format(home=home.name), _models[home.name].to_json())
+
+
+class SimulatedHouse:
+    """A house with known coefficients and sensor noise, heated by a thermostat-controlled heat pump."""
+
+    def __init__(self, loss=0.04, pump=0.8, stove=1.2, indoor=21.0, capacity=8.0, noise=0.05, seed=1):
+        self.loss, self.pump, self.stove = loss, pump, stove
+        self.indoor = indoor
+        self.capacity = capacity  # kWh per °C, converts the heat pump term into delivered heat
+        self.noise = noise
+        self._random = random.Random(seed)
+
+    def step(self, outdoor, heater, setpoint, hours):
+        """Advances the house by hours. Returns the heat in kWh the heat pump delivered."""
+        steps = max(1, int(hours * 12))
+        dt = hours / steps
+        heat = 0.0
+        for _ in range(steps):
+            pumped = self.pump * max(0.0, setpoint - self.indoor) * dt if heater == "heatpump" else 0.0
+            self.indoor += (self.loss * (outdoor - self.indoor) * dt + pumped
+                            + (self.stove * dt if heater == "pelletstove" else 0.0))
+            heat += pumped * self.capacity
+        return heat
+
+    def measure(self):
+        """Returns the indoor temperature as a noisy sensor reads it."""
+        return round(self.indoor + self._random.gauss(0.0, self.noise), 1)
+
+
+def simulate(days=14, shift=True, seed=1, base=21.0, cop=3.0):
+    """
+    Runs the simulated house through synthetic prices and temperatures for days, with the model
+    learning from its sensor every half hour. Returns a dict with the cost, the comfort and the fit.
+    """
+    from datetime import datetime, timedelta, timezone
+    rng = random.Random(seed)
+    house = SimulatedHouse(seed=seed)
+    fitted = ThermalModel(base=base)
+    start = datetime(2025, 1, 6, tzinfo=timezone.utc)
+    slot = timedelta(minutes=30)
+    slots = days * 48
+    # Morning and evening peaks on a cold winter baseline
+    prices = [(start + slot * i, 0.6 + 1.2 * math.exp(-((i % 48) / 2 - 8) ** 2 / 4) + 1.5 * math.exp(-((i % 48) / 2 - 18) ** 2 / 4)
+               + rng.uniform(0.0, 0.2)) for i in range(slots + 48)]
+    temperatures = [(start + slot * i, -5.0 + 4.0 * math.sin(2 * math.pi * (i % 48 - 18) / 48) + rng.gauss(0.0, 0.5))
+                    for i in range(slots + 48)]
+
+    cost = heat_total = 0.0
+    coldest = float("inf")
+    for i in range(slots):
+        now, price = prices[i]
+        outdoor = temperatures[i][1]
+        setpoints = schedule(fitted, base, prices[i:i + 48], temperatures[i:i + 48]) if shift else [(now, base)]
+        setpoint = setpoints[0][1]
+        fitted.observe(now.timestamp(), house.measure(), outdoor, "heatpump", setpoint)
+        heat = house.step(outdoor, "heatpump", setpoint, 0.5)
+        cost += heat / cop * price
+        heat_total += heat
+        coldest = min(coldest, house.indoor)
+    return {"cost": cost, "heat_kwh": heat_total, "coldest": coldest, "samples": fitted.samples,
+            "loss": fitted.loss, "pump": fitted.pump, "true_loss": house.loss, "true_pump": house.pump}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the thermal model against a simulated house.")
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    fixed = simulate(args.days, shift=False, seed=args.seed)
+    shifted = simulate(args.days, shift=True, seed=args.seed)
+    elapsed = time.perf_counter() - started
+    print(f"Fitted loss:   {shifted['loss']:.4f} /h (true {shifted['true_loss']:.4f})")
+    print(f"Fitted pump:   {shifted['pump']:.4f} /h (true {shifted['true_pump']:.4f})")
+    print(f"Fixed setpoint:   {fixed['cost']:.2f} SEK, {fixed['heat_kwh']:.0f} kWh, coldest {fixed['coldest']:.1f}°C")
+    print(f"Shifted setpoint: {shifted['cost']:.2f} SEK, {shifted['heat_kwh']:.0f} kWh, coldest {shifted['coldest']:.1f}°C")
+    print(f"Simulated {2 * args.days * 48} half hours in {elapsed:.2f} s.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    main()
@@ -16,78 +16,254 @@
 
 # module: tibber.py – A module for interacting with the Tibber API to fetch spot prices.
 
-import os
+import time
+import bisect
 import requests
 import json
 import logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-from dotenv import load_dotenv
-load_dotenv()
+import threading
+from datetime import datetime, timedelta, timezone
+from . import breaker
+from . import cache
+from . import config
+from . import httppool
+from . import metrics
 
-TIBBER_API_KEY = os.getenv("TIBBER_API_KEY")
 URL = "https://api.tibber.com/v1-beta/gql"
 
+PUBLISH_HOUR = 13  # Local hour after which tomorrow's prices are expected
+RETRY_INTERVAL = 900  # Seconds between attempts while waiting for tomorrow's prices
+MISSING_RETRY_INTERVAL = 30  # Seconds between attempts while no price covers now
+CACHE_FILE = "tibber_prices_{area}.json"
 
-def get_spot_price():
+PRICE_INFO = """
+currentSubscription {
+  priceInfo {
+    today {
+      total
+      startsAt
+    }
+    tomorrow {
+      total
+      startsAt
+    }
+  }
+}
+"""
+
+
+class _Prices:
+    """The price series of one price area, shared by the homes in it."""
+
+    def __init__(self, area):
+        self.area = area
+        self.starts = []  # Aware UTC start times of the price slots, sorted
+        self.totals = []  # Total price of each slot
+        self.fetched = None  # When the prices were fetched, as a Unix timestamp
+        self.last_attempt = 0
+        self.lock = threading.Lock()
+
+
+_areas = {}  # Price area -> _Prices
+_areas_lock = threading.Lock()
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).astimezone(timezone.utc)
+
+
+def _prices_for(home):
+    with _areas_lock:
+        if home.price_area not in _areas:
+            _areas[home.price_area] = _Prices(home.price_area)
+        return _areas[home.price_area]
+
+
+@metrics.timed("tibber", "fetch_prices")
+def fetch_prices(home=None):
     """
-    Fetches the current spot price from the Tibber API.
+    Fetches today's and tomorrow's prices from the Tibber API in one query, for the Tibber home
+    of the given home, or the first home of the account if it has none.
     Returns:
-        float: The current spot price, or None if not found.
+        list: (startsAt, total) tuples sorted by time, or None if no prices were found.
     """
+    home = home or config.default()
     headers = {
-        "Authorization": f"Bearer {TIBBER_API_KEY}",
+        "Authorization": f"Bearer {home.tibber_api_key}",
         "Content-Type": "application/json"
     }
-    query = """
-    {
-      viewer {
-        homes {
-          currentSubscription {
-            priceInfo {
-              current {
-                total
-                energy
-                tax
-                startsAt
-              }
-            }
-          }
-        }
-      }
-    }
-    """
-
     payload = {
-        "query": query
+        "query": f"{{ viewer {{ homes {{ {PRICE_INFO} }} }} }}"
     }
+    if home.tibber_home_id:
+        payload = {
+            "query": f"query($id: ID!) {{ viewer {{ home(id: $id) {{ {PRICE_INFO} }} }} }}",
+            "variables": {"id": home.tibber_home_id},
+        }
 
     try:
-        response = requests.post(URL, headers=headers, data=json.dumps(payload), timeout=10)
+        response = httppool.session(URL).post(URL, headers=headers, data=json.dumps(payload), timeout=10)
         response.raise_for_status()
     except requests.exceptions.RequestException as e:
         logging.error(f"Error making request to Tibber API: {e}")
         return None
 
-    data = response.json()
-
-    homes = data.get("data", {}).get("viewer", {}).get("homes", [])
+    try:
+        data = response.json()
+        viewer = (data.get("data") or {}).get("viewer") or {}
+        homes = [viewer["home"]] if viewer.get("home") else viewer.get("homes", [])
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        logging.error(f"Malformed Tibber response: {e!r}")
+        return None
 
     if not homes:
         logging.warning("No homes found in Tibber response.")
         return None
-    for home in homes:
-        current_subscription = home.get("currentSubscription", {})
-        if current_subscription:
-            total_price = current_subscription.get("priceInfo", {}).get("current", {}).get("total")
-            if total_price is not None:
-                logging.info(f"Total price: {total_price}")
-                return total_price
-            else:
-                logging.warning("Total price not found for this home.")
-
-    logging.warning("Could not determine total price from any home.")
+    for tibber_home in homes:
+        try:
+            current_subscription = tibber_home.get("currentSubscription") or {}
+            price_info = current_subscription.get("priceInfo") or {}
+            slots = (price_info.get("today") or []) + (price_info.get("tomorrow") or [])
+            prices = [(_parse_time(slot["startsAt"]), float(slot["total"])) for slot in slots if slot.get("total") is not None]
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            logging.error(f"Malformed prices in the Tibber response: {e!r}")
+            return None
+        if prices:
+            prices.sort()
+            logging.info(f"Fetched {len(prices)} prices for {home.price_area} from Tibber, up to {prices[-1][0].isoformat()}.")
+            return prices
+        logging.warning("No prices found for this home.")
+
+    logging.warning("Could not determine prices from any home.")
     return None
 
-# For testing only
-if __name__ == "__main__":
-    print(get_spot_price())
\ No newline at end of file
+
+def _load_cached(series):
+    data = cache.load(CACHE_FILE.format(area=series.area))
+    if not data:
+        return
+    try:
+        prices = [(_parse_time(start), total) for start, total in data["prices"]]
+        series.fetched = data["fetched"]
+    except (KeyError, TypeError, ValueError) as e:
+        logging.warning(f"Ignoring malformed Tibber price cache: {e}")
+        return
+    series.starts = [start for start, _ in prices]
+    series.totals = [total for _, total in prices]
+
+
+def _slot_index(series, ts):
+    """Returns the index of the price slot containing ts, or None if no slot covers it."""
+    starts = series.starts
+    index = bisect.bisect_right(starts, ts) - 1
+    if index < 0:
+        return None
+    if index + 1 < len(starts):
+        return index
+    # The last slot is as long as the one before it, an hour if it is the only one
+    length = starts[index] - starts[index - 1] if index > 0 else timedelta(hours=1)
+    return index if ts < starts[index] + length else None
+
+
+def _has_tomorrow(series, local_now):
+    tomorrow_end = (local_now + timedelta(days=2)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return series.starts[-1] >= tomorrow_end - timedelta(hours=1)
+
+
+def _needs_refresh(series, now):
+    if not series.starts or _slot_index(series, now) is None:
+        return True
+    local_now = now.astimezone()
+    return local_now.hour >= PUBLISH_HOUR and not _has_tomorrow(series, local_now)
+
+
+def _refresh(home):
+    """
+    Fetches new prices for the price area of the home when today's are missing or tomorrow's are
+    due, otherwise does nothing. Returns the price series of the area.
+    """
+    home = home or config.default()
+    series = _prices_for(home)
+    # Homes in the same area wait for one fetch instead of each sending their own
+    with series.lock:
+        if series.fetched is None:
+            _load_cached(series)
+        now = datetime.now(timezone.utc)
+        if not _needs_refresh(series, now):
+            return series
+        # Once we have prices for now, only poll for tomorrow's every RETRY_INTERVAL. Without them
+        # every lookup of a cycle would fetch again, so they are polled every MISSING_RETRY_INTERVAL.
+        interval = RETRY_INTERVAL if _slot_index(series, now) is not None else MISSING_RETRY_INTERVAL
+        if time.time() - series.last_attempt < interval:
+            return series
+        series.last_attempt = time.time()
+
+        # While Tibber keeps failing the breaker skips the request and the cached prices are used
+        prices = breaker.call(breaker.key("tibber", series.area), fetch_prices, home)
+        if not prices:
+            return series
+        series.starts = [start for start, _ in prices]
+        series.totals = [total for _, total in prices]
+        series.fetched = time.time()
+        cache.save(CACHE_FILE.format(area=series.area),
+                   {"fetched": series.fetched, "prices": [(start.isoformat(), total) for start, total in prices]})
+        return series
+
+
+def _as_utc(ts):
+    # Naive timestamps are taken as local time, like datetime.now()
+    return ts.astimezone(timezone.utc)
+
+
+def get_price_at(ts, home=None):
+    """Returns the total price of the slot containing ts, or None if it is not known."""
+    series = _refresh(home)
+    index = _slot_index(series, _as_utc(ts))
+    return series.totals[index] if index is not None else None
+
+
+def get_prices(start, end, home=None):
+    """Returns the known prices as a list of (startsAt, total) with start <= startsAt < end."""
+    series = _refresh(home)
+    first = bisect.bisect_left(series.starts, _as_utc(start))
+    last = bisect.bisect_left(series.starts, _as_utc(end))
+    return list(zip(series.starts[first:last], series.totals[first:last]))
+
+
+def last_update(home=None):
+    """Returns when the prices of the home's price area were fetched, as a Unix timestamp."""
+    return _prices_for(home or config.default()).fetched
+
+
+def next_refresh(home=None):
+    """
+    Returns when new prices for the home's price area can next be fetched, as an aware UTC datetime:
+    the next publication of tomorrow's prices, or the next retry while waiting for them. Returns None
+    if the prices are due now.
+    """
+    series = _prices_for(home or config.default())
+    now = datetime.now(timezone.utc)
+    if not series.starts or _slot_index(series, now) is None:
+        return None
+    local_now = now.astimezone()
+    publish = local_now.replace(hour=PUBLISH_HOUR, minute=0, second=0, microsecond=0)
+    if _has_tomorrow(series, local_now):
+        return (publish + timedelta(days=1)).astimezone(timezone.utc)
+    if local_now < publish:
+        return publish.astimezone(timezone.utc)
+    retry_at = datetime.fromtimestamp(series.last_attempt + RETRY_INTERVAL, timezone.utc)
+    return retry_at if retry_at > now else None
+
+
+def get_spot_price(home=None):
+    """
+    Returns the current spot price, served from the day-ahead price cache.
+    Returns:
+        float: The current spot price, or None if not found.
+    """
+    total_price = get_price_at(datetime.now(timezone.utc), home)
+    if total_price is None:
+        logging.warning("No price available for the current time.")
+        return None
+    logging.info(f"Total price: {total_price}")
+    return total_price
@@ -0,0 +1,266 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# module: tibber_live.py – Streams the live power measurements of a Tibber Pulse into a ring buffer.
+#
+# A background thread per Tibber home subscribes to liveMeasurement over Tibber's websocket API
+# (the graphql-transport-ws protocol) and appends every sample to a fixed-size ring buffer.
+# average_power() and latest_power() answer from the buffer without allocating. The connection
+# is re-established with exponential backoff. Needs the optional websocket-client package
+# (pip install heatautomation[live]) and TIBBER_LIVE=1; without them nothing is started.
+
+import os
+import json
+import time
+import array
+import random
+import logging
+import threading
+from . import config
+from . import metrics
+
+WEBSOCKET_URL = os.getenv("TIBBER_WEBSOCKET_URL", "wss://websocket-api.tibber.com/v1-beta/gql/subscriptions")
+ENABLED = os.getenv("TIBBER_LIVE", "0") == "1"
+CAPACITY = 8192  # Samples kept, over 4 hours at the Pulse's usual rate of one sample every 2 seconds
+RECEIVE_TIMEOUT = 60  # Seconds without a message before the connection is considered dead
+BACKOFF = 1.0  # Seconds before the first reconnect
+MAX_BACKOFF = 300.0
+USER_AGENT = "heatautomation/0.1.0"  # Tibber rejects websocket clients without one
+
+SUBSCRIPTION = "subscription($id: ID!) { liveMeasurement(homeId: $id) { timestamp power } }"
+
+
+class RingBuffer:
+    """
+    Power samples in fixed-size arrays, the oldest overwritten first. Next to every sample the
+    energy used up to it is kept, so time-weighted averages over any window need two binary
+    searches and no allocation. array.array keeps appends cheap from Python at several samples
+    per second, cheaper than writing into numpy arrays item by item.
+    """
+
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        self.times = array.array("d", bytes(8 * capacity))  # Unix time the sample was received
+        self.power = array.array("d", bytes(8 * capacity))  # W
+        self.energy = array.array("d", bytes(8 * capacity))  # Ws used from the first sample up to this one
+        self.head = 0  # Where the next sample goes
+        self.count = 0
+        self.appended = 0  # Samples ever appended
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def append(self, ts, watts):
+        with self._lock:
+            if self.count:
+                last = (self.head - 1) % self.capacity
+                if ts <= self.times[last]:
+                    ts = self.times[last] + 1e-6  # Keep the times strictly increasing for the searches
+                energy = self.energy[last] + self.power[last] * (ts - self.times[last])
+            else:
+                energy = 0.0
+            self.times[self.head] = ts
+            self.power[self.head] = watts
+            self.energy[self.head] = energy
+            self.head = (self.head + 1) % self.capacity
+            if self.count < self.capacity:
+                self.count += 1
+            self.appended += 1
+
+    def _index(self, i):
+        # Logical index, 0 is the oldest sample, to the position in the arrays
+        return (self.head - self.count + i) % self.capacity
+
+    def _energy_at(self, ts):
+        # Energy used up to ts, holding every sample until the next one. ts must be within the buffer.
+        lo, hi = 0, self.count - 1
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if self.times[self._index(mid)] <= ts:
+                lo = mid
+            else:
+                hi = mid - 1
+        i = self._index(lo)
+        return self.energy[i] + self.power[i] * (ts - self.times[i])
+
+    def latest(self):
+        """Returns (time, watts) of the newest sample, or None if the buffer is empty."""
+        with self._lock:
+            if not self.count:
+                return None
+            i = (self.head - 1) % self.capacity
+            return self.times[i], self.power[i]
+
+    def mean(self, seconds, now=None):
+        """
+        Returns the time-weighted mean power in W over the last seconds, or None if there is no
+        sample in that window. A window reaching past the oldest sample starts at it.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            if not self.count:
+                return None
+            newest = (self.head - 1) % self.capacity
+            if self.times[newest] < now - seconds:
+                return None
+            start = max(now - seconds, self.times[self._index(0)])
+            if now <= start:
+                return self.power[newest]
+            return (self._energy_at(now) - self._energy_at(start)) / (now - start)
+
+
+class LiveClient:
+    """Keeps a subscription to the live measurements of one Tibber home running in a background thread."""
+
+    def __init__(self, home_id, api_key, url=WEBSOCKET_URL, capacity=CAPACITY):
+        self.home_id = home_id
+        self.api_key = api_key
+        self.url = url
+        self.buffer = RingBuffer(capacity)
+        self.connected = False
+        self.reconnects = 0
+        self._stop = threading.Event()
+        self._socket = None
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"tibber-live-{self.home_id}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        socket = self._socket
+        if socket is not None:
+            try:
+                socket.close()  # Wakes the thread from recv()
+            except Exception:
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        failures = 0
+        while not self._stop.is_set():
+            samples = self.buffer.appended
+            try:
+                self._stream()
+            except Exception as e:
+                if self._stop.is_set():
+                    break
+                logging.warning(f"Tibber live stream of {self.home_id} failed: {e!r}")
+            self.connected = False
+            if self.buffer.appended != samples:
+                failures = 0  # The connection delivered samples, start the backoff over
+            if self._stop.is_set():
+                break
+            delay = min(MAX_BACKOFF, BACKOFF * 2 ** failures) * random.uniform(0.5, 1.0)
+            failures += 1
+            self.reconnects += 1
+            metrics.count_retry("tibber_live")
+            logging.info(f"Reconnecting to the Tibber live stream in {delay:.1f} seconds.")
+            self._stop.wait(delay)
+
+    def _stream(self):
+        """Runs one connection until it ends."""
+        import websocket  # Optional dependency, only needed once a stream is started
+
+        with metrics.timed("tibber_live", "connect"):
+            self._socket = websocket.create_connection(
+                self.url, timeout=RECEIVE_TIMEOUT, subprotocols=["graphql-transport-ws"],
+                header=[f"User-Agent: {USER_AGENT}"],
+                skip_utf8_validation=True)  # Pure Python and most of the cost per sample, json.loads rejects bad text anyway
+            self._socket.send(json.dumps({"type": "connection_init", "payload": {"token": self.api_key}}))
+            ack = json.loads(self._socket.recv())
+            if ack.get("type") != "connection_ack":
+                raise ConnectionError(f"Unexpected answer to connection_init: {ack}")
+            self._socket.send(json.dumps({"id": "1", "type": "subscribe", "payload": {
+                "query": SUBSCRIPTION, "variables": {"id": self.home_id}}}))
+        self.connected = True
+        logging.info(f"Subscribed to the Tibber live measurements of {self.home_id}.")
+
+        append = self.buffer.append
+        try:
+            while not self._stop.is_set():
+                message = json.loads(self._socket.recv())
+                kind = message.get("type")
+                if kind == "next":
+                    measurement = ((message.get("payload") or {}).get("data") or {}).get("liveMeasurement")
+                    if measurement and measurement.get("power") is not None:
+                        append(time.time(), float(measurement["power"]))
+                elif kind == "ping":
+                    self._socket.send('{"type": "pong"}')
+                elif kind in ("error", "complete"):
+                    raise ConnectionError(f"Subscription ended: {message}")
+        finally:
+            self._socket.close()
+
+
+_clients = {}  # Tibber home id -> LiveClient
+_lock = threading.Lock()
+
+
+def available():
+    """Returns True if the optional websocket-client package is installed."""
+    try:
+        import websocket  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def start(home=None):
+    """
+    Starts streaming the live measurements of a home, once per Tibber home. Returns the client,
+    or None if the stream is turned off, the home has no Tibber home id or websocket-client is missing.
+    """
+    home = home or config.default()
+    if not ENABLED or not home.tibber_home_id:
+        return None
+    if not available():
+        logging.warning("TIBBER_LIVE is set but websocket-client is not installed, not streaming live measurements.")
+        return None
+    with _lock:
+        if home.tibber_home_id not in _clients:
+            _clients[home.tibber_home_id] = LiveClient(home.tibber_home_id, home.tibber_api_key).start()
+        return _clients[home.tibber_home_id]
+
+
+def stop():
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.stop()
+
+
+def _buffer(home):
+    home = home or config.default()
+    client = _clients.get(home.tibber_home_id)
+    return client.buffer if client is not None else None
+
+
+def average_power(seconds, home=None):
+    """Returns the mean power in W the home drew over the last seconds, or None if it is not streamed."""
+    buffer = _buffer(home)
+    return buffer.mean(seconds) if buffer is not None else None
+
+
+def latest_power(home=None):
+    """Returns (Unix time, W) of the newest live measurement of the home, or None."""
+    buffer = _buffer(home)
+    return buffer.latest() if buffer is not None else None
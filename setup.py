@@ -29,8 +29,16 @@ setup(
         'requests',
         'python-dotenv',
         'selenium',
-        'webdriver-manager',
+        'numpy',
     ],
+    extras_require={
+        'live': ['websocket-client'],
+    },
+    entry_points={
+        'console_scripts': [
+            'heatautomation=heatautomation.cli:main',
+        ],
+    },
     classifiers=[
         'Programming Language :: Python :: 3',
         'License :: OSI Approved :: GNU Affero General Public License v3',
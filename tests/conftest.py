@@ -0,0 +1,100 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# conftest.py - Shared fixtures of the tests, run with python -m pytest from the repository root.
+#
+# The tests never reach the network: the integrations are pointed at the stub servers of the
+# benchmarks, and the cache lives in a scratch directory that is emptied before every test.
+
+import os
+import sys
+import shutil
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = tempfile.mkdtemp(prefix="heatautomation-tests-")
+
+# Read when heatautomation is imported, so set before any test module imports it
+os.environ.update({
+    "HEATAUTOMATION_CACHE_DIR": CACHE_DIR,
+    "HEATAUTOMATION_HOMES": os.path.join(CACHE_DIR, "homes.json"),
+    "METRICS_PORT": "0",
+    "KMP_BACKEND": "http",
+    "TIBBER_API_KEY": "test",
+    "SENSIBO_API_KEY": "test",
+})
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import pytest  # noqa: E402
+import stubs  # noqa: E402
+
+
+def _reset():
+    """Forgets everything a restart forgets: the in-memory state, the cache files and the connections."""
+    from heatautomation import tibber, smhi, sensibo, kmp_http, devicestate, main, httppool, breaker, thermal, shadow
+    tibber._areas.clear()
+    smhi._forecasts.clear()
+    sensibo._pods.clear()
+    kmp_http._portals.clear()
+    devicestate._states.clear()
+    main._plans.clear()
+    main._last_good.clear()
+    main._available.clear()
+    main._setpoints.clear()
+    main._shifted.clear()
+    thermal._models.clear()
+    shadow._totals.clear()
+    breaker._breakers.clear()
+    httppool._sessions.clear()
+    for name in os.listdir(CACHE_DIR):
+        path = os.path.join(CACHE_DIR, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+@pytest.fixture(autouse=True)
+def reset():
+    _reset()
+    yield
+    _reset()
+
+
+@pytest.fixture
+def servers(monkeypatch):
+    """Starts the stub servers and points the integrations at them."""
+    from heatautomation import tibber, sensibo, smhi
+    with stubs.StubServers() as servers:
+        monkeypatch.setattr(tibber, "URL", servers.urls["tibber"] + "/v1-beta/gql")
+        monkeypatch.setattr(sensibo, "URL", servers.urls["sensibo"] + "/api/v2/pods/{pod}/acStates")
+        monkeypatch.setattr(smhi, "FORECAST_URL", servers.urls["smhi"]
+                            + "/api/category/pmp3g/version/2/geotype/point/lon/{lon}/lat/{lat}/data.json")
+        yield servers
+
+
+def stub(servers, name):
+    """Returns the stub of an integration."""
+    return next(stub for stub in servers.stubs if stub.name == name)
+
+
+def home(servers, name="home0", **kwargs):
+    """Returns a home whose integrations are all served by the stubs."""
+    from heatautomation import config
+    kwargs = dict(dict(price_area="SE3", sensibo_pods=[f"{name}-pod"], kmp_username=name, kmp_password="test",
+                       kmp_url=servers.urls["kmp"] + "/kmp/", lat=60.1333, lon=15.2667), **kwargs)
+    return config.Home(name=name, **kwargs)
@@ -0,0 +1,118 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# test_breaker.py - The circuit breakers, on their own and per home against the stubs.
+
+import pytest
+from conftest import home, stub
+from heatautomation import breaker, kmp, sensibo
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(breaker.time, "monotonic", clock)
+    return clock
+
+
+def _fail():
+    raise ConnectionError("down")
+
+
+def _attempt(name, func):
+    try:
+        with breaker.guard(name):
+            func()
+    except ConnectionError:
+        pass
+
+
+def test_opens_after_threshold_failures_in_a_row(clock):
+    b = breaker.get("test")
+    for _ in range(b.threshold - 1):
+        _attempt("test", _fail)
+    _attempt("test", lambda: None)  # A success starts the count over
+    for _ in range(b.threshold - 1):
+        _attempt("test", _fail)
+    assert b.state == breaker.CLOSED
+    _attempt("test", _fail)
+    assert b.state == breaker.OPEN
+    with pytest.raises(breaker.CircuitOpen):
+        _attempt("test", lambda: None)
+
+
+def test_probe_after_the_reset_timeout_closes_or_reopens_for_longer(clock):
+    b = breaker.get("test")
+    for _ in range(b.threshold):
+        _attempt("test", _fail)
+    clock.now += b.reset_timeout - 1
+    assert not b.allow()
+    clock.now += 1
+    assert b.allow() and b.state == breaker.HALF_OPEN
+    assert not b.allow()  # Only one probe at a time
+    b.record(False)
+    assert b.state == breaker.OPEN and b.seconds_until_probe() == 2 * b.reset_timeout
+
+    clock.now += 2 * b.reset_timeout
+    _attempt("test", lambda: None)
+    assert b.state == breaker.CLOSED and b.timeout == b.reset_timeout
+
+
+def test_call_counts_none_as_a_failure(clock):
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return None
+
+    for _ in range(breaker.FAILURE_THRESHOLD + 2):
+        assert breaker.call("test", fetch) is None
+    assert len(calls) == breaker.FAILURE_THRESHOLD  # The rest were refused without calling
+    assert breaker.is_open("test")
+
+
+def test_wrong_kmp_password_only_opens_that_homes_breaker(servers):
+    stub(servers, "kmp").password = "test"
+    good, bad = home(servers, "good"), home(servers, "bad", kmp_password="wrong")
+    for _ in range(breaker.FAILURE_THRESHOLD):
+        with pytest.raises(RuntimeError, match="Login failed"):
+            kmp.status(bad)
+    with pytest.raises(breaker.CircuitOpen):
+        kmp.status(bad)
+
+    assert kmp.status(good) == "AV"
+    assert breaker.get(breaker.key("kmp", "bad")).state == breaker.OPEN
+    assert breaker.get(breaker.key("kmp", "good")).state == breaker.CLOSED
+
+
+def test_missing_pod_only_opens_its_own_breaker(servers):
+    stub(servers, "sensibo").missing.add("gone")
+    good, bad = home(servers, "good"), home(servers, "bad", sensibo_pods=["gone"])
+    for _ in range(breaker.FAILURE_THRESHOLD):
+        sensibo._pods.clear()  # No cached state, every read goes out
+        assert sensibo.getSystemStatus(bad, "gone") is None
+
+    assert sensibo.getSystemStatus(good, "good-pod")["is_on"] is not None
+    assert breaker.get(breaker.key("sensibo", "gone")).state == breaker.OPEN
+    assert breaker.get(breaker.key("sensibo", "good-pod")).state == breaker.CLOSED
@@ -0,0 +1,30 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# test_chromewatch.py - Supervision of the Chrome processes, without starting Chrome.
+
+import os
+from heatautomation import chromewatch
+
+
+def test_nothing_is_tracked_without_proc(monkeypatch):
+    monkeypatch.setattr(chromewatch, "_stat", lambda pid: None)
+    monkeypatch.setattr(chromewatch, "_processes", lambda: {})
+    chromewatch.track("kmp", os.getpid())
+    chromewatch.borrowed(os.getpid())
+    chromewatch.returned(os.getpid())
+    assert chromewatch.usage() == []
+    assert chromewatch.untrack(os.getpid()) is None
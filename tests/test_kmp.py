@@ -0,0 +1,87 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# test_kmp.py - The stove commands and the portal session of the HTTP backend, against the stubbed KMP portal.
+
+import pytest
+from conftest import home, stub
+from heatautomation import kmp
+
+
+@pytest.fixture
+def fast_polls(monkeypatch):
+    monkeypatch.setattr(kmp, "PRESS_POLL", 0.05)
+    monkeypatch.setattr(kmp, "PRESS_TIMEOUT", 2)
+
+
+def test_press_waits_for_the_mode_to_change(servers, fast_polls):
+    portal = stub(servers, "kmp")
+    portal.settle = 0.3  # The page shows the old mode for a while after the press
+
+    kmp.on(home(servers))
+    assert portal.on
+    assert kmp.status(home(servers)) == "UPPVÄRMNING"
+
+    kmp.off(home(servers))
+    assert not portal.on
+
+
+def test_press_that_does_not_take_raises(servers, fast_polls, monkeypatch):
+    stub(servers, "kmp").settle = 60
+    monkeypatch.setattr(kmp, "PRESS_TIMEOUT", 0.3)
+    with pytest.raises(RuntimeError, match="mode AV after pressing"):
+        kmp.on(home(servers))
+
+
+def test_already_in_mode_does_not_press(servers, fast_polls):
+    portal = stub(servers, "kmp")
+    kmp.off(home(servers))
+    assert not portal.on and portal.switch_at is None
+
+
+def test_login_submits_the_form_once_and_reuses_the_session(servers):
+    portal = stub(servers, "kmp")
+    assert kmp.status(home(servers)) == "AV"
+    assert kmp.status(home(servers)) == "AV"
+
+    assert len(portal.logins) == 1
+    form = portal.logins[0]
+    assert form["user"] == ["home0"] and form["pass"] == ["test"]
+    assert form["lang"] == ["sv"] and "stove" in form  # The hidden field and the submit button go along
+
+
+def test_expired_session_logs_in_again(servers):
+    portal = stub(servers, "kmp")
+    kmp.status(home(servers))
+    portal.expire()
+    assert kmp.status(home(servers)) == "AV"
+    assert len(portal.logins) == 2
+
+
+def test_power_button_posts_the_stove_form(servers, fast_polls):
+    portal = stub(servers, "kmp")
+    kmp.on(home(servers))
+    assert len(portal.presses) == 1
+    form = portal.presses[0]
+    assert form["cmd"] == ["toggle"] and "startbild.y" in form
+
+
+def test_each_account_has_its_own_session(servers):
+    portal = stub(servers, "kmp")
+    kmp.status(home(servers, "a"))
+    kmp.status(home(servers, "b"))
+    kmp.status(home(servers, "a"))
+    assert [form["user"] for form in portal.logins] == [["a"], ["b"]]
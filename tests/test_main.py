@@ -0,0 +1,82 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# test_main.py - The control loop and its inputs.
+
+import asyncio
+import pytest
+from conftest import home, stub
+from heatautomation import api, main, metrics, scheduler, tibber, tibber_live
+
+
+class _Stop(Exception):
+    pass
+
+
+def test_error_after_a_cycle_falls_back_to_the_quarter_hour(servers, monkeypatch, caplog):
+    caplog.set_level("INFO")
+    homes = [home(servers, "a"), home(servers, "b")]
+    sleeps = []
+
+    async def run_cycle(deadline, running):
+        return {h.name: {"price": 1.0, "temperature": 0.0, "decision": "heatpump"} for h in running}
+
+    def next_wakeup(h, now, inputs):
+        if h.name == "a":
+            raise KeyError("startsAt")  # Like a malformed Tibber answer
+        return now + main.MIN_INTERVAL, "test"
+
+    async def sleep_until(wakeup, wake=None):
+        sleeps.append(wakeup)
+        raise _Stop
+
+    monkeypatch.setattr(main, "run_cycle", run_cycle)
+    monkeypatch.setattr(main, "next_wakeup", next_wakeup)
+    monkeypatch.setattr(main, "record_cycle", lambda inputs, h: None)
+    monkeypatch.setattr(metrics, "serve", lambda: None)
+    monkeypatch.setattr(api, "serve", lambda homes, wake=None: None)
+    monkeypatch.setattr(tibber_live, "start", lambda h: None)
+    monkeypatch.setattr(scheduler, "sleep_until", sleep_until)
+    with pytest.raises(_Stop):
+        asyncio.run(main.run_forever(homes))
+
+    # b still wakes on its own schedule, a at the next quarter hour instead of stopping the loop
+    assert len(sleeps) == 1
+    assert api.status(homes[1])["next_cycle"]["reason"] == "test"
+    assert api.status(homes[0])["next_cycle"] is None
+    assert "(next quarter hour after an error)" in caplog.text
+
+
+def test_malformed_tibber_answer_is_a_failed_fetch(servers):
+    del stub(servers, "tibber").home["currentSubscription"]["priceInfo"]["today"][0]["startsAt"]
+    h = home(servers)
+    assert tibber.get_spot_price(h) is None
+    assert servers.requests()["tibber"] == 1
+    # The other lookups of the cycle do not fetch again
+    assert tibber.get_spot_price(h) is None
+    assert servers.requests()["tibber"] == 1
+
+
+def test_failing_source_falls_back_to_its_last_known_value(servers, monkeypatch):
+    h = home(servers)
+    price, temperature = asyncio.run(main.fetch_inputs(h))
+    assert price is not None and temperature is not None
+
+    def fail(home):
+        raise RuntimeError("down")
+
+    monkeypatch.setattr(tibber, "get_spot_price", fail)
+    assert asyncio.run(main.fetch_inputs(h)) == (price, temperature)
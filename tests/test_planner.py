@@ -0,0 +1,80 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# test_planner.py - The look-ahead planner and its fallback in the control cycle.
+
+from datetime import datetime, timedelta, timezone
+import pytest
+from heatautomation import main, planner
+
+INF = planner.INF
+START = datetime(2025, 1, 6, tzinfo=timezone.utc)
+SLOT = timedelta(minutes=15)
+
+
+def _costs(heatpump, pelletstove, off=None):
+    return {"off": off or [INF] * len(heatpump), "heatpump": heatpump, "pelletstove": pelletstove}
+
+
+def test_small_savings_do_not_pay_for_a_switch():
+    costs = _costs([1.0, 1.2, 1.0, 1.2], [1.1, 1.0, 1.1, 1.0])
+    modes, total = planner.optimize(costs, min_run=1, current_mode="heatpump")
+    assert modes == ["heatpump"] * 4
+    assert total == pytest.approx(4.4)
+
+
+def test_switch_is_charged_penalty_and_ignition():
+    costs = _costs([5.0] * 4, [1.0] * 4)
+    modes, total = planner.optimize(costs, min_run=1, current_mode="heatpump", switch_penalty=0.5, ignition_cost=2.0)
+    assert modes == ["pelletstove"] * 4
+    assert total == pytest.approx(4.0 + 0.5 + 2.0)
+    # A stove that is already burning is not ignited again
+    assert planner.optimize(costs, min_run=1, current_mode="pelletstove")[1] == pytest.approx(4.0)
+
+
+def test_stove_runs_at_least_min_run_slots():
+    costs = _costs([1.0, 1.0, 9.0, 1.0, 1.0, 1.0], [3.0, 3.0, 2.0, 2.0, 2.0, 3.0])
+    modes, _ = planner.optimize(costs, min_run=3, current_mode="heatpump", switch_penalty=0.0, ignition_cost=0.0)
+    assert modes == ["heatpump", "heatpump", "pelletstove", "pelletstove", "pelletstove", "heatpump"]
+
+
+def test_no_heating_at_or_above_the_balance_temperature():
+    prices = [(START + SLOT * i, 1.0) for i in range(8)]
+    plan = planner.make_plan(prices, [(START, 17.0)])
+    assert plan.modes == ["off"] * 8 and plan.cost == 0.0
+    plan = planner.make_plan(prices, [(START, 18.0), (START + SLOT * 4, -5.0)], "off")
+    assert plan.modes[:4] == ["off"] * 4 and "off" not in plan.modes[4:]
+
+
+def test_plan_lookups():
+    prices = [(START + SLOT * i, 0.5 if i < 4 else 5.0) for i in range(8)]
+    plan = planner.make_plan(prices, [(START, 0.0)], "heatpump")
+    assert plan.decision_at(START) == "heatpump"
+    assert plan.decision_at(START - SLOT) is None and plan.decision_at(plan.end) is None
+    assert plan.next_change(START) == START + SLOT * 4
+    assert plan.decision_at(START + SLOT * 5) == "pelletstove"
+
+
+def test_gap_in_the_prices_ends_the_horizon():
+    prices = [(START + SLOT * i, 1.0) for i in range(4)] + [(START + SLOT * 10, 1.0)]
+    assert len(planner.make_plan(prices, [(START, 0.0)]).modes) == 4
+
+
+def test_without_prices_the_threshold_rule_decides():
+    assert planner.make_plan([(START, 1.0)], [(START, 0.0)]) is None
+    assert planner.make_plan([], []) is None
+    assert main.choose_heater(0.5, 0.0, None) == main.evaluate_heater_with_temperature(0.0, 0.5)
+    assert main.choose_heater(5.0, 0.0, None) == "pelletstove"
@@ -0,0 +1,42 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# test_shadow.py - The shadow strategies decide like main's rules and are charged for the time they ran.
+
+import pytest
+from heatautomation import main, shadow
+
+PRICES = [0.1, 0.5, 1.0, 1.5, 2.0, 3.0, 5.0]
+TEMPERATURES = [None, -25.0, -15.0, -5.0, 0.0, 10.0]
+
+
+@pytest.mark.parametrize("temperature", TEMPERATURES)
+@pytest.mark.parametrize("price", PRICES)
+def test_shadow_decisions_are_mains(price, temperature):
+    results = shadow.evaluate(price, temperature, "heatpump", now=0)
+    assert results["price"]["decision"] == main.evaluate_heater(price)
+    assert results["temperature"]["decision"] == main.evaluate_heater_with_temperature(temperature, price)
+    assert results["optimize"]["decision"] == main.optimize_heating_system(temperature, price)
+
+
+def test_registered_strategy_is_charged_for_the_time_until_the_next_cycle(monkeypatch):
+    monkeypatch.setattr(shadow, "SHADOW", ["pellets"])
+    monkeypatch.setitem(shadow.STRATEGIES, "pellets", lambda price, temperature: "pelletstove")
+    first = shadow.evaluate(1.0, 0.0, "heatpump", now=0)
+    assert first["pellets"]["decision"] == "pelletstove" and first["pellets"]["cost"] == 0.0
+    second = shadow.evaluate(1.0, 0.0, "heatpump", now=1800)
+    assert second["pellets"]["cost"] == pytest.approx(first["pellets"]["cost_per_hour"] / 2)
+    assert second[shadow.PRIMARY]["cost"] == pytest.approx(first[shadow.PRIMARY]["cost_per_hour"] / 2)
@@ -0,0 +1,69 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# test_smhi.py - The SMHI forecast cache, against the stubbed forecast API.
+
+import time
+from conftest import home, stub
+from heatautomation import smhi
+
+
+def _age(h, seconds):
+    # Makes the forecast of the home's grid point as old as seconds
+    smhi._forecasts[smhi.grid_point(h)]["fetched"] = time.time() - seconds
+
+
+def test_forecast_is_served_from_memory_within_the_ttl(servers):
+    h = home(servers)
+    temperature = smhi.get_outdoor_temp(h)
+    assert temperature is not None
+    assert smhi.get_outdoor_temp(h) == temperature
+    assert servers.requests()["smhi"] == 1
+
+
+def test_homes_on_one_grid_point_share_the_forecast(servers):
+    smhi.get_outdoor_temp(home(servers, "a"))
+    smhi.get_outdoor_temp(home(servers, "b", lat=60.1334))  # Same grid point
+    assert servers.requests()["smhi"] == 1
+    smhi.get_outdoor_temp(home(servers, "c", lat=61.0))
+    assert servers.requests()["smhi"] == 2
+
+
+def test_expired_forecast_is_revalidated(servers):
+    h = home(servers)
+    temperature = smhi.get_outdoor_temp(h)
+    _age(h, smhi.CACHE_TTL + 1)
+    assert smhi.get_outdoor_temp(h) == temperature
+    assert stub(servers, "smhi").not_modified == 1
+    assert time.time() - smhi.last_update(h) < 5  # Fresh again for another CACHE_TTL
+
+
+def test_cached_forecast_survives_a_restart(servers):
+    h = home(servers)
+    temperature = smhi.get_outdoor_temp(h)
+    smhi._forecasts.clear()
+    assert smhi.get_outdoor_temp(h) == temperature
+    assert servers.requests()["smhi"] == 1
+
+
+def test_unreachable_smhi_falls_back_until_max_age(servers, monkeypatch):
+    h = home(servers)
+    temperature = smhi.get_outdoor_temp(h)
+    monkeypatch.setattr(smhi, "FORECAST_URL", "http://127.0.0.1:1/{lat}/{lon}")
+    _age(h, smhi.CACHE_TTL + 1)
+    assert smhi.get_outdoor_temp(h) == temperature
+    _age(h, smhi.MAX_AGE + 1)
+    assert smhi.get_outdoor_temp(h) is None
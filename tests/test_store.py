@@ -0,0 +1,81 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# test_store.py - The SQLite time-series store: writing, roll-up and downsampling.
+
+import time
+import pytest
+from heatautomation import store
+
+DAY = 86400
+NOW = int(time.time()) // 3600 * 3600  # On a whole hour, the writer rolls up what is older than RAW_RETENTION
+
+
+@pytest.fixture(autouse=True)
+def db(tmp_path, monkeypatch):
+    # A file per test, the writer thread keeps its connections open
+    monkeypatch.setattr(store, "DB_PATH", str(tmp_path / "heatautomation.db"))
+    monkeypatch.setattr(store, "FLUSH_INTERVAL", 0.01)
+
+
+def test_recorded_cycles_are_written_per_home():
+    store.record(NOW, price=1.5, temperature=-2.0, decision="heatpump", heatpump_on=True, pelletstove_on=False,
+                 details={"calls": {"tibber": 1}})
+    store.record(NOW + 900, price=1.6, decision="pelletstove", home="cabin")
+    store.flush()
+
+    rows = store.query(NOW, NOW + DAY)
+    assert len(rows) == 1
+    assert rows[0]["heatpump_on"] == 1 and rows[0]["pelletstove_on"] == 0
+    assert rows[0]["details"] == {"calls": {"tibber": 1}}
+    assert store.last(home="cabin")["decision"] == "pelletstove"
+    assert store.query(NOW, NOW + DAY, home="missing") == []
+
+
+def test_old_cycles_are_rolled_up_into_hours():
+    old = NOW - store.RAW_RETENTION - 2 * 3600
+    with store.connect() as connection:
+        for i, decision in enumerate(["heatpump", "heatpump", "pelletstove", "heatpump"]):
+            connection.execute("INSERT INTO cycles (ts, price, temperature, decision) VALUES (?, ?, ?, ?)",
+                               (old + i * 900, 1.0 + i, -4.0, decision))
+        connection.execute("INSERT INTO cycles (ts, price, decision) VALUES (?, 2.0, 'heatpump')", (NOW,))
+        connection.execute("INSERT INTO cycles_hourly (hour, samples, price) VALUES (?, 4, 1.0)",
+                           (NOW - store.HOURLY_RETENTION - 3600,))
+        store.maintain(connection, now=NOW)
+
+        assert connection.execute("SELECT ts FROM cycles").fetchall() == [(NOW,)]
+        hourly = connection.execute("SELECT hour, samples, price, temperature, heatpump_share FROM cycles_hourly").fetchall()
+    assert hourly == [(old, 4, 2.5, -4.0, 0.75)]  # The expired hour is gone
+
+
+def test_downsample_combines_hours_and_cycles():
+    with store.connect() as connection:
+        connection.execute("INSERT INTO cycles_hourly (hour, samples, price, temperature, heatpump_share) "
+                           "VALUES (?, 3, 1.0, 0.0, 1.0)", (NOW,))
+        connection.execute("INSERT INTO cycles (ts, price, temperature, decision) VALUES (?, 3.0, 4.0, 'pelletstove')",
+                           (NOW + 1800,))
+        connection.execute("INSERT INTO cycles (ts, price, temperature, decision) VALUES (?, NULL, 4.0, 'pelletstove')",
+                           (NOW + 2700,))
+        connection.execute("INSERT INTO cycles (ts, price, decision) VALUES (?, 2.0, 'heatpump')", (NOW + 3600,))
+        buckets = store.downsample(NOW, NOW + 2 * 3600, 3600, connection=connection)
+
+    assert [bucket["bucket"] for bucket in buckets] == [NOW, NOW + 3600]
+    first = buckets[0]
+    assert first["samples"] == 5
+    assert first["price"] == pytest.approx((3 * 1.0 + 3.0) / 4)  # The cycle without a price is left out
+    assert first["temperature"] == pytest.approx((3 * 0.0 + 4.0 + 4.0) / 5)
+    assert first["heatpump_share"] == pytest.approx(3 / 5)
+    assert buckets[1]["temperature"] is None
@@ -0,0 +1,60 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# test_thermal.py - The thermal model and its setpoint schedule, against the simulated house.
+
+from datetime import datetime, timedelta, timezone
+import pytest
+from heatautomation import thermal
+
+START = datetime(2025, 1, 6, tzinfo=timezone.utc)
+
+
+def _prices(values):
+    return [(START + timedelta(minutes=30 * i), price) for i, price in enumerate(values)]
+
+
+def _trusted():
+    return thermal.ThermalModel(theta=(0.04, 0.8, 1.2), samples=thermal.MIN_SAMPLES)
+
+
+def test_untrusted_model_keeps_the_base_setpoint():
+    prices = _prices([0.5] * 8 + [3.0] * 4 + [0.5] * 8)
+    assert [setpoint for _, setpoint in thermal.schedule(thermal.ThermalModel(), 21.5, prices, [])] == [21.5] * 20
+
+
+def test_only_shifted_setpoints_are_rounded():
+    prices = _prices([0.5] * 12 + [3.0] * 6 + [0.5] * 6)
+    setpoints = [setpoint for _, setpoint in thermal.schedule(_trusted(), 21.5, prices, [(START, -5.0)])]
+    assert setpoints[0] == 21.5 and setpoints[-1] == 21.5
+    assert setpoints[12:18] == [21] * 6  # 21.5 - SETBACK
+    assert setpoints[11] == 24  # 21.5 + PREHEAT, pre-heating before the expensive stretch
+
+
+def test_flat_prices_are_not_shifted():
+    prices = _prices([1.0 + 0.01 * (i % 3) for i in range(24)])
+    assert {setpoint for _, setpoint in thermal.schedule(_trusted(), 21.0, prices, [])} == {21.0}
+
+
+def test_simulated_house():
+    fixed = thermal.simulate(14, shift=False)
+    shifted = thermal.simulate(14, shift=True)
+    # The fit finds the coefficients of the house from its noisy sensor
+    assert shifted["loss"] == pytest.approx(shifted["true_loss"], rel=0.25)
+    assert shifted["pump"] == pytest.approx(shifted["true_pump"], rel=0.25)
+    # Shifting the load into cheap slots saves money without letting the house get cold
+    assert shifted["cost"] < 0.95 * fixed["cost"]
+    assert shifted["coldest"] > 21.0 - thermal.SETBACK - 1.0
@@ -0,0 +1,62 @@
+# Heat Automation; A program that selects the best heat source based on spot price and outdoor temperature
+# Copyright (C) 2025  Gabriel Blomgren Strandberg <gabriel.blomgren.strandberg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# test_tibber_live.py - The live measurement ring buffer, and the stream against the websocket stub.
+
+import time
+import pytest
+import stubs
+from heatautomation import tibber_live
+
+
+def test_oldest_samples_are_overwritten():
+    buffer = tibber_live.RingBuffer(capacity=4)
+    for i in range(6):
+        buffer.append(100.0 + i, 1000.0 * i)
+    assert len(buffer) == 4 and buffer.appended == 6
+    assert buffer.latest() == (105.0, 5000.0)
+    # The window reaches past the oldest sample kept, 102, so it starts there
+    assert buffer.mean(10, now=106.0) == pytest.approx((2000 + 3000 + 4000 + 5000) / 4)
+
+
+def test_mean_is_time_weighted():
+    buffer = tibber_live.RingBuffer(capacity=8)
+    buffer.append(0.0, 1000.0)
+    buffer.append(30.0, 2000.0)
+    assert buffer.mean(40, now=40.0) == pytest.approx((1000 * 30 + 2000 * 10) / 40)
+    assert buffer.mean(10, now=40.0) == pytest.approx(2000.0)
+    assert buffer.mean(5, now=100.0) is None  # No sample in the window
+
+
+def _wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+
+def test_stream_reconnects_after_a_dropped_connection(monkeypatch):
+    pytest.importorskip("websocket")
+    monkeypatch.setattr(tibber_live, "BACKOFF", 0.01)
+    with stubs.TibberLiveStub(rate=200, count=30, drop_after=10) as server:
+        client = tibber_live.LiveClient("home", "test", url=server.url, capacity=16).start()
+        try:
+            assert _wait_for(lambda: client.buffer.appended == 30)
+        finally:
+            client.stop()
+    assert server.connections == 2 and client.reconnects >= 1
+    assert len(client.buffer) == 16  # The oldest samples were overwritten
+    assert client.buffer.latest()[1] in (1500.0, 2000.0)